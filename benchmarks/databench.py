@@ -0,0 +1,95 @@
+"""Memory and construction cost of the event types in tomotoio.data, compared with
+equivalent plain classes that keep their attributes in a per-instance __dict__."""
+import argparse
+import sys
+import tracemalloc
+from timeit import Timer
+
+from tomotoio.data import *
+
+
+class DictPositionID:
+    def __init__(self, x, y, angle, sensorX, sensorY, sensorAngle):
+        self.type = ToioIDType.POSITION
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.sensorX = sensorX
+        self.sensorY = sensorY
+        self.sensorAngle = sensorAngle
+
+
+class DictMotion:
+    def __init__(self, isLevel, collision, doubleTap, orientation, shake):
+        self.isLevel = isLevel
+        self.collision = collision
+        self.doubleTap = doubleTap
+        self.orientation = orientation
+        self.shake = shake
+
+
+class DictMotorSpeed:
+    def __init__(self, ctrltype, left, right):
+        self.type = ctrltype
+        self.left = left
+        self.right = right
+
+
+class DictMagneticForce:
+    def __init__(self, status, strength, x, y, z):
+        self.status = status
+        self.strength = strength
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+CASES = [
+    ("PositionID", DictPositionID, PositionID, (709, 383, 306, 700, 386, 307)),
+    ("Motion", DictMotion, Motion, (True, False, False, Orientation.STRAIGHT_UP, 0)),
+    ("MotorSpeed", DictMotorSpeed, MotorSpeed, (0xe0, 50, 50)),
+    ("MagneticForce", DictMagneticForce, MagneticForce, (1, 16, 5, -5, 2)),
+]
+
+
+def instanceSize(obj) -> int:
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def allocatedPerEvent(cls, args, count: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    events = [cls(*args) for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    del events
+    return total / count
+
+
+def constructionsPerSecond(cls, args, number: int, repeat: int) -> float:
+    return number / min(Timer(lambda: cls(*args)).repeat(repeat, number))
+
+
+def run(count: int, number: int, repeat: int):
+    print("%-14s %10s %10s %12s %12s %14s %14s" %
+          ("event", "dict B", "slots B", "dict B/ev", "slots B/ev", "dict new/s", "slots new/s"))
+    for (name, dictClass, slotsClass, args) in CASES:
+        print("%-14s %10d %10d %12.1f %12.1f %14.0f %14.0f" % (
+            name,
+            instanceSize(dictClass(*args)), instanceSize(slotsClass(*args)),
+            allocatedPerEvent(dictClass, args, count), allocatedPerEvent(slotsClass, args, count),
+            constructionsPerSecond(dictClass, args, number, repeat),
+            constructionsPerSecond(slotsClass, args, number, repeat)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', dest='count', type=int, help="Events allocated to measure the memory", default=100000)
+    parser.add_argument('-n', dest='number', type=int, help="Constructions per measurement", default=100000)
+    parser.add_argument('-r', dest='repeat', type=int, help="Measurements per event type", default=5)
+    args = parser.parse_args()
+    run(args.count, args.number, args.repeat)
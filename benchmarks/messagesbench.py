@@ -0,0 +1,97 @@
+"""Micro-benchmark of the message decoders: the original unpack/if-chain decoders vs
+the codec registry, with and without a reusable DecodeBuffer."""
+import argparse
+from struct import unpack
+from timeit import Timer
+
+import tomotoio.messages as tm
+from tomotoio.data import *
+
+SAMPLES = {
+    "PositionID": ("toioID", bytes([0x01, 0xc5, 0x02, 0x7f, 0x01, 0x32, 0x01, 0xbc, 0x02, 0x82, 0x01, 0x33, 0x01])),
+    "StandardID": ("toioID", bytes([0x02, 0x00, 0x00, 0x38, 0x00, 0x15, 0x00])),
+    "MissedID": ("toioID", bytes([0x03])),
+    "Motion": ("motion", bytes([0x01, 0x01, 0x00, 0x01, 0x01, 0x00])),
+    "MagneticForce": ("motion", bytes([0x02, 0x01, 0x10, 0x05, 0xfb, 0x02])),
+    "TiltEuler": ("motion", bytes([0x03, 0x01, 0x0a, 0x00, 0xf6, 0xff, 0x5a, 0x00])),
+    "TiltQuaternion": ("motion", bytes([0x03, 0x02, 0x00, 0x40, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])),
+    "Motor": ("motor", bytes([0x83, 0x01, 0x00])),
+    "MotorSpeed": ("motor", bytes([0xe0, 0x32, 0x32])),
+}
+
+
+def legacyDecodeToioID(data: bytes):
+    if data[0] == 0x01:
+        (_, x, y, a, sx, sy, sa) = unpack("<BHHHHHH", data)
+        return PositionID(x, y, a, sx, sy, sa)
+    if data[0] == 0x02:
+        (_, value, angle) = unpack("<BIH", data)
+        return StandardID(value, angle)
+    if data[0] == 0x03:
+        return MissedID(ToioIDType.POSITION)
+    if data[0] == 0x04:
+        return MissedID(ToioIDType.STANDARD)
+    if data[0] == 0xff:
+        return MissedID(ToioIDType.INVALID)
+    raise ValueError(data)
+
+
+def legacyDecodeMotion(data: bytes):
+    if data[0] == 0x01:
+        if len(data) == 3:
+            (_, isLevel, collision) = unpack("<BBB", data)
+            return Motion(isLevel != 0, collision != 0, False, Orientation.INVALID, 0)
+        else:
+            (_, isLevel, collision, doubleTap, orientation, shake) = unpack("<BBBBBB", data)
+            return Motion(isLevel != 0, collision != 0, doubleTap != 0, Orientation(orientation), shake)
+    if data[0] == 0x02:
+        (_, status, strength, x, y, z) = unpack("<BBBbbb", data)
+        return MagneticForce(status, strength, x, y, z)
+    if data[0] == 0x03:
+        if data[1] == 0x01:
+            (_, angleType, roll, pitch, yaw) = unpack("<BBhhh", data)
+            return TiltEuler(roll, pitch, yaw)
+        if data[1] == 0x02:
+            (_, angleType, w, x, y, z) = unpack("<BBhhhh", data)
+            return TiltQuaternion(w, x, y, z)
+    raise ValueError(data)
+
+
+def legacyDecodeMotor(data: bytes):
+    if len(data) == 3:
+        if data[0] == MotorInfoType.SPEED:
+            return MotorSpeed(data[0], data[1], data[2])
+        else:
+            return Motor(data[0], data[1], data[2])
+    raise ValueError(data)
+
+
+DECODERS = {
+    "toioID": (legacyDecodeToioID, tm.decodeToioID, tm.decodeToioIDInto),
+    "motion": (legacyDecodeMotion, tm.decodeMotion, tm.decodeMotionInto),
+    "motor": (legacyDecodeMotor, tm.decodeMotor, tm.decodeMotorInto),
+}
+
+
+def measure(func, number: int, repeat: int) -> float:
+    """Returns the best throughput in decodes per second."""
+    return number / min(Timer(func).repeat(repeat, number))
+
+
+def run(number: int, repeat: int):
+    buffer = tm.DecodeBuffer()
+    print("%-16s %14s %14s %14s %8s" % ("message", "legacy/s", "codec/s", "into/s", "speedup"))
+    for (name, (kind, data)) in SAMPLES.items():
+        (legacy, decode, decodeInto) = DECODERS[kind]
+        old = measure(lambda: legacy(data), number, repeat)
+        new = measure(lambda: decode(data), number, repeat)
+        into = measure(lambda: decodeInto(data, buffer), number, repeat)
+        print("%-16s %14.0f %14.0f %14.0f %7.2fx" % (name, old, new, into, into / old))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='number', type=int, help="Decodes per measurement", default=100000)
+    parser.add_argument('-r', dest='repeat', type=int, help="Measurements per decoder", default=5)
+    args = parser.parse_args()
+    run(args.number, args.repeat)
@@ -0,0 +1,213 @@
+"""Headless benchmark suite of the hot paths: message codecs, notification dispatch,
+navigation commands and geo.Vector arithmetic.
+
+Every case reports operations (events) per second on a single thread. The results can be
+written as JSON and compared with a previous run to catch regressions between releases:
+
+    python benchmarks/suite.py -o current.json --compare baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+from timeit import Timer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import tomotoio.messages as tm
+from tomotoio.constants import CharacteristicID
+from tomotoio.cube import Cube, Peer
+from tomotoio.data import *
+from tomotoio.geo import Vector
+from tomotoio.navigator import CircleCommand, MoveCommand, Navigator, RotateCommand
+
+Case = Tuple[str, str, Callable[[], Any]]
+
+DECODE_SAMPLES = [
+    ("PositionID", tm.decodeToioID, bytes([0x01, 0xc5, 0x02, 0x7f, 0x01, 0x32, 0x01, 0xbc, 0x02, 0x82, 0x01, 0x33, 0x01])),
+    ("StandardID", tm.decodeToioID, bytes([0x02, 0x00, 0x00, 0x38, 0x00, 0x15, 0x00])),
+    ("MissedID", tm.decodeToioID, bytes([0x03])),
+    ("Motion", tm.decodeMotion, bytes([0x01, 0x01, 0x00, 0x01, 0x01, 0x00])),
+    ("MagneticForce", tm.decodeMotion, bytes([0x02, 0x01, 0x10, 0x05, 0xfb, 0x02])),
+    ("TiltEuler", tm.decodeMotion, bytes([0x03, 0x01, 0x0a, 0x00, 0xf6, 0xff, 0x5a, 0x00])),
+    ("TiltQuaternion", tm.decodeMotion, bytes([0x03, 0x02, 0x00, 0x40, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])),
+    ("Motor", tm.decodeMotor, bytes([0x83, 0x01, 0x00])),
+    ("MotorSpeed", tm.decodeMotor, bytes([0xe0, 0x32, 0x32])),
+    ("Button", tm.decodeButton, bytes([0x01, 0x80])),
+    ("Battery", tm.decodeBattery, bytes([0x50])),
+]
+
+ENCODE_SAMPLES = [
+    ("Motor", lambda: tm.encodeMotor(50, -50, 0.5)),
+    ("MotorTarget", lambda: tm.encodeMotorTarget(1, 300, 200, 5, 0, 80, 0, 0, 90)),
+    ("MotorMultipleTargets", lambda: tm.encodeMotorMultipleTargets(1, [Target(100, 100), Target(300, 300), Target(100, 300)])),
+    ("MotorAcceleration", lambda: tm.encodeMotorAcceleration(50, 15, 30, 0, 0, 0, 1)),
+    ("Light", lambda: tm.encodeLight(255, 0, 0, 1)),
+    ("LightPattern", lambda: tm.encodeLightPattern([Light(255, 0, 0, 0.5), Light(0, 255, 0, 0.5)], 3)),
+    ("Sound", lambda: tm.encodeSound(3)),
+    ("SoundByNotes", lambda: tm.encodeSoundByNotes([Note(60, 0.5), Note(64, 0.5), Note(67, 0.5)])),
+    ("ConfigToioIDNotify", lambda: tm.encodeConfigToioIDNotify(0.1, 0xff)),
+]
+
+DISPATCH_LISTENERS = [1, 4, 16, 64]
+
+POSITION = PositionID(150, 150, 30, 150, 150, 30)
+
+
+class NullPeer(Peer):
+    """Peer that discards the writes, so only the cost on the Python side is measured."""
+
+    def disconnect(self):
+        pass
+
+    def read(self, uuid) -> bytes:
+        return bytes(1)
+
+    def write(self, uuid, data: bytes, withResponse=False):
+        pass
+
+    def enableNotification(self, uuid, value: bool = True):
+        pass
+
+    def addListener(self, listener):
+        pass
+
+
+def codecCases() -> List[Case]:
+    cases: List[Case] = list()
+    for (name, decode, data) in DECODE_SAMPLES:
+        cases.append(("decode", name, lambda decode=decode, data=data: decode(data)))
+    for (name, encode) in ENCODE_SAMPLES:
+        cases.append(("encode", name, encode))
+    return cases
+
+
+def dispatchCases() -> List[Case]:
+    cases: List[Case] = list()
+    data = DECODE_SAMPLES[0][2]
+    for n in DISPATCH_LISTENERS:
+        cube = Cube(NullPeer(), "bench")
+        for _ in range(n):
+            cube.toioID.addListener(lambda e: None)
+        cases.append(("dispatch", "TOIO_ID x%d listeners" % n,
+                      lambda cube=cube: cube._handleNotification(CharacteristicID.TOIO_ID, data)))
+
+    # Typed listeners: a matching one, and one of another type which skips the decoding
+    for (name, eventType) in (("PositionID", PositionID), ("StandardID", StandardID)):
+        cube = Cube(NullPeer(), "bench")
+        cube.addEventListener(eventType, lambda e: None)
+        cases.append(("dispatch", "TOIO_ID %s listener" % name,
+                      lambda cube=cube: cube._handleNotification(CharacteristicID.TOIO_ID, data)))
+    return cases
+
+
+def navigationCases() -> List[Case]:
+    nav = Navigator(Cube(NullPeer(), "bench"))
+    # Targets far enough from POSITION that the commands never complete
+    commands = [
+        ("MoveCommand", MoveCommand(nav, 350, 300, 5)),
+        ("RotateCommand", RotateCommand(nav, 210, 1)),
+        ("CircleCommand", CircleCommand(nav, 250, 250, 100)),
+    ]
+    return [("navigation", name, lambda c=c: c.handleNotification(POSITION)) for (name, c) in commands]
+
+
+def vectorCases() -> List[Case]:
+    (a, b) = (Vector(120.0, 80.0), Vector(30.0, -45.0))
+    return [
+        ("vector", "add/sub", lambda: (a + b) - b),
+        ("vector", "mul", lambda: a * 1.5),
+        ("vector", "magnitude", lambda: a.magnitude()),
+        ("vector", "normalize", lambda: a.normalize()),
+        ("vector", "direction", lambda: a.direction()),
+        ("vector", "transform", lambda: a.transform((1, -0.5, 0.5, 1))),
+        ("vector", "from PositionID", lambda: Vector(POSITION)),
+    ]
+
+
+def allCases() -> List[Case]:
+    return codecCases() + dispatchCases() + navigationCases() + vectorCases()
+
+
+def measure(func: Callable[[], Any], repeat: int, minTime: float) -> Dict[str, float]:
+    timer = Timer(func)
+    (number, elapsed) = timer.autorange()
+    number = max(int(number * minTime / max(elapsed, 1e-9)), 1)
+    best = min(timer.repeat(repeat, number)) / number
+    return dict(opsPerSec=1 / best, nsPerOp=best * 1e9, number=number)
+
+
+def metadata() -> Dict[str, Any]:
+    try:
+        from importlib.metadata import version
+        packageVersion: Optional[str] = version("tomotoio")
+    except Exception:
+        packageVersion = None
+
+    return dict(
+        timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        tomotoio=packageVersion,
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        cpuCount=os.cpu_count(),
+    )
+
+
+def run(pattern: Optional[str], repeat: int, minTime: float) -> Dict[str, Any]:
+    results = list()
+    print("%-10s %-28s %14s %10s" % ("group", "case", "ops/s", "ns/op"))
+    for (group, name, func) in allCases():
+        if pattern and pattern.lower() not in ("%s/%s" % (group, name)).lower():
+            continue
+        r = measure(func, repeat, minTime)
+        results.append(dict(group=group, name=name, **r))
+        print("%-10s %-28s %14.0f %10.1f" % (group, name, r["opsPerSec"], r["nsPerOp"]))
+    return dict(meta=metadata(), results=results)
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Prints the ratio to the baseline for each case and returns the cases that regressed."""
+    base = {(r["group"], r["name"]): r["opsPerSec"] for r in baseline["results"]}
+    regressions = list()
+    print()
+    print("%-10s %-28s %8s" % ("group", "case", "ratio"))
+    for r in report["results"]:
+        key = (r["group"], r["name"])
+        if key not in base:
+            continue
+        ratio = r["opsPerSec"] / base[key]
+        flag = " REGRESSION" if ratio < 1 - tolerance else ""
+        print("%-10s %-28s %7.2fx%s" % (r["group"], r["name"], ratio, flag))
+        if flag:
+            regressions.append("%s/%s" % key)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', dest='pattern', help="Only run the cases whose group/name contains this")
+    parser.add_argument('-r', dest='repeat', type=int, help="Measurements per case", default=5)
+    parser.add_argument('-t', dest='minTime', type=float, help="Seconds per measurement", default=0.2)
+    parser.add_argument('-o', dest='output', help="Write the results to this JSON file")
+    parser.add_argument('--cpu', type=int, help="Pin the process to this CPU")
+    parser.add_argument('--compare', help="Compare with the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, help="Allowed slowdown against the baseline", default=0.1)
+    args = parser.parse_args()
+
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+
+    report = run(args.pattern, args.repeat, args.minTime)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressed: %s" % ", ".join(regressions))
+            sys.exit(1)
@@ -0,0 +1,36 @@
+import asyncio
+import logging as log
+
+from utils import createCubes, releaseCubes
+
+from tomotoio.asynccube import AsyncCube, AsyncNavigator
+from tomotoio.navigator import Mat
+
+mat = Mat()
+cubes = createCubes()
+
+
+async def patrol(cube: AsyncCube, offset: float):
+    nav = AsyncNavigator(cube)
+    (cx, cy) = (mat.center.x, mat.center.y)
+    corners = [(cx - 80, cy - 80), (cx + 80, cy - 80), (cx + 80, cy + 80), (cx - 80, cy + 80)]
+    for i in range(8):
+        (x, y) = corners[(i + int(offset)) % len(corners)]
+        try:
+            await nav.move(x, y, 10, timeout=10)
+        except asyncio.TimeoutError:
+            log.warning("%s did not reach (%d, %d)", cube.name, x, y)
+
+
+async def main():
+    asyncCubes = [AsyncCube(c) for c in cubes]
+    for c in asyncCubes:
+        log.info("%s: battery %d%%", c.name, await c.battery.get())
+    await asyncio.gather(*[patrol(c, i) for (i, c) in enumerate(asyncCubes)])
+
+
+try:
+    asyncio.run(main())
+
+finally:
+    releaseCubes(cubes)
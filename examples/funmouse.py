@@ -59,7 +59,8 @@ try:
 
     cube.toioID.addListener(positionListener)
     cube.toioID.enableNotification()
-    cube.motion.addListener(clickListener)
+    # Only Motion, not the posture and magnetic sensor events of the same characteristic
+    cube.addEventListener(Motion, clickListener)
     cube.motion.enableNotification()
 
     while True:
@@ -1,9 +1,6 @@
 import logging as log
-from datetime import datetime
-from functools import partial
-from time import sleep
 
-from utils import createCubes, releaseCubes, Cube
+from utils import createCubes, releaseCubes
 from utils import PostureType, NotifyType, TargetPointAngleType, MovementType, MotorInfoType, Target
 from tomotoio.navigator import Mat
 
@@ -17,36 +14,22 @@ goals = [Target(mat_cx, mat_cy, TargetPointAngleType.NO_ROTATION, 0),
             Target(mat_cx + 50, mat_cy +50, TargetPointAngleType.NO_ROTATION, 0),
             Target(mat_cx + 50, mat_cy -50, TargetPointAngleType.NO_ROTATION, 0),
             Target(mat_cx - 50, mat_cy -50, TargetPointAngleType.NO_ROTATION, 0)]
-index = 0
 
 cubes = createCubes()
 
 try:
-    def listener(cube: Cube, notificationType: str, e):
-        global index
-        # log.debug("%s, %s, %s, %s", datetime.now().isoformat(), cube.name, notificationType, e)
-        if e.type == MotorInfoType.WITH_MULTIPLE_TARGETS:
-            log.debug("setMotorWithMultipleTargets %s result %s", e.id, e.result)
-            # add next target position
-            if index < len(goals):
-                cube.setMotorWithMultipleTargets(index, [goals[index]], 30)
-                log.debug("add next target position %s: %s, %s", index, goals[index].x, goals[index].y)
-                index = index +1
-            else:
-                log.debug("core cube reached to final target.")
-
     cube = cubes[0]
-    cube.motor.addListener(partial(listener, cube, 'MotorNotify'))
-    cube.motor.enableNotification()
-
-    # First, add 2 target positions
-    cube.setMotorWithMultipleTargets(index, [goals[index]], 50)
-    index = index +1
-    cube.setMotorWithMultipleTargets(index, [goals[index]], 30)
-    index = index +1
 
-    while True:
-        sleep(1)
+    # Keep 2 target positions queued in the cube, adding the next one as each is reached
+    pending = [cube.setMotorWithMultipleTargets(None, [goals[0]], 50),
+               cube.setMotorWithMultipleTargets(None, [goals[1]], 30)]
+    for goal in goals[2:] + [None]:
+        result = pending.pop(0).result(30)
+        log.debug("setMotorWithMultipleTargets result %s", result)
+        if goal:
+            pending.append(cube.setMotorWithMultipleTargets(None, [goal], 30))
+            log.debug("add next target position: %s, %s", goal.x, goal.y)
+    log.debug("core cube reached to final target.")
 
 finally:
     releaseCubes(cubes)
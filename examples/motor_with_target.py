@@ -28,13 +28,14 @@ try:
 
     mat_cx = int(mat.center.x)
     mat_cy = int(mat.center.y)
-    cube.setMotorWithTarget(0, mat_cx, mat_cy, 50)
-    sleep(3)
+    # Wait for the response of the control
+    result = cube.setMotorWithTarget(None, mat_cx, mat_cy, 50).result(15)
+    log.debug("setMotorWithTarget result %s", result)
     # x, y, AngleType, deg  
     goals = [Target(mat_cx - 100, mat_cy -100, TargetPointAngleType.ABSOLUTE, 0), 
              Target(mat_cx - 100, mat_cy +100, TargetPointAngleType.ABSOLUTE, 90)]
 
-    cube.setMotorWithMultipleTargets(1, goals, 30)
+    cube.setMotorWithMultipleTargets(None, goals, 30)
     while True:
         sleep(1)
 
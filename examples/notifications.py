@@ -1,26 +1,23 @@
 import logging as log
 from datetime import datetime
-from functools import partial
-from time import sleep
 
-from utils import createCubes, releaseCubes, Cube
+from utils import createCubes, releaseCubes
+
+from tomotoio.constants import CharacteristicID
+from tomotoio.eventbus import createEventBus
 
 cubes = createCubes()
 
 try:
-    def listener(cube: Cube, notificationType: str, e):
-        log.debug("%s, %s, %s, %s", datetime.now().isoformat(), cube.name, notificationType, e)
-
+    bus = createEventBus(cubes)
     for cube in cubes:
-        cube.button.addListener(partial(listener, cube, 'button'))
         cube.button.enableNotification()
-        cube.motion.addListener(partial(listener, cube, 'motion'))
         cube.motion.enableNotification()
-        cube.toioID.addListener(partial(listener, cube, 'toioID'))
         cube.toioID.enableNotification()
 
-    while True:
-        sleep(1)
+    # A single consumer of the events of all the cubes
+    for e in bus.subscribe(characteristics=[CharacteristicID.BUTTON, CharacteristicID.MOTION, CharacteristicID.TOIO_ID]):
+        log.debug("%s, %s, %s, %s", datetime.now().isoformat(), e.cube.name, CharacteristicID(e.charId).name, e.event)
 
 finally:
     releaseCubes(cubes)
@@ -1,11 +1,12 @@
 import logging as log
 from enum import Enum
 from random import random
-from time import sleep, time
+from time import monotonic, sleep
 from typing import cast
 
 from tomotoio.data import Motion, Note, PositionID
 from tomotoio.geo import Vector
+from tomotoio.history import PoseHistory
 from tomotoio.navigator import NavigationCommandBase, RotateCommand
 from utils import createCubes, createNavigators, releaseCubes
 
@@ -31,15 +32,17 @@ class BallCommand(NavigationCommandBase):
         self.releaseTime = 0
 
     def handleNotification(self, e):
+        # Use the receive time of the notification so listener scheduling does not skew the speed
+        now = self.nav.lastTimestamp / 1e9
         if self.state == self.State.STANDBY:
             self.nav.cube.setMotor(0, 0)
             if isinstance(e, PositionID):
                 if self.positionBeforeKicked:
                     v = Vector(self.positionBeforeKicked[0], e)
-                    dt = time() - self.positionBeforeKicked[1]
+                    dt = now - self.positionBeforeKicked[1]
                     if dt > 0.2:
                         k = v.magnitude() / dt
-                        if k > 7 and time() - self.releaseTime > 0.2:
+                        if k > 7 and now - self.releaseTime > 0.2:
                             self.positionBeforeKicked = None
                             self.vector = v * (10 + 2 / dt)
                             self.rotateCommand = RotateCommand(self.nav, v.direction(), 10)
@@ -47,10 +50,10 @@ class BallCommand(NavigationCommandBase):
                             self.nav.cube.setMusic(BALL_KICKED_SOUND, 1)
                             log.debug("BALL: trans to ROTATE")
                         else:
-                            self.positionBeforeKicked = (e, time())
+                            self.positionBeforeKicked = (e, now)
                             self.collisionCount = 0
                 else:
-                    self.positionBeforeKicked = (e, time())
+                    self.positionBeforeKicked = (e, now)
                     self.collisionCount = 0
 
         elif self.state == self.State.ROTATE:
@@ -68,7 +71,7 @@ class BallCommand(NavigationCommandBase):
             if s < 8:
                 self.nav.cube.setMotor(0, 0)
                 self.state = self.State.STANDBY
-                self.releaseTime = time()
+                self.releaseTime = now
                 self.nav.cube.setMusic(BALL_STOP_SOUND, 1)
                 log.debug("BALL: trans to STANDBY")
 
@@ -80,7 +83,7 @@ navs = createNavigators(cubes)
 ball.setCommand(BallCommand(ball))
 
 try:
-    playerTrace = list()
+    playerTrace = PoseHistory(20)
     moveSound = 0
     while True:
         sleep(0.1)
@@ -99,17 +102,13 @@ try:
                     player.cube.setMusic(PLAYER_MOVE_SOUND[moveSound], 0)
                     moveSound = (moveSound + 1) % len(PLAYER_MOVE_SOUND)
 
-                    playerTrace.append(bp)
-                    if len(playerTrace) > 20:
-                        playerTrace = playerTrace[-20:]
-                        dx = max([p.x for p in playerTrace]) - min([p.x for p in playerTrace])
-                        dy = max([p.y for p in playerTrace]) - min([p.y for p in playerTrace])
-                        if dx < 5 and dy < 5:
-                            player.setCommand(None)
-                            player.cube.setMotor(-60, -60, 0.2)
-                            player.cube.setMusic(PLAYER_BACK_SOUND, 5)
-                            sleep(0.2)
-                            playerTrace = list()
+                    playerTrace.append(monotonic(), bp.x, bp.y, 0)
+                    if playerTrace.isStalled(5):
+                        player.setCommand(None)
+                        player.cube.setMotor(-60, -60, 0.2)
+                        player.cube.setMusic(PLAYER_BACK_SOUND, 5)
+                        sleep(0.2)
+                        playerTrace.clear()
 
             else:
                 if player.command and bpp.magnitude() < 40:
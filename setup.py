@@ -9,5 +9,6 @@ setuptools.setup(
     description="Playing with TOIO",
     packages=setuptools.find_packages(exclude=("examples")),
     python_requires='>3.6',
-    install_requires=['bluepy >= 1.3.0']
+    install_requires=['bluepy >= 1.3.0'],
+    extras_require={'analysis': ['numpy']}
 )
@@ -0,0 +1,48 @@
+import unittest
+
+import tomotoio.data as td
+import tomotoio.messages as tm
+
+try:
+    import numpy as np
+    import tomotoio.analysis as ta
+except ImportError:
+    np = None
+
+POSITION = bytes([0x01, 0xc5, 0x02, 0x7f, 0x01, 0x32, 0x01, 0xbc, 0x02, 0x82, 0x01, 0x33, 0x01])
+STANDARD = bytes([0x02, 0x00, 0x00, 0x38, 0x00, 0x15, 0x00])
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestAnalysis(unittest.TestCase):
+    def testDecodeToioIDArrayMatchesDecodeToioID(self):
+        a = ta.decodeToioIDArray([POSITION, STANDARD, bytes([0x03]), bytes([0x04]), bytes([0xff, 0x01, 0x02])],
+                                 [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(list(a['time']), [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(list(a['type']), [td.ToioIDType.POSITION.value, td.ToioIDType.STANDARD.value] +
+                         [td.ToioIDType.MISSED.value] * 3)
+
+        p = tm.decodeToioID(POSITION)
+        self.assertEqual((a[0]['x'], a[0]['y'], a[0]['angle'], a[0]['sensorX'], a[0]['sensorY'], a[0]['sensorAngle']),
+                         (p.x, p.y, p.angle, p.sensorX, p.sensorY, p.sensorAngle))
+        self.assertEqual((a[1]['value'], a[1]['angle'], a[1]['x']), (3670016, 21, 0))
+        self.assertEqual(list(a['fromType'][2:]), [td.ToioIDType.POSITION.value, td.ToioIDType.STANDARD.value,
+                                                  td.ToioIDType.INVALID.value])
+
+    def testDecodeToioIDArrayAcceptsMatrix(self):
+        matrix = np.frombuffer(POSITION * 3, np.uint8).reshape(3, 13)
+        a = ta.decodeToioIDArray(matrix)
+        self.assertEqual(list(a['x']), [709] * 3)
+        self.assertTrue(np.isnan(a['time']).all())
+
+    def testDecodeToioIDArrayMarksBrokenPayloadsInvalid(self):
+        a = ta.decodeToioIDArray([bytes([0x01, 0x01, 0x02]), bytes([0x07, 0x00])])
+        self.assertEqual(list(a['type']), [td.ToioIDType.INVALID.value] * 2)
+        self.assertEqual(list(a['x']), [0, 0])
+
+    def testDecodeToioIDArrayOfNothing(self):
+        self.assertEqual(len(ta.decodeToioIDArray([])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+
+from tomotoio.asynccube import AsyncCube, AsyncNavigator
+from tomotoio.cube import Cube
+from tomotoio.data import MotorResult, PositionID
+from tomotoio.simpeer import SimPeer
+
+
+class TestAsyncCube(unittest.TestCase):
+    def setUp(self):
+        self.peer = SimPeer(x=200, y=300, angle=0, seed=1)
+        self.cube = AsyncCube(Cube(self.peer, "sim"))
+        self.peer.start(timeScale=10)
+
+    def tearDown(self):
+        self.peer.stop()
+
+    def testGet(self):
+        self.assertEqual(asyncio.run(self.cube.battery.get()), 100)
+
+    def testStream(self):
+        async def firstPositions():
+            events = list()
+            async for e in self.cube.toioID.stream(types=(PositionID,)):
+                events.append(e)
+                if len(events) == 3:
+                    break
+            return events
+
+        self.cube.toioID.enableNotification()
+        events = asyncio.run(asyncio.wait_for(firstPositions(), 5))
+        self.assertEqual(len(events), 3)
+        self.assertTrue(all(isinstance(e, PositionID) for e in events))
+        self.assertEqual(self.cube.bus.subscriptions, [])
+        self.assertEqual(self.cube.bus.attachments, dict())
+
+    def testNothingPublishedWithoutStream(self):
+        self.assertEqual(self.cube.bus.attachments, dict())
+        self.assertEqual(self.cube.cube.envelopeListeners, [[] for _ in self.cube.cube.envelopeListeners])
+
+    def testAwaitableWrite(self):
+        asyncio.run(self.cube.setMotor(30, -30))
+        self.assertGreater(self.peer.left, 0)
+        self.assertLess(self.peer.right, 0)
+        # The other methods are those of the cube
+        self.assertIsInstance(self.cube.stats(), dict)
+
+    def testAwaitsTargetControl(self):
+        result = asyncio.run(asyncio.wait_for(self.cube.setMotorWithTarget(None, 230, 300, maxspeed=50), 20))
+        self.assertEqual(result, MotorResult.SUCCESS)
+        self.assertLess(abs(self.peer.x - 230), 15)
+
+    def testAclose(self):
+        asyncio.run(self.cube.aclose())
+        self.assertEqual(self.cube.bus.attachments, dict())
+
+    def testMoveCompletes(self):
+        nav = AsyncNavigator(self.cube)
+        asyncio.run(nav.move(260, 300, 10, timeout=20))
+        self.assertLess(abs(self.peer.x - 260), 15)
+
+    def testMoveTimesOutAndStops(self):
+        nav = AsyncNavigator(self.cube)
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(nav.move(400, 400, 5, timeout=0.05))
+        self.assertIsNone(nav.command)
+        self.assertEqual((self.peer.left, self.peer.right), (0, 0))
+
+    def testGetConfigProtocolVersion(self):
+        self.assertEqual(asyncio.run(self.cube.getConfigProtocolVersion()), "2.3.0")
+
+
+if __name__ == '__main__':
+    unittest.main()
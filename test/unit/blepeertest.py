@@ -0,0 +1,306 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Event
+from unittest.mock import patch
+
+from bluepy.btle import BTLEDisconnectError, BTLEException, BTLEGattError
+
+from tomotoio.blepeer import BlePeer, HelperReader
+from tomotoio.constants import CHARACTERISTIC_IDS, CharacteristicID, UUIDs
+from tomotoio.data import AdditionalWriteSettingType, Target
+from tomotoio.handlecache import HandleCache
+from tomotoio.messages import (encodeConfigProtocolVersionRequest, encodeConfigProtocolVersionResponse, encodeLight,
+                               encodeMotor, encodeMotorMultipleTargets)
+
+ADDRESS = "aa:bb:cc:dd:ee:ff"
+HANDLES = {uuid: 0x10 + 4 * int(charId) for (uuid, charId) in CHARACTERISTIC_IDS.items()}
+
+
+class FakeCharacteristic:
+    def __init__(self, uuid, handle: int):
+        self.uuid = uuid
+        self.handle = handle
+
+    def getHandle(self) -> int:
+        return self.handle
+
+
+class FakeHelper:
+    def __init__(self):
+        (r, self.sender) = os.pipe()
+        self.stdout = os.fdopen(r, "rb", buffering=0)
+
+
+class FakePeripheral:
+    """Peripheral whose helper output is a pipe the test writes the helper lines to."""
+
+    def __init__(self, address: str, addrType: str, iface: int):
+        self.addr = address
+        self.handles = dict(HANDLES)
+        self._helper = FakeHelper()
+        self.reads = list()
+        self.writes = list()
+        self.commands: Queue = Queue()
+        self.discoveries = 0
+        self.protocolVersion = "2.3.0"
+
+    def withDelegate(self, delegate):
+        return self
+
+    def getCharacteristics(self):
+        self.discoveries += 1
+        return [FakeCharacteristic(u, h) for (u, h) in self.handles.items()]
+
+    def readCharacteristic(self, handle: int) -> bytes:
+        if handle not in self.handles.values():
+            raise BTLEGattError("Invalid handle")
+        self.reads.append(handle)
+        if handle == self.handles[UUIDs.CONFIG] and self.writes[-1:] == [(handle, encodeConfigProtocolVersionRequest())]:
+            return encodeConfigProtocolVersionResponse(self.protocolVersion)
+        return bytes([handle])
+
+    def writeCharacteristic(self, handle: int, data: bytes, withResponse: bool = False):
+        # Only a write with response tells whether the handle exists
+        if withResponse and handle not in self.handles.values():
+            raise BTLEGattError("Invalid handle")
+        self.writes.append((handle, data))
+
+    def _writeCmd(self, cmd: str):
+        self.commands.put(cmd)
+
+    def disconnect(self):
+        self.exitHelper()
+
+    def sendLine(self, line: str):
+        os.write(self._helper.sender, line.encode())
+
+    def exitHelper(self):
+        if self._helper.sender is not None:
+            os.close(self._helper.sender)
+            self._helper.sender = None
+
+
+def createPeer(handleCache=None, protocolVersion: str = "2.3.0", handles=HANDLES) -> BlePeer:
+    def createPeripheral(*args) -> FakePeripheral:
+        peripheral = FakePeripheral(*args)
+        peripheral.protocolVersion = protocolVersion
+        peripheral.handles = dict(handles)
+        return peripheral
+
+    with patch("tomotoio.blepeer.Peripheral", createPeripheral):
+        return BlePeer(ADDRESS, handleCache=handleCache)
+
+
+class TestHelperReader(unittest.TestCase):
+    def setUp(self):
+        (r, self.sender) = os.pipe()
+        self.reader = HelperReader(os.fdopen(r, "rb", buffering=0))
+
+    def tearDown(self):
+        if self.sender is not None:
+            os.close(self.sender)
+        self.reader.close()
+
+    def testBuffersPartialLines(self):
+        os.write(self.sender, b"rsp=$ntfy\x1e")
+        self.assertTrue(self.reader.fill())
+        self.assertFalse(self.reader.hasLine())
+        os.write(self.sender, b"hnd=h10\n#comment\n")
+        self.assertTrue(self.reader.fill())
+        self.assertTrue(self.reader.hasLine())
+        self.assertEqual(self.reader.readline(), "rsp=$ntfy\x1ehnd=h10\n")
+        self.assertEqual(self.reader.readline(), "#comment\n")
+        self.assertFalse(self.reader.hasLine())
+
+    def testReadsUpToEndOfFile(self):
+        os.write(self.sender, b"rsp=$stat")
+        os.close(self.sender)
+        self.sender = None
+        self.assertEqual(self.reader.readline(), "rsp=$stat")
+        self.assertFalse(self.reader.fill())
+        self.assertTrue(self.reader.eof)
+        self.assertEqual(self.reader.readline(), "")
+
+
+class TestBlePeer(unittest.TestCase):
+    def setUp(self):
+        self.peer = createPeer()
+        self.peripheral: FakePeripheral = self.peer.peripheral
+
+    def tearDown(self):
+        self.peer.disconnect()
+        self.peer.helperReader.close()
+
+    def register(self):
+        # As enabling a notification does, without a queued write racing with the test
+        self.peer.reactor.register(self.peer)
+        self.peer.registered = True
+
+    def testDispatchesNotifiedLines(self):
+        received = list()
+        done = Event()
+
+        def listener(charId, data, timestamp, sequence):
+            received.append((charId, data, sequence))
+            if len(received) == 2:
+                done.set()
+
+        self.peer.addTimedListener(listener)
+        self.register()
+        toioID = HANDLES[UUIDs.TOIO_ID]
+        self.peripheral.sendLine("# ignored\nrsp=$ntfy\x1ehnd=h%x\x1ed=b0102\n" % toioID)
+        self.peripheral.sendLine("rsp=$ind\x1ehnd=h%x\x1ed=b03\nrsp=$ntfy\x1ehnd=h%x\x1ed=b04\n" % (toioID, 0x1000))
+        self.assertTrue(done.wait(1))
+        self.assertEqual(received, [(CharacteristicID.TOIO_ID, b"\x01\x02", 1), (CharacteristicID.TOIO_ID, b"\x03", 2)])
+        self.assertTrue(self.peer.registered)
+
+    def testQueuesEveryAddedTargetWrite(self):
+        motor = HANDLES[UUIDs.MOTOR]
+        writes = [encodeMotorMultipleTargets(1, [Target(100, 100)], AdditionalWriteSettingType.ADD),
+                  encodeMotorMultipleTargets(2, [Target(200, 200)], AdditionalWriteSettingType.ADD),
+                  encodeMotor(10, 10), encodeMotor(20, 20)]
+        for data in writes:
+            self.peer.writeQueue.put(motor, data)
+        self.peer.writeQueue.put(HANDLES[UUIDs.LIGHT], encodeLight(255, 0, 0))
+        self.peer.writeQueue.put(HANDLES[UUIDs.LIGHT], encodeLight(0, 255, 0))
+
+        sent = list()
+        try:
+            while True:
+                sent.append(self.peer.writeQueue.get()[:2])
+        except Empty:
+            pass
+        self.assertEqual(sent, [(motor, writes[0]), (motor, writes[1]), (motor, writes[3]),
+                                (HANDLES[UUIDs.LIGHT], encodeLight(0, 255, 0))])
+
+    def testDeliversNotificationsWhileReading(self):
+        received = list()
+        notified = Event()
+
+        def listener(charId, data, timestamp, sequence):
+            received.append(data)
+            notified.set()
+
+        self.peer.addTimedListener(listener)
+        self.register()
+        future = self.peer.readFuture(UUIDs.BATTERY)
+        self.assertEqual(self.peripheral.commands.get(timeout=1), "rd %X\n" % HANDLES[UUIDs.BATTERY])
+
+        # The reactor does not wait for the response of the read
+        self.peripheral.sendLine("rsp=$ntfy\x1ehnd=h%x\x1ed=b01\n" % HANDLES[UUIDs.TOIO_ID])
+        self.assertTrue(notified.wait(1))
+        self.assertFalse(future.done())
+
+        self.peripheral.sendLine("rsp=$rd\x1ed=b42\n")
+        self.assertEqual(future.result(1), b"\x42")
+        self.assertEqual(received, [b"\x01"])
+        self.assertEqual(self.peer.stats()["reads"]["count"], 1)
+
+    def testSendsOneOperationAtATime(self):
+        self.register()
+        motor = HANDLES[UUIDs.MOTOR]
+        self.peer._write(motor, encodeMotor(10, 10))
+        self.assertEqual(self.peripheral.commands.get(timeout=1), "wr %X %s\n" % (motor, encodeMotor(10, 10).hex()))
+        future = self.peer.readFuture(UUIDs.BATTERY)
+        self.peer._write(HANDLES[UUIDs.LIGHT], encodeLight(255, 0, 0), True)
+        with self.assertRaises(Empty):
+            self.peripheral.commands.get(timeout=0.05)
+
+        # Writes go ahead of the reads
+        self.peripheral.sendLine("rsp=$wr\n")
+        self.assertEqual(self.peripheral.commands.get(timeout=1),
+                         "wrr %X %s\n" % (HANDLES[UUIDs.LIGHT], encodeLight(255, 0, 0).hex()))
+        self.peripheral.sendLine("rsp=$wr\n")
+        self.assertEqual(self.peripheral.commands.get(timeout=1), "rd %X\n" % HANDLES[UUIDs.BATTERY])
+        self.peripheral.sendLine("rsp=$err\x1ecode=$comerr\n")
+        self.assertIsInstance(future.exception(1), BTLEException)
+        self.assertEqual(self.peer.traffic.failedReads, 1)
+
+    def testDisconnectFailsQueuedReads(self):
+        self.register()
+
+        future: Future = Future()
+        self.peer.readQueue.put((0x10, future))
+        self.peripheral.sendLine("rsp=$stat\x1estate=$disc\n")
+        self.assertIsInstance(future.exception(1), BTLEDisconnectError)
+        self.assertFalse(self.peer.registered)
+        self.assertNotIn(self.peer, self.peer.reactor.peers.values())
+
+        # Reads no longer wait for the reactor
+        self.assertEqual(self.peer._read(0x14), bytes([0x14]))
+
+    def testHelperExitFailsQueuedReads(self):
+        self.register()
+        future: Future = Future()
+        self.peer.readQueue.put((0x10, future))
+        self.peripheral.exitHelper()
+        self.assertIsInstance(future.exception(1), BTLEDisconnectError)
+        self.assertFalse(self.peer.registered)
+
+
+class TestBlePeerHandleCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = HandleCache(os.path.join(self.dir.name, "handles.json"))
+        self.cache.put(ADDRESS, {str(u): h for (u, h) in HANDLES.items()}, "2.3.0")
+        self.peer = None
+
+    def tearDown(self):
+        if self.peer:
+            self.peer.disconnect()
+            self.peer.helperReader.close()
+        self.dir.cleanup()
+
+    def connect(self, **kwargs) -> FakePeripheral:
+        self.peer = createPeer(self.cache, **kwargs)
+        return self.peer.peripheral
+
+    def testLoadsCachedHandles(self):
+        peripheral = self.connect()
+        self.assertTrue(self.peer.usingCachedHandles)
+        self.assertEqual(peripheral.discoveries, 0)
+        # Checked through the cached handles right after connecting
+        self.assertEqual(peripheral.writes, [(HANDLES[UUIDs.CONFIG], encodeConfigProtocolVersionRequest())])
+
+    def testRediscoversStaleHandlesOnConnect(self):
+        # Handles of a firmware that moved every characteristic by one
+        peripheral = self.connect(handles={u: h + 1 for (u, h) in HANDLES.items()})
+        self.assertEqual(peripheral.discoveries, 1)
+        self.assertFalse(self.peer.usingCachedHandles)
+        self.assertEqual(self.peer.uuidHandleMap[UUIDs.MOTOR], HANDLES[UUIDs.MOTOR] + 1)
+        self.assertEqual(self.cache.get(ADDRESS)[str(UUIDs.MOTOR)], HANDLES[UUIDs.MOTOR] + 1)
+        self.assertTrue(self.cache.matchesVersion(ADDRESS, "2.3.0"))
+
+    def testRediscoversOnProtocolVersionChange(self):
+        peripheral = self.connect(protocolVersion="2.4.0")
+        self.assertEqual(peripheral.discoveries, 1)
+        self.assertTrue(self.cache.matchesVersion(ADDRESS, "2.4.0"))
+
+        self.peer.setProtocolVersion("2.4.0")
+        self.assertEqual(peripheral.discoveries, 1)
+
+    def testRediscoversHandlesOfUnknownVersion(self):
+        self.cache.put(ADDRESS, {str(u): h for (u, h) in HANDLES.items()})
+        peripheral = self.connect()
+        self.assertEqual(peripheral.discoveries, 1)
+        self.assertTrue(self.cache.matchesVersion(ADDRESS, "2.3.0"))
+
+    def testRefreshesStaleHandlesOnGattError(self):
+        peripheral = self.connect()
+        peripheral.handles = {u: h + 1 for (u, h) in HANDLES.items()}
+        self.assertEqual(self.peer.read(UUIDs.BATTERY), bytes([HANDLES[UUIDs.BATTERY] + 1]))
+        self.assertEqual(peripheral.discoveries, 1)
+        self.assertFalse(self.peer.usingCachedHandles)
+        self.assertEqual(self.cache.get(ADDRESS)[str(UUIDs.BATTERY)], HANDLES[UUIDs.BATTERY] + 1)
+
+        # Handles that are not stale are not rediscovered
+        with self.assertRaises(BTLEGattError):
+            self.peer._read(0x1000)
+        self.assertEqual(peripheral.discoveries, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
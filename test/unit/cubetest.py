@@ -0,0 +1,113 @@
+import unittest
+
+from tomotoio.cube import Cube
+from tomotoio.constants import CharacteristicID
+from tomotoio.data import Envelope, MissedID, Motion, MotorInfoType, MotorSpeed, PositionID, StandardID
+from tomotoio.messages import encodeMotorResponse, encodeMotorSpeed, encodePositionID, encodeStandardID
+from tomotoio.simpeer import SimPeer
+
+
+class CountingPeer(SimPeer):
+    def __init__(self):
+        super().__init__(x=200, y=300, seed=1)
+        self.readCount = 0
+
+    def read(self, uuid):
+        self.readCount += 1
+        return super().read(uuid)
+
+
+class TestCube(unittest.TestCase):
+    def setUp(self):
+        self.peer = CountingPeer()
+        self.cube = Cube(self.peer, "sim")
+
+    def testGetReadsByDefault(self):
+        self.cube.toioID.enableNotification()
+        self.peer.run(0.05)
+        self.cube.toioID.get()
+        self.cube.toioID.get()
+        self.assertEqual(self.peer.readCount, 2)
+
+    def testGetServesFreshNotification(self):
+        self.assertIsNone(self.cube.toioID.age())
+        self.cube.toioID.enableNotification()
+        self.peer.run(0.05)
+        e = self.cube.toioID.get(maxAge=1)
+        self.assertIsInstance(e, PositionID)
+        self.assertEqual((e.x, e.y), (200, 300))
+        self.assertEqual(self.peer.readCount, 0)
+        self.assertLess(self.cube.toioID.age(), 1)
+
+    def testGetReadsWhenStale(self):
+        self.cube.battery.get(maxAge=10)
+        self.cube.battery.get(maxAge=10)
+        self.assertEqual(self.peer.readCount, 1)
+        self.cube.battery.get(maxAge=0)
+        self.assertEqual(self.peer.readCount, 2)
+
+    def testGetServesOnlyTheTypeReadReturns(self):
+        self.cube._handleNotification(CharacteristicID.MOTOR, encodeMotorResponse(MotorInfoType.WITH_TARGET, 1, 0))
+        self.assertIsInstance(self.cube.motor.get(maxAge=1), MotorSpeed)
+        self.assertEqual(self.peer.readCount, 1)
+
+        self.cube._handleNotification(CharacteristicID.MOTOR, encodeMotorSpeed(10, 20))
+        self.cube._handleNotification(CharacteristicID.MOTOR, encodeMotorResponse(MotorInfoType.WITH_TARGET, 2, 0))
+        e = self.cube.motor.get(maxAge=1)
+        self.assertIsInstance(e, MotorSpeed)
+        self.assertEqual((e.left, e.right), (10, 20))
+        self.assertEqual(self.peer.readCount, 1)
+
+    def testEnvelopeCarriesTimestampAndSequence(self):
+        envelopes = list()
+        events = list()
+        self.cube.toioID.addListener(envelopes.append, envelope=True)
+        self.cube.toioID.addListener(events.append)
+        self.cube.toioID.enableNotification()
+        self.peer.run(0.05)
+        self.assertEqual(len(envelopes), len(events))
+        self.assertIsInstance(envelopes[0], Envelope)
+        self.assertIsInstance(envelopes[0].event, PositionID)
+        self.assertEqual([e.sequence for e in envelopes], list(range(1, len(envelopes) + 1)))
+        self.assertEqual(envelopes[-1].timestamp, self.peer.now())
+        self.assertTrue(all(a.timestamp < b.timestamp for (a, b) in zip(envelopes, envelopes[1:])))
+
+    def testEventListenersReceiveOnlyTheirType(self):
+        positions = list()
+        missed = list()
+        self.cube.addEventListener(PositionID, positions.append)
+        self.cube.addEventListener(MissedID, missed.append, envelope=True)
+        self.cube.toioID.enableNotification()
+        self.peer.run(0.05)
+        self.peer.setPose(-100, -100, 0)
+        self.peer.run(0.05)
+        self.assertGreater(len(positions), 0)
+        self.assertTrue(all(isinstance(e, PositionID) for e in positions))
+        self.assertEqual(len(missed), 1)
+        self.assertIsInstance(missed[0].event, MissedID)
+
+        self.cube.removeEventListener(PositionID, positions.append)
+        count = len(positions)
+        self.peer.setPose(200, 300, 0)
+        self.peer.run(0.05)
+        self.assertEqual(len(positions), count)
+
+    def testSkipsDecodingWithoutListeners(self):
+        decoded = list()
+        self.cube.decoders[0] = lambda data: decoded.append(data)
+        self.cube.addEventListener(StandardID, lambda e: None)
+        self.cube._handleNotification(0, encodePositionID(1, 2, 3))
+        self.assertEqual(decoded, [])
+        self.assertIsNotNone(self.cube.lastValues[0])
+        self.cube._handleNotification(0, encodeStandardID(1, 2))
+        self.assertEqual(len(decoded), 1)
+
+    def testEventListenerOfUnknownType(self):
+        with self.assertRaises(ValueError):
+            self.cube.addEventListener(bool, lambda e: None)
+        self.cube.addEventListener(Motion, lambda e: None)
+        self.cube.addEventListener(MotorSpeed, lambda e: None)
+
+
+if __name__ == '__main__':
+    unittest.main()
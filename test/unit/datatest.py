@@ -0,0 +1,38 @@
+import unittest
+
+import tomotoio.data as td
+
+
+class TestData(unittest.TestCase):
+    def testEventsHaveNoInstanceDict(self):
+        events = [td.PositionID(1, 2, 3, 4, 5, 6), td.StandardID(1, 2), td.MissedID(td.ToioIDType.POSITION),
+                  td.Motion(True, False, False, td.Orientation.INVALID, 0), td.Motor(0x83, 1, 0),
+                  td.MotorSpeed(0xe0, 1, 2), td.TiltEuler(1, 2, 3), td.TiltQuaternion(1, 2, 3, 4),
+                  td.MagneticForce(1, 2, 3, 4, 5)]
+        for e in events:
+            self.assertFalse(hasattr(e, '__dict__'), type(e).__name__)
+
+    def testToioIDType(self):
+        self.assertTrue(td.PositionID(1, 2, 3, 4, 5, 6).isPosition())
+        self.assertTrue(td.StandardID(1, 2).isStandard())
+        self.assertTrue(td.MissedID(td.ToioIDType.STANDARD).isMissed())
+        self.assertFalse(td.PositionID(1, 2, 3, 4, 5, 6).isMissed())
+
+    def testToioIDTypeArgument(self):
+        self.assertEqual(td.ToioID(td.ToioIDType.INVALID).type, td.ToioIDType.INVALID)
+        self.assertRaises(ValueError, td.ToioID, td.ToioIDType.POSITION)
+
+        class CustomID(td.ToioID):
+            def __init__(self):
+                super().__init__(td.ToioIDType.STANDARD)
+
+        self.assertTrue(CustomID().isStandard())
+        self.assertEqual(td.ToioID.type, td.ToioIDType.INVALID)
+
+    def testStr(self):
+        self.assertEqual(str(td.StandardID(5, 6)), str({'type': td.ToioIDType.STANDARD, 'value': 5, 'angle': 6}))
+        self.assertEqual(str(td.MotorSpeed(0xe0, 1, 2)), str({'type': 0xe0, 'left': 1, 'right': 2}))
+
+
+if __name__ == '__main__':
+    unittest.main()
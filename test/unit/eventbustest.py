@@ -0,0 +1,113 @@
+import asyncio
+import unittest
+from threading import Thread
+
+from tomotoio.constants import CharacteristicID
+from tomotoio.cube import Cube
+from tomotoio.data import PositionID
+from tomotoio.eventbus import FleetEvent, createEventBus
+from tomotoio.simpeer import SimPeer
+
+
+class TestEventBus(unittest.TestCase):
+    def setUp(self):
+        self.peers = [SimPeer(x=100 + 100 * i, y=200, seed=i) for i in range(2)]
+        self.cubes = [Cube(p, "Cube #%d" % (i + 1)) for (i, p) in enumerate(self.peers)]
+        self.positions = list()
+        for c in self.cubes:
+            c.toioID.enableNotification()
+            c.button.enableNotification()
+            c.toioID.addListener(self.positions.append)
+        self.bus = createEventBus(self.cubes)
+
+    def simulate(self, seconds: float):
+        for _ in range(int(seconds / 0.005)):
+            for p in self.peers:
+                p.step()
+
+    def testFleetEventStr(self):
+        e = FleetEvent(self.cubes[0], CharacteristicID.BUTTON, 1, 42, 7)
+        self.assertEqual(str(e), str(dict(cube="Cube #1", charId="BUTTON", event=1, timestamp=42, sequence=7)))
+
+    def testMergesAllCubes(self):
+        s = self.bus.subscribe()
+        self.simulate(0.1)
+        self.peers[1].setButton(True)
+        self.peers[1].step()
+        s.close()
+        events = list(s)
+        self.assertEqual(set(e.cube.name for e in events), {"Cube #1", "Cube #2"})
+        self.assertTrue(all(a.timestamp <= b.timestamp for (a, b) in zip(events, events[1:])))
+        buttons = [e for e in events if e.charId == CharacteristicID.BUTTON]
+        self.assertEqual(len(buttons), 1)
+        self.assertIs(buttons[0].cube, self.cubes[1])
+        self.assertEqual(len(events), len(self.positions) + 1)
+
+    def testFilters(self):
+        byCube = self.bus.subscribe(cubes=["Cube #2"])
+        byType = self.bus.subscribe(types=(PositionID,))
+        byCharacteristic = self.bus.subscribe(characteristics=[CharacteristicID.BUTTON])
+        self.simulate(0.1)
+        self.peers[0].setButton(True)
+        self.peers[0].setPose(-100, -100, 0)
+        self.simulate(0.1)
+        for s in (byCube, byType, byCharacteristic):
+            s.close()
+
+        self.assertTrue(all(e.cube is self.cubes[1] for e in byCube))
+        self.assertTrue(all(isinstance(e.event, PositionID) for e in byType))
+        self.assertEqual([e.event for e in byCharacteristic], [True])
+
+    def testCallback(self):
+        events = list()
+        s = self.bus.subscribe(types=(PositionID,), callback=events.append)
+        self.simulate(0.1)
+        s.close()
+        self.assertEqual(len(events), len(self.positions))
+
+    def testDropsOldest(self):
+        s = self.bus.subscribe(capacity=4)
+        self.simulate(0.1)
+        s.close()
+        self.assertEqual(len(list(s)), 4)
+        self.assertEqual(s.droppedCount, len(self.positions) - 4)
+
+    def testAsyncIteration(self):
+        async def consume():
+            s = self.bus.subscribe(cubes=[self.cubes[0]])
+            t = Thread(target=lambda: (self.simulate(0.1), s.close()))
+            t.start()
+            events = [e async for e in s]
+            t.join()
+            return events
+
+        events = asyncio.run(consume())
+        self.assertGreater(len(events), 5)
+        self.assertEqual([e.sequence for e in events], list(range(1, len(events) + 1)))
+
+    def testTimedOutAsyncConsumer(self):
+        s = self.bus.subscribe()
+        other = self.bus.subscribe()
+
+        async def timeOut():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(s.__anext__(), 0.05)
+
+        asyncio.run(timeOut())
+        self.assertEqual(s.waiters, [])
+        self.simulate(0.1)
+        s.close()
+        other.close()
+        self.assertEqual(len(list(s)), len(self.positions))
+        self.assertEqual(len(list(other)), len(self.positions))
+
+    def testDetach(self):
+        s = self.bus.subscribe()
+        self.bus.detach(self.cubes[0])
+        self.simulate(0.1)
+        s.close()
+        self.assertTrue(all(e.cube is self.cubes[1] for e in s))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import time
+import unittest
+from threading import Event
+
+from tomotoio.constants import CharacteristicID
+from tomotoio.cube import Cube
+from tomotoio.data import MotorInfoType
+from tomotoio.eventqueue import EventQueue, OverflowPolicy
+from tomotoio.simpeer import SimPeer
+
+
+class TestEventQueue(unittest.TestCase):
+    def setUp(self):
+        self.handled = list()
+        self.release = Event()
+
+    def handler(self, charId, data, timestamp, sequence):
+        self.release.wait()
+        self.handled.append((charId, sequence))
+
+    def testDropOldest(self):
+        q = EventQueue(self.handler, capacity=3)
+        for i in range(1, 6):
+            q.put(CharacteristicID.TOIO_ID, b"", i, i)
+        q.start()
+        self.release.set()
+        q.stop()
+        self.assertEqual(self.handled, [(CharacteristicID.TOIO_ID, i) for i in (3, 4, 5)])
+        self.assertEqual(q.stats()['dropped'], dict(TOIO_ID=2))
+
+    def testDropNew(self):
+        q = EventQueue(self.handler, capacity=3, defaultPolicy=OverflowPolicy.DROP_NEW)
+        for i in range(1, 6):
+            q.put(CharacteristicID.TOIO_ID, b"", i, i)
+        q.start()
+        self.release.set()
+        q.stop()
+        self.assertEqual([s for (_, s) in self.handled], [1, 2, 3])
+
+    def testNeverDropAndOrderAcrossCharacteristics(self):
+        q = EventQueue(self.handler, capacity=2)
+        expected = list()
+        for i in range(1, 6):
+            for c in (CharacteristicID.TOIO_ID, CharacteristicID.BUTTON):
+                q.put(c, b"", i, i)
+                expected.append((c, i))
+        q.start()
+        self.release.set()
+        q.stop()
+        # Only the last two positions are kept, and every button is
+        self.assertEqual(self.handled, [e for e in expected if e[0] == CharacteristicID.BUTTON or e[1] > 3])
+
+    def testMotorSpeedDoesNotGrowMotorLane(self):
+        q = EventQueue(self.handler, capacity=2)
+        speed = bytes([MotorInfoType.SPEED, 0, 0])
+        response = bytes([MotorInfoType.WITH_TARGET, 0, 0])
+        for i in range(1, 6):
+            q.put(CharacteristicID.MOTOR, speed, i, i)
+        for i in range(6, 9):
+            q.put(CharacteristicID.MOTOR, response, i, i)
+        self.assertEqual(len(q), 5)
+        q.start()
+        self.release.set()
+        q.stop()
+        # Only the last two speeds are kept, and every response is
+        self.assertEqual([s for (_, s) in self.handled], [4, 5, 6, 7, 8])
+        self.assertEqual(q.stats()['dropped'], dict(MOTOR=3))
+
+    def testPutDoesNotWaitForHandler(self):
+        q = EventQueue(self.handler, capacity=10)
+        q.start()
+        startTime = time.monotonic()
+        for i in range(1000):
+            q.put(CharacteristicID.TOIO_ID, b"", i, i)
+        self.assertLess(time.monotonic() - startTime, 0.5)
+        self.release.set()
+        q.stop()
+        self.assertLessEqual(len(self.handled), 11)
+        self.assertEqual(self.handled[-1], (CharacteristicID.TOIO_ID, 999))
+
+    def testStopWithoutDrain(self):
+        q = EventQueue(self.handler)
+        for i in range(5):
+            q.put(CharacteristicID.BUTTON, b"", i, i)
+        self.release.set()
+        q.start()
+        q.stop(drain=False)
+        self.assertEqual(len(self.handled) + q.stats()['dropped'].get('BUTTON', 0), 5)
+        self.assertEqual(len(q), 0)
+
+
+class TestCubeEventQueues(unittest.TestCase):
+    def testSlowListenerDoesNotStallReception(self):
+        peer = SimPeer(x=200, y=300, positionInterval=0.01)
+        cube = Cube(peer, "sim")
+        cube.startEventQueues(capacity=4)
+        events = list()
+
+        def slowListener(e):
+            time.sleep(0.01)
+            events.append(e)
+
+        cube.toioID.addListener(slowListener, envelope=True)
+        cube.toioID.enableNotification()
+        startTime = time.monotonic()
+        peer.run(1)
+        self.assertLess(time.monotonic() - startTime, 0.5)
+        self.assertIsNotNone(cube.toioID.age())
+        cube.stopEventQueues()
+
+        self.assertLess(len(events), 100)
+        self.assertEqual(events[-1].timestamp, cube.lastValues[CharacteristicID.TOIO_ID][1])
+        self.assertTrue(all(a.sequence < b.sequence for (a, b) in zip(events, events[1:])))
+        self.assertGreater(cube.stats()['listeners']['TOIO_ID']['count'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
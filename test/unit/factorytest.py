@@ -0,0 +1,78 @@
+import unittest
+from concurrent.futures import TimeoutError
+from threading import Event, Lock, Timer
+from typing import Dict, List
+
+from tomotoio.factory import connectCubes
+from tomotoio.simpeer import SimPeer
+
+
+class FakePeerFactory:
+    """Creates SimPeers, after failing or hanging as scripted for each address."""
+
+    def __init__(self, script: Dict[str, List[str]]):
+        self.script = script
+        self.lock = Lock()
+        self.attempts: Dict[str, int] = dict()
+        self.active: Dict[str, int] = dict()
+        self.maxActive: Dict[str, int] = dict()
+        self.release = Event()
+
+    def __call__(self, address: str, iface: int, reactor=None, handleCache=None) -> SimPeer:
+        with self.lock:
+            outcomes = self.script.get(address, [])
+            n = self.attempts.get(address, 0)
+            self.attempts[address] = n + 1
+            self.active[address] = self.active.get(address, 0) + 1
+            self.maxActive[address] = max(self.maxActive.get(address, 0), self.active[address])
+        try:
+            outcome = outcomes[n] if n < len(outcomes) else "ok"
+            if outcome == "fail":
+                raise ConnectionError("Failed to connect to %s" % address)
+            if outcome == "hang":
+                self.release.wait()
+            peer = SimPeer()
+            peer.timings = dict(connect=0.0, discovery=0.0)
+            return peer
+        finally:
+            with self.lock:
+                self.active[address] -= 1
+
+
+class TestConnectCubes(unittest.TestCase):
+    def testConnectsInOrder(self):
+        factory = FakePeerFactory(dict())
+        result = connectCubes(["a", "b", "c"], peerFactory=factory)
+        self.assertEqual([c.name for c in result.cubes], ["Cube #1", "Cube #2", "Cube #3"])
+        self.assertEqual(result.failed(), [])
+        self.assertEqual(result.errors, dict())
+        self.assertEqual(result.timings["b"]["attempts"], 1)
+
+    def testRetriesWithBackoff(self):
+        factory = FakePeerFactory(dict(a=["fail", "fail"], b=["fail", "fail", "fail"]))
+        result = connectCubes(["a", "b"], retries=2, backoff=0.001, peerFactory=factory)
+        self.assertEqual(result.failed(), ["b"])
+        self.assertEqual(len(result.succeeded()), 1)
+        self.assertEqual(result.timings["a"]["attempts"], 3)
+        self.assertEqual(result.timings["b"]["attempts"], 3)
+        self.assertIsInstance(result.errors["b"], ConnectionError)
+        self.assertNotIn("a", result.errors)
+
+    def testTimeout(self):
+        factory = FakePeerFactory(dict(a=["hang"]))
+        result = connectCubes(["a", "b"], timeout=0.05, peerFactory=factory)
+        self.assertEqual(result.failed(), ["a"])
+        self.assertIsInstance(result.errors["a"], TimeoutError)
+        factory.release.set()
+
+    def testRetryWaitsForAbandonedAttempt(self):
+        factory = FakePeerFactory(dict(a=["hang"]))
+        Timer(0.2, factory.release.set).start()
+        result = connectCubes(["a"], timeout=0.05, retries=1, backoff=0, peerFactory=factory)
+        self.assertEqual(result.failed(), [])
+        self.assertEqual(factory.attempts["a"], 2)
+        self.assertEqual(factory.maxActive["a"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from tomotoio.handlecache import HandleCache
+
+ADDRESS = "D0:8B:7F:12:34:56"
+HANDLES = {"10b20101-5b3b-4571-9508-cf3efcd7bbae": 13, "10b20102-5b3b-4571-9508-cf3efcd7bbae": 17}
+
+
+class TestHandleCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "sub", "handles.json")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testPersistsHandlesByAddress(self):
+        HandleCache(self.path).put(ADDRESS, HANDLES)
+        cache = HandleCache(self.path)
+        self.assertEqual(cache.get(ADDRESS), HANDLES)
+        self.assertEqual(cache.get(ADDRESS.lower()), HANDLES)
+        self.assertIsNone(cache.get("D0:8B:7F:00:00:00"))
+
+    def testMatchesVersion(self):
+        cache = HandleCache(self.path)
+        cache.put(ADDRESS, HANDLES)
+        # Handles of an unknown version are not trusted
+        self.assertFalse(cache.matchesVersion(ADDRESS, "2.3.0"))
+        cache.put(ADDRESS, HANDLES, "2.3.0")
+        self.assertTrue(cache.matchesVersion(ADDRESS, "2.3.0"))
+        self.assertFalse(cache.matchesVersion(ADDRESS, "2.4.0"))
+
+    def testInvalidate(self):
+        cache = HandleCache(self.path)
+        cache.put(ADDRESS, HANDLES)
+        cache.invalidate(ADDRESS)
+        self.assertIsNone(HandleCache(self.path).get(ADDRESS))
+
+    def testIgnoresBrokenFile(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write("{broken")
+        self.assertIsNone(HandleCache(self.path).get(ADDRESS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import random
+import unittest
+
+from tomotoio.history import PoseHistory, SlidingExtremum
+
+
+class TestHistory(unittest.TestCase):
+    def testSlidingExtremumMatchesBruteForce(self):
+        rng = random.Random(1)
+        values = [rng.uniform(0, 100) for _ in range(200)]
+        (lo, hi) = (SlidingExtremum(7, False), SlidingExtremum(7, True))
+        for (i, v) in enumerate(values):
+            lo.push(v)
+            hi.push(v)
+            window = values[max(i - 6, 0):i + 1]
+            self.assertEqual(lo.value(), min(window))
+            self.assertEqual(hi.value(), max(window))
+
+    def testKeepsLatestPoses(self):
+        h = PoseHistory(4)
+        self.assertIsNone(h.latest())
+        for i in range(6):
+            h.append(i * 0.1, i, 2 * i, 10 * i)
+        self.assertEqual(len(h), 4)
+        self.assertEqual(h[0], (0.2, 2, 4, 20))
+        self.assertEqual(h.latest(), (0.5, 5, 10, 50))
+        self.assertRaises(IndexError, lambda: h[4])
+
+    def testEstimatesVelocityAndAcceleration(self):
+        h = PoseHistory(64)
+        for i in range(30):
+            t = i * 0.01
+            h.append(t, 100 + 50 * t, 200 - 20 * t + 100 * t * t, (350 + 90 * t) % 360)
+        (vx, vy, va) = h.velocity(0.05)
+        self.assertAlmostEqual(vx, 50, 6)
+        self.assertAlmostEqual(va, 90, 6)
+        self.assertAlmostEqual(vy, -20 + 200 * 0.265, 0)
+        (ax, ay) = h.acceleration(0.2)
+        self.assertAlmostEqual(ax, 0, 6)
+        self.assertAlmostEqual(ay, 200, 6)
+
+    def testVelocityNeedsTwoPoses(self):
+        h = PoseHistory()
+        self.assertIsNone(h.velocity())
+        h.append(0, 1, 1, 0)
+        self.assertIsNone(h.velocity())
+
+    def testDetectsStall(self):
+        h = PoseHistory(64, 5)
+        for i in range(4):
+            h.append(i, 100 + i, 100, 0)
+        self.assertFalse(h.isStalled(5))
+        h.append(4, 100, 100, 0)
+        self.assertTrue(h.isStalled(5))
+        h.append(5, 120, 100, 0)
+        self.assertFalse(h.isStalled(5))
+        self.assertEqual(h.extent(), (20, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
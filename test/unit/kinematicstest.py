@@ -0,0 +1,29 @@
+import unittest
+
+from tomotoio.kinematics import AXLE_TRACK_UNITS, advancePose
+
+
+class TestKinematics(unittest.TestCase):
+    def testStraight(self):
+        (x, y, a) = advancePose(100, 100, 90, 20, 20, 0.5)
+        self.assertAlmostEqual(x, 100)
+        self.assertAlmostEqual(y, 110)
+        self.assertAlmostEqual(a, 90)
+
+    def testSpinsClockwiseWithFasterLeftWheel(self):
+        (x, y, a) = advancePose(100, 100, 0, 10, -10, 1)
+        self.assertAlmostEqual((x, y), (100, 100))
+        self.assertAlmostEqual(a, 20 / AXLE_TRACK_UNITS * 180 / 3.141592653589793 % 360)
+
+    def testArcMatchesSmallSteps(self):
+        pose = (100, 100, 30)
+        for _ in range(1000):
+            pose = advancePose(*pose, 30, 20, 0.001)
+        (x, y, a) = advancePose(100, 100, 30, 30, 20, 1)
+        self.assertAlmostEqual(x, pose[0], 6)
+        self.assertAlmostEqual(y, pose[1], 6)
+        self.assertAlmostEqual(a, pose[2], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -52,6 +52,43 @@ class TestMessages(unittest.TestCase):
         self.assertFalse(m.isLevel)
         self.assertTrue(m.collision)
 
+    def testDecodeMotionExtended(self):
+        m = tm.decodeMotion(bytes([0x01, 0x01, 0x00, 0x01, 0x03, 0x01]))
+        self.assertTrue(m.doubleTap)
+        self.assertEqual(m.orientation, td.Orientation.BACK_UP)
+        self.assertEqual(m.shake, 1)
+        self.assertRaises(ValueError, tm.decodeMotion, bytes([0x01, 0x01, 0x00, 0x01, 0x09, 0x01]))
+
+    def testDecodeMotionReturnsTilt(self):
+        t = tm.decodeMotion(bytes([0x03, 0x01, 0x0a, 0x00, 0xf6, 0xff, 0x5a, 0x00]))
+        self.assertIsInstance(t, td.TiltEuler)
+        self.assertEqual((t.roll, t.pitch, t.yaw), (10, -10, 90))
+        self.assertRaises(ValueError, tm.decodeMotion, bytes([0x03, 0x03]))
+
+    def testDecodeMotor(self):
+        m = tm.decodeMotor(bytes([0x83, 0x05, 0x00]))
+        self.assertIsInstance(m, td.Motor)
+        self.assertEqual((m.type, m.id, m.result), (0x83, 5, td.MotorResult.SUCCESS))
+        s = tm.decodeMotor(bytes([0xe0, 0x32, 0x14]))
+        self.assertIsInstance(s, td.MotorSpeed)
+        self.assertEqual((s.left, s.right), (0x32, 0x14))
+        self.assertRaises(ValueError, tm.decodeMotor, bytes([0x83, 0x05]))
+
+    def testDecodeIntoReusesEvents(self):
+        buffer = tm.DecodeBuffer()
+        p1 = tm.decodeToioIDInto(bytes([0x01, 0xc5, 0x02, 0x7f, 0x01, 0x32, 0x01, 0xbc, 0x02, 0x82, 0x01, 0x33, 0x01]), buffer)
+        p2 = tm.decodeToioIDInto(bytes([0x01, 0x01, 0x00, 0x02, 0x00, 0x03, 0x00, 0x04, 0x00, 0x05, 0x00, 0x06, 0x00]), buffer)
+        self.assertIs(p1, p2)
+        self.assertEqual((p2.x, p2.y, p2.angle, p2.sensorX, p2.sensorY, p2.sensorAngle), (1, 2, 3, 4, 5, 6))
+        m = tm.decodeToioIDInto(bytes([0x04]), buffer)
+        self.assertIsInstance(m, td.MissedID)
+        self.assertEqual(m.fromType, td.ToioIDType.STANDARD)
+        motion = tm.decodeMotionInto(bytes([0x01, 0x00, 0x01]), buffer)
+        self.assertIs(motion, buffer.motion)
+        self.assertFalse(motion.isLevel)
+        self.assertTrue(motion.collision)
+        self.assertIs(tm.decodeMotorInto(bytes([0xe0, 0x01, 0x02]), buffer), buffer.motorSpeed)
+
     def testDecodeButton(self):
         self.assertFalse(tm.decodeButton(bytes([0x01, 0x00])))
         self.assertTrue(tm.decodeButton(bytes([0x01, 0x80])))
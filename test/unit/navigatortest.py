@@ -0,0 +1,57 @@
+import unittest
+
+from tomotoio.cube import Cube
+from tomotoio.geo import angleDiff
+from tomotoio.navigator import Navigator, PosePredictor, RotateCommand
+from tomotoio.simpeer import SimPeer
+
+
+class TestNavigator(unittest.TestCase):
+    def rotate(self, predictor):
+        peer = SimPeer(angle=0, latency=0.1, seed=1)
+        nav = Navigator(Cube(peer, "sim"), predictor=predictor)
+        nav.setCommand(RotateCommand(nav, 180, 3, rotateSpeedFactor=2))
+        peer.run(3)
+        worst = 0.0
+        for _ in range(100):
+            peer.run(0.01)
+            worst = max(worst, abs(angleDiff(180 - peer.angle)))
+        return worst
+
+    def testPredictorDampsOscillation(self):
+        self.assertGreater(self.rotate(None), 20)
+        self.assertLess(self.rotate(PosePredictor(latency=0.1)), 15)
+
+    def testEstimatePoseWithoutPredictor(self):
+        peer = SimPeer(x=200, y=300, angle=45)
+        nav = Navigator(Cube(peer, "sim"))
+        peer.run(0.02)
+        self.assertEqual(nav.estimatePose(nav.lastPosition), (200, 300, 45))
+
+    def testPredictsCommandedMotion(self):
+        peer = SimPeer(x=200, y=300, angle=0)
+        nav = Navigator(Cube(peer, "sim"), predictor=PosePredictor(latency=0.1, commandWeight=1))
+        peer.run(0.02)
+        nav.setMotor(50, 50, 1)
+        (x, y, a) = nav.estimatePose(nav.lastPosition)
+        self.assertGreater(x, 205)
+        self.assertAlmostEqual(y, 300)
+
+    def testStopsOnceWhenComplete(self):
+        peer = SimPeer(x=200, y=300, angle=0)
+        cube = Cube(peer, "sim")
+        nav = Navigator(cube)
+        speeds = list()
+        setMotor = cube.setMotor
+        cube.setMotor = lambda left, right, duration=0: (speeds.append((left, right)), setMotor(left, right, duration))
+        nav.setCommand(RotateCommand(nav, 90, 5))
+        for _ in range(100):
+            peer.run(0.02)
+            nav.step()
+        self.assertTrue(nav.command.complete)
+        self.assertEqual(speeds.count((0, 0)), 1)
+        self.assertEqual(speeds[-1], (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from tomotoio.cube import Cube
+from tomotoio.data import EstimatedPositionID, MotorSpeed, PositionID
+from tomotoio.kinematics import UNITS_PER_SECOND_PER_SPEED
+from tomotoio.navigator import MoveCommand, Navigator
+from tomotoio.odometry import Odometry
+from tomotoio.simpeer import SimPeer
+
+
+class TestOdometry(unittest.TestCase):
+    def setUp(self):
+        self.odometry = Odometry(maxGap=2, maxUncertainty=100)
+        self.odometry.handlePosition(0, PositionID(100, 100, 0, 100, 100, 0))
+
+    def testDoesNotEstimateOnTheMat(self):
+        self.assertIsNone(self.odometry.estimate(0.5))
+
+    def testDeadReckonsCommandedSpeeds(self):
+        self.odometry.handleCommand(0, 50, 50, 0.5)
+        self.odometry.handleMissed(0.2)
+        e = self.odometry.estimate(1)
+        self.assertIsInstance(e, EstimatedPositionID)
+        self.assertTrue(e.isEstimated())
+        self.assertAlmostEqual(e.x, 100 + 50 * UNITS_PER_SECOND_PER_SPEED * 0.5)
+        self.assertAlmostEqual(e.y, 100)
+        self.assertGreater(e.uncertainty, 0)
+
+    def testTakesSignsFromCommandAndMagnitudesFromMotorSpeed(self):
+        self.odometry.handleCommand(0, -50, -50)
+        self.odometry.handleMotorSpeed(0, MotorSpeed(0xe0, 20, 20))
+        self.odometry.handleMissed(0)
+        e = self.odometry.estimate(1)
+        self.assertAlmostEqual(e.x, 100 - 20 * UNITS_PER_SECOND_PER_SPEED)
+
+    def testStopsEstimatingWhenUnreliable(self):
+        self.odometry.handleMissed(0)
+        self.assertIsNotNone(self.odometry.estimate(1.5))
+        self.assertIsNone(self.odometry.estimate(2.5))
+
+    def testNavigatorKeepsMovingThroughBlindSpot(self):
+        peer = SimPeer(x=100, y=250, angle=0, seed=1, blindSpots=[(180, 150, 350, 350)])
+        nav = Navigator(Cube(peer, "sim"), odometry=Odometry(maxGap=3, maxUncertainty=50))
+        nav.setCommand(MoveCommand(nav, 260, 300, 10))
+        for _ in range(100):
+            peer.run(0.05)
+            nav.tick()
+            if nav.command.complete:
+                break
+        self.assertTrue(nav.command.complete)
+        self.assertTrue(nav.lastPosition.isEstimated())
+        self.assertLess(abs(peer.x - 260) + abs(peer.y - 300), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import unittest
+from threading import Event
+
+from tomotoio.reactor import Reactor
+
+
+class PipeReader:
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.buffer = bytearray()
+
+    def fileno(self):
+        return self.fd
+
+    def fill(self):
+        chunk = os.read(self.fd, 4096)
+        self.buffer += chunk
+        return bool(chunk)
+
+    def hasLine(self):
+        return b"\n" in self.buffer
+
+
+class PipePeer:
+    def __init__(self, expectedLines: int = 1):
+        (r, self.sender) = os.pipe()
+        self.helperReader = PipeReader(r)
+        self.lines = list()
+        self.operations = 0
+        self.exited = False
+        self.expectedLines = expectedLines
+        self.done = Event()
+
+    def processHelperLines(self):
+        while self.helperReader.hasLine():
+            (line, _, rest) = bytes(self.helperReader.buffer).partition(b"\n")
+            self.helperReader.buffer = bytearray(rest)
+            self.lines.append(line)
+            if len(self.lines) >= self.expectedLines:
+                self.done.set()
+
+    def processPendingOperations(self):
+        self.operations += 1
+        self.done.set()
+
+    def processHelperExit(self):
+        self.exited = True
+
+    def close(self):
+        os.close(self.sender)
+        os.close(self.helperReader.fd)
+
+
+class TestReactor(unittest.TestCase):
+    def setUp(self):
+        self.reactor = Reactor()
+
+    def tearDown(self):
+        self.reactor.close()
+
+    def testDispatchesLinesOfAllPeers(self):
+        peers = [PipePeer(2) for _ in range(4)]
+        for p in peers:
+            self.reactor.register(p)
+        for i, p in enumerate(peers):
+            os.write(p.sender, b"a%d\nb\n" % i)
+        for i, p in enumerate(peers):
+            self.assertTrue(p.done.wait(1))
+            self.assertEqual(p.lines, [b"a%d" % i, b"b"])
+            p.close()
+
+    def testScheduleRunsPendingOperationsOnReactorThread(self):
+        peer = PipePeer()
+        self.reactor.register(peer)
+        self.reactor.schedule(peer)
+        self.assertTrue(peer.done.wait(1))
+        self.assertEqual(peer.operations, 1)
+        self.assertTrue(self.reactor.call(self.reactor.isReactorThread))
+        self.assertFalse(self.reactor.isReactorThread())
+        peer.close()
+
+    def testUnregisteredPeerIsNotDispatched(self):
+        peer = PipePeer()
+        self.reactor.register(peer)
+        self.reactor.unregister(peer)
+        os.write(peer.sender, b"x\n")
+        self.reactor.call(lambda: None)
+        self.assertEqual(peer.lines, [])
+        peer.close()
+
+    def testFailingPeerIsDroppedAlone(self):
+        broken = PipePeer()
+        peer = PipePeer()
+        self.reactor.register(broken)
+        self.reactor.register(peer)
+
+        def fail():
+            raise OSError(9, "Bad file descriptor")
+
+        broken.helperReader.fill = fail
+        os.write(broken.sender, b"x\n")
+        self.reactor.call(lambda: None)
+        self.assertNotIn(broken, self.reactor.peers.values())
+        self.assertTrue(broken.exited)
+
+        os.write(peer.sender, b"y\n")
+        self.assertTrue(peer.done.wait(1))
+        self.assertEqual(peer.lines, [b"y"])
+        broken.close()
+        peer.close()
+
+    def testClosesWhenLastUserReleases(self):
+        reactor = Reactor(closeWhenUnused=True)
+        reactor.acquire()
+        reactor.acquire()
+        reactor.call(lambda: None)
+        reactor.release()
+        self.assertFalse(reactor.closed)
+        self.assertIsNotNone(reactor.thread)
+
+        reactor.release()
+        self.assertTrue(reactor.closed)
+        self.assertIsNone(reactor.thread)
+        self.assertTrue(reactor.epoll.closed)
+        reactor.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+from tomotoio.cube import Cube
+from tomotoio.navigator import Navigator, NavigationCommandBase
+from tomotoio.scheduler import ControlScheduler
+from tomotoio.simpeer import SimPeer
+
+
+class SteppedScheduler(ControlScheduler):
+    """Runs on the calling thread on a fake clock, which only moves while stepping and waiting."""
+
+    def __init__(self, rate: float, ticks: int):
+        self.time = 0
+        self.remaining = ticks
+        super().__init__(rate, clock=lambda: self.time)
+
+    def _wait(self, seconds: float):
+        self.time += max(int(seconds * 1e9), 0)
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.stopping.set()
+
+
+class CountingNavigator:
+    def __init__(self, scheduler: SteppedScheduler = None, delay: float = 0):
+        self.scheduler = scheduler
+        self.delay = delay
+        self.steps = 0
+        self.scheduled = False
+
+    def step(self, maxAge: float):
+        self.steps += 1
+        if self.scheduler:
+            self.scheduler.time += int(self.delay * 1e9)
+
+
+class RecordingCommand(NavigationCommandBase):
+    def __init__(self, nav):
+        super().__init__(nav)
+        self.events = list()
+
+    def handleNotification(self, e):
+        self.events.append(e)
+
+
+class TestControlScheduler(unittest.TestCase):
+    def testTicksAtRate(self):
+        scheduler = SteppedScheduler(rate=100, ticks=30)
+        nav = CountingNavigator(scheduler, delay=0.002)
+        scheduler.add(nav)
+        self.assertTrue(nav.scheduled)
+        scheduler._run()
+        self.assertEqual(nav.steps, 30)
+        self.assertEqual(scheduler.time, 30 * scheduler.period)
+        stats = scheduler.stats()
+        self.assertEqual(stats['ticks'], 30)
+        self.assertEqual(stats['missed'], 0)
+        self.assertEqual(stats['jitter']['count'], 29)
+        self.assertEqual(stats['lateness']['max'], 0)
+
+    def testSkipsOverrunTicks(self):
+        scheduler = SteppedScheduler(rate=100, ticks=10)
+        nav = CountingNavigator(scheduler, delay=0.025)
+        scheduler.add(nav)
+        scheduler._run()
+        # Each tick overlaps the next two periods, so the ticks run every 30 ms
+        self.assertEqual(nav.steps, 10)
+        self.assertEqual(scheduler.missed, 20)
+        self.assertEqual(scheduler.time, 300 * 1000000)
+
+    def testRunsOnThread(self):
+        scheduler = ControlScheduler(rate=100)
+        nav = CountingNavigator()
+        scheduler.add(nav)
+        scheduler.start()
+        self.assertTrue(scheduler.thread.daemon)
+        scheduler.stop()
+        self.assertIsNone(scheduler.thread)
+        self.assertEqual(scheduler.ticks, nav.steps)
+
+    def testRemove(self):
+        scheduler = ControlScheduler()
+        nav = CountingNavigator()
+        scheduler.add(nav)
+        scheduler.remove(nav)
+        self.assertFalse(nav.scheduled)
+        scheduler.tick()
+        self.assertEqual(nav.steps, 0)
+
+    def testScheduledNavigatorRunsCommandOnStep(self):
+        peer = SimPeer(x=200, y=300)
+        nav = Navigator(Cube(peer, "sim"))
+        command = RecordingCommand(nav)
+        nav.setCommand(command)
+        ControlScheduler().add(nav)
+
+        peer.run(0.1)
+        self.assertEqual(command.events, [])
+        self.assertIsNotNone(nav.lastPosition)
+
+        nav.step()
+        self.assertEqual(command.events, [nav.lastPosition])
+
+    def testStepSkipsStalePose(self):
+        peer = SimPeer(x=200, y=300)
+        nav = Navigator(Cube(peer, "sim"))
+        command = RecordingCommand(nav)
+        nav.setCommand(command)
+        nav.scheduled = True
+
+        nav.step()
+        self.assertEqual(command.events, [])
+
+        peer.run(0.1)
+        peer.time += 1
+        nav.step(maxAge=0.5)
+        self.assertEqual(command.events, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
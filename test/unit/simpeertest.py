@@ -0,0 +1,91 @@
+import unittest
+
+from tomotoio.constants import CharacteristicID
+from tomotoio.cube import Cube
+from tomotoio.data import MissedID, MotorInfoType, MotorResult, PositionID
+from tomotoio.messages import *
+from tomotoio.navigator import Navigator
+from tomotoio.simpeer import SimPeer, runSimulation
+
+
+class TestSimPeer(unittest.TestCase):
+    def setUp(self):
+        self.peer = SimPeer(x=250, y=250, angle=0, seed=1)
+        self.cube = Cube(self.peer, "sim")
+        self.events = list()
+
+    def testReadsState(self):
+        e = self.cube.toioID.get()
+        self.assertIsInstance(e, PositionID)
+        self.assertEqual((e.x, e.y, e.angle), (250, 250, 0))
+        self.assertEqual(self.cube.battery.get(), 100)
+        self.assertEqual(self.cube.getConfigProtocolVersion(), "2.3.0")
+
+    def testMovesStraight(self):
+        self.cube.setMotor(50, 50, 1)
+        self.peer.run(0.5)
+        self.assertGreater(self.peer.x, 260)
+        self.assertAlmostEqual(self.peer.y, 250, 3)
+        self.peer.run(1)
+        x = self.peer.x
+        self.peer.run(0.5)
+        self.assertEqual(self.peer.x, x)
+
+    def testTurnsClockwiseWithFasterLeftWheel(self):
+        self.cube.setMotor(30, -30)
+        self.peer.run(0.2)
+        self.assertTrue(0 < self.peer.angle < 180)
+
+    def testNotifiesPositionsAndMissed(self):
+        self.cube.toioID.addListener(self.events.append)
+        self.cube.toioID.enableNotification()
+        self.peer.setPose(450, 250, 0)
+        self.cube.setMotor(50, 50)
+        self.peer.run(0.5)
+        self.assertIsInstance(self.events[0], PositionID)
+        self.assertIsInstance(self.events[-1], MissedID)
+        self.assertEqual(sum(isinstance(e, MissedID) for e in self.events), 1)
+
+    def testReachesTarget(self):
+        self.cube.motor.addListener(self.events.append)
+        self.cube.motor.enableNotification()
+        self.cube.setMotorWithTarget(7, 350, 150, maxspeed=80, timeout=5)
+        self.peer.run(5)
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0].type, MotorInfoType.WITH_TARGET)
+        self.assertEqual(self.events[0].id, 7)
+        self.assertEqual(self.events[0].result, MotorResult.SUCCESS)
+        self.assertLess(abs(self.peer.x - 350) + abs(self.peer.y - 150), 20)
+
+    def testTargetIsOverriddenByPlainMotor(self):
+        self.cube.motor.addListener(self.events.append)
+        self.cube.motor.enableNotification()
+        self.cube.setMotorWithTarget(1, 350, 150)
+        self.cube.setMotor(0, 0)
+        self.assertEqual(self.events[0].result, MotorResult.OTHER_CONTROL_ACCEPTED)
+
+    def testNavigatorMovesToTarget(self):
+        nav = Navigator(self.cube)
+        nav.move(150, 350, 10)
+        self.peer.run(5)
+        self.assertTrue(nav.command.complete)
+        self.assertEqual(len(nav.history), 64)
+        self.assertAlmostEqual(nav.history.latest()[0], self.peer.time, 1)
+
+    def testLatencyAndLoss(self):
+        peer = SimPeer(latency=0.05, lossRate=0.5, seed=3)
+        peer.addListener(lambda charId, data: self.events.append((peer.time, charId)))
+        peer.enableNotification(Cube(peer, "sim").toioID.uuid)
+        peer.run(1)
+        self.assertTrue(20 < len(self.events) < 80)
+        self.assertGreaterEqual(self.events[0][0], 0.05 - 1e-9)
+        self.assertTrue(all(charId == CharacteristicID.TOIO_ID for (_, charId) in self.events))
+
+    def testRunsManyPeersInLockstep(self):
+        peers = [SimPeer(seed=i) for i in range(3)]
+        runSimulation(peers, 0.1)
+        self.assertTrue(all(abs(p.time - 0.1) < 1e-9 for p in peers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from tomotoio.constants import CharacteristicID
+from tomotoio.cube import Cube
+from tomotoio.simpeer import SimPeer
+from tomotoio.stats import Histogram, PeerStats
+from tomotoio.writequeue import WriteQueue
+
+
+class TestStats(unittest.TestCase):
+    def testHistogramIsExactForSmallValues(self):
+        h = Histogram()
+        for v in range(1, 11):
+            h.record(v)
+        self.assertEqual(h.percentile(50), 5)
+        self.assertEqual(h.percentile(100), 10)
+        self.assertEqual(h.snapshot(), dict(count=10, min=1, mean=5.5, p50=5, p90=9, p99=10, max=10))
+
+    def testHistogramBoundsTheRelativeError(self):
+        h = Histogram()
+        values = [int(1.37 ** i) for i in range(10, 80)]
+        for v in values:
+            h.record(v)
+        for p in (10, 50, 90):
+            exact = values[max(int(len(values) * p / 100 + 0.5), 1) - 1]
+            self.assertLessEqual(abs(h.percentile(p) - exact), exact / 16)
+
+    def testHistogramClampsLargeValues(self):
+        h = Histogram(1000)
+        h.record(10 ** 9)
+        self.assertEqual(h.max, 10 ** 9)
+        self.assertEqual(h.percentile(50), 10 ** 9)
+
+    def testEmptyHistogram(self):
+        self.assertEqual(Histogram().snapshot()["p50"], None)
+
+    def testPeerStats(self):
+        s = PeerStats()
+        for i in range(5):
+            s.recordNotification(CharacteristicID.TOIO_ID, 13, i * 10_000_000)
+        s.recordWrite(8)
+        snapshot = s.snapshot()
+        toioID = snapshot["notifications"]["TOIO_ID"]
+        self.assertEqual((toioID["count"], toioID["bytes"]), (5, 65))
+        self.assertEqual(toioID["interArrival"]["count"], 4)
+        self.assertAlmostEqual(toioID["interArrival"]["p50"], 10, delta=10 / 16)
+        self.assertEqual((snapshot["writes"]["count"], snapshot["writes"]["bytes"]), (1, 8))
+
+    def testWriteQueueWaitTime(self):
+        q = WriteQueue()
+        q.put(1, b"\x01")
+        q.put(2, b"\x02")
+        q.get()
+        self.assertEqual(q.waitTime.count, 1)
+        self.assertEqual(q.putDepth.max, 2)
+
+    def testCubeListenerTime(self):
+        peer = SimPeer(seed=1)
+        cube = Cube(peer, "sim")
+        cube.toioID.addListener(lambda e: None)
+        cube.toioID.enableNotification()
+        peer.run(0.1)
+        stats = cube.stats()
+        self.assertGreater(stats["listeners"]["TOIO_ID"]["count"], 5)
+        self.assertNotIn("MOTION", stats["listeners"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+
+from tomotoio.cube import Cube
+from tomotoio.data import AdditionalWriteSettingType, Motor, MotorInfoType, MotorResult, Target
+from tomotoio.simpeer import SimPeer
+from tomotoio.targetcontrol import TargetControlTracker
+
+
+class TestTargetControlTracker(unittest.TestCase):
+    def setUp(self):
+        self.time = 0
+        self.cancelled = 0
+        self.tracker = TargetControlTracker(lambda: self.time, self.cancel)
+
+    def cancel(self):
+        self.cancelled += 1
+
+    def testAllocatesFreeIds(self):
+        (a, _) = self.tracker.start(MotorInfoType.WITH_TARGET)
+        (b, _) = self.tracker.start(MotorInfoType.WITH_TARGET)
+        self.assertNotEqual(a, b)
+        self.assertEqual(len(self.tracker), 2)
+        self.tracker.handleResponse(Motor(MotorInfoType.WITH_TARGET, a, 0))
+        self.assertEqual(len(self.tracker), 1)
+        for _ in range(254):
+            self.tracker.start(MotorInfoType.WITH_TARGET)
+        (d, _) = self.tracker.start(MotorInfoType.WITH_TARGET)
+        self.assertEqual(d, a)
+        with self.assertRaises(RuntimeError):
+            self.tracker.start(MotorInfoType.WITH_TARGET)
+
+    def testResolvesMatchingResponse(self):
+        (ctrlid, future) = self.tracker.start(MotorInfoType.WITH_TARGET, 7)
+        self.tracker.handleResponse(Motor(MotorInfoType.WITH_MULTIPLE_TARGETS, 7, 0))
+        self.assertFalse(future.done())
+        self.tracker.handleResponse(Motor(MotorInfoType.WITH_TARGET, 7, 1))
+        self.assertEqual(future.result(0), MotorResult.TIMEOUT)
+
+    def testExpires(self):
+        (_, future) = self.tracker.start(MotorInfoType.WITH_TARGET, timeout=1)
+        self.time = int(2.5e9)
+        self.tracker.expire()
+        self.assertFalse(future.done())
+        self.time = int(3.5e9)
+        self.tracker.expire()
+        with self.assertRaises(TimeoutError):
+            future.result(0)
+        self.assertEqual(len(self.tracker), 0)
+
+    def testIgnoresResponseToOverwrittenControl(self):
+        (_, first) = self.tracker.start(MotorInfoType.WITH_TARGET, 7)
+        (_, second) = self.tracker.start(MotorInfoType.WITH_TARGET, 7)
+        self.assertTrue(first.cancelled())
+        self.tracker.handleResponse(Motor(MotorInfoType.WITH_TARGET, 7, MotorResult.OTHER_CONTROL_ACCEPTED))
+        self.assertFalse(second.done())
+        self.tracker.handleResponse(Motor(MotorInfoType.WITH_TARGET, 7, MotorResult.SUCCESS))
+        self.assertEqual(second.result(0), MotorResult.SUCCESS)
+        self.assertEqual(self.cancelled, 0)
+
+    def testCancelStops(self):
+        (_, future) = self.tracker.start(MotorInfoType.WITH_TARGET)
+        self.assertTrue(future.cancel())
+        self.assertEqual(self.cancelled, 1)
+        self.assertEqual(len(self.tracker), 0)
+
+        self.tracker.start(MotorInfoType.WITH_TARGET)
+        self.tracker.cancelAll()
+        self.assertEqual(self.cancelled, 1)
+
+
+class TestCubeTargetFutures(unittest.TestCase):
+    def setUp(self):
+        self.peer = SimPeer(x=200, y=300, angle=0, seed=1)
+        self.cube = Cube(self.peer, "sim")
+
+    def testMoveResolves(self):
+        future = self.cube.setMotorWithTarget(None, 260, 300, 50)
+        self.peer.run(5)
+        self.assertEqual(future.result(0), MotorResult.SUCCESS)
+        self.assertLess(abs(self.peer.x - 260), 10)
+
+    def testAddedTargetsResolveInOrder(self):
+        first = self.cube.setMotorWithMultipleTargets(None, [Target(260, 300)], 50)
+        second = self.cube.setMotorWithMultipleTargets(None, [Target(260, 360)], 50,
+                                                        addwritemode=AdditionalWriteSettingType.ADD)
+        self.peer.run(2)
+        self.assertEqual(first.result(0), MotorResult.SUCCESS)
+        self.assertFalse(second.done())
+        self.peer.run(5)
+        self.assertEqual(second.result(0), MotorResult.SUCCESS)
+
+    def testOverwrittenControl(self):
+        first = self.cube.setMotorWithTarget(None, 400, 300, 50)
+        self.peer.run(0.1)
+        second = self.cube.setMotorWithTarget(None, 200, 350, 50)
+        self.peer.run(0.1)
+        self.assertEqual(first.result(0), MotorResult.OTHER_CONTROL_ACCEPTED)
+        self.assertFalse(second.done())
+
+    def testLostResponseExpiresOnNotification(self):
+        self.cube.toioID.enableNotification()
+        future = self.cube.setMotorWithTarget(None, 260, 300, 50, timeout=1)
+        # The response gets lost, while the positions keep coming
+        self.cube.removeEventListener(Motor, self.cube.targetControls.handleResponse)
+        self.peer.run(5)
+        self.assertTrue(future.done())
+        self.assertIsInstance(future.exception(0), TimeoutError)
+        self.assertEqual(len(self.cube.targetControls), 0)
+
+    def testCancelStopsMotors(self):
+        future = self.cube.setMotorWithTarget(None, 400, 300, 50)
+        self.peer.run(0.5)
+        self.assertNotEqual(self.peer.left, 0)
+        future.cancel()
+        self.peer.run(0.1)
+        self.assertEqual((self.peer.left, self.peer.right), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import time
+import unittest
+
+from tomotoio.constants import CharacteristicID, UUIDs
+from tomotoio.cube import Cube, Peer
+from tomotoio.data import PositionID
+from tomotoio.simpeer import SimPeer
+from tomotoio.trace import RecordingPeer, RecordKind, ReplayPeer, TraceReader, TraceWriter
+
+
+class StampingPeer(Peer):
+    """Peer stamping its notifications itself, as the BLE peers do."""
+
+    def __init__(self):
+        self.timedListeners = list()
+
+    def addTimedListener(self, listener):
+        self.timedListeners.append(listener)
+
+    def notify(self, charId: int, data: bytes, timestamp: int, sequence: int):
+        for listener in self.timedListeners:
+            listener(charId, data, timestamp, sequence)
+
+    def read(self, uuid) -> bytes:
+        return b"\x50"
+
+    def now(self) -> int:
+        return 1000
+
+    def stats(self):
+        return dict(reads=1)
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "session.trace")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def record(self) -> SimPeer:
+        sim = SimPeer(seed=1)
+        cube = Cube(RecordingPeer(sim, self.path), "recorded")
+        cube.toioID.enableNotification()
+        cube.battery.get()
+        cube.setMotor(30, 30)
+        sim.run(0.1)
+        cube.release()
+        return sim
+
+    def testRecordsAllTraffic(self):
+        self.record()
+        reader = TraceReader(self.path)
+        records = list(reader)
+        kinds = [r.kind for r in records]
+        self.assertEqual(kinds[0], RecordKind.READ)
+        self.assertEqual(records[0].charId, CharacteristicID.BATTERY)
+        self.assertEqual(kinds[1], RecordKind.WRITE)
+        self.assertEqual(records[1].charId, CharacteristicID.MOTOR)
+        self.assertGreater(kinds.count(RecordKind.NOTIFICATION), 5)
+        self.assertEqual(sorted(r.timestamp for r in records), [r.timestamp for r in records])
+        self.assertEqual(len(list(reader.records([RecordKind.WRITE]))), 1)
+        reader.close()
+
+    def testRecordingKeepsPeerStamps(self):
+        peer = StampingPeer()
+        recording = RecordingPeer(peer, self.path)
+        received = list()
+        recording.addTimedListener(lambda *args: received.append(args))
+        peer.notify(CharacteristicID.BUTTON, b"\x01\x80", 42, 7)
+        self.assertEqual(received, [(CharacteristicID.BUTTON, b"\x01\x80", 42, 7)])
+        self.assertEqual(recording.readFuture(UUIDs.BATTERY).result(), b"\x50")
+        self.assertEqual(recording.now(), 1000)
+        self.assertEqual(recording.stats(), dict(reads=1))
+        recording.writer.close()
+
+        records = list(TraceReader(self.path))
+        self.assertEqual([(r.kind, r.timestamp) for r in records], [(RecordKind.NOTIFICATION, 42), (RecordKind.READ, 1000)])
+
+    def testFlushesPeriodically(self):
+        writer = TraceWriter(self.path, flushRecords=2, flushInterval=60)
+        writer.write(RecordKind.NOTIFICATION, CharacteristicID.BUTTON, b"\x01\x80")
+        self.assertEqual(os.path.getsize(self.path), 0)
+        writer.write(RecordKind.NOTIFICATION, CharacteristicID.BUTTON, b"\x01\x00")
+        reader = TraceReader(self.path)
+        self.assertEqual([r.data for r in reader], [b"\x01\x80", b"\x01\x00"])
+        reader.close()
+        writer.close()
+
+    def testIgnoresTruncatedRecord(self):
+        writer = TraceWriter(self.path)
+        writer.write(RecordKind.NOTIFICATION, CharacteristicID.BUTTON, b"\x01\x80")
+        writer.write(RecordKind.NOTIFICATION, CharacteristicID.BUTTON, b"\x01\x00")
+        writer.close()
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        reader = TraceReader(self.path)
+        self.assertEqual([r.data for r in reader], [b"\x01\x80"])
+        reader.close()
+
+    def testRejectsOtherFiles(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a trace")
+        self.assertRaises(ValueError, TraceReader, self.path)
+
+    def testReplaysIntoCube(self):
+        self.record()
+        peer = ReplayPeer(self.path, speed=None)
+        cube = Cube(peer, "replayed")
+        events = list()
+        envelopes = list()
+        cube.toioID.addListener(events.append)
+        cube.toioID.addListener(envelopes.append, envelope=True)
+        count = len(list(TraceReader(self.path).records([RecordKind.NOTIFICATION])))
+        self.assertEqual(peer.play(), count)
+        self.assertEqual(len(events), count)
+        self.assertTrue(all(isinstance(e, PositionID) for e in events))
+        recorded = [r.timestamp for r in TraceReader(self.path).records([RecordKind.NOTIFICATION])]
+        self.assertEqual([e.timestamp for e in envelopes], recorded)
+        self.assertEqual(cube.battery.get(), 100)
+        cube.setMotor(0, 0)
+        self.assertEqual(peer.writes[0].kind, RecordKind.WRITE)
+        cube.release()
+
+    def testReplaysAtSpeed(self):
+        writer = TraceWriter(self.path)
+        writer.write(RecordKind.NOTIFICATION, CharacteristicID.BUTTON, b"\x01\x80", 0)
+        writer.write(RecordKind.NOTIFICATION, CharacteristicID.BUTTON, b"\x01\x00", 200_000_000)
+        writer.close()
+        peer = ReplayPeer(self.path, speed=2)
+        start = time.monotonic()
+        peer.play()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        peer.disconnect()
+
+
+if __name__ == '__main__':
+    unittest.main()
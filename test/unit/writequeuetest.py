@@ -0,0 +1,122 @@
+import unittest
+from queue import Empty, Full
+from threading import Thread
+
+from tomotoio.writequeue import QueueFullPolicy, WritePriority, WriteQueue
+
+MOTOR = 1
+LIGHT = 2
+SOUND = 3
+
+PRIORITIES = {MOTOR: WritePriority.HIGH, LIGHT: WritePriority.LOW, SOUND: WritePriority.LOW}
+
+
+class TestWriteQueue(unittest.TestCase):
+    def drain(self, q: WriteQueue):
+        result = list()
+        try:
+            while True:
+                result.append(q.get())
+        except Empty:
+            return result
+
+    def testKeepsOnlyNewestPayloadOfCoalescingKey(self):
+        q = WriteQueue(coalescingKeys=[MOTOR, LIGHT])
+        q.put(MOTOR, b"\x01")
+        q.put(SOUND, b"\x10")
+        q.put(MOTOR, b"\x02")
+        q.put(MOTOR, b"\x03")
+        self.assertEqual(self.drain(q), [(MOTOR, b"\x03", False), (SOUND, b"\x10", False)])
+        self.assertEqual(q.coalescedCount, 2)
+
+    def testCoalescesOnlyMatchingLeadingBytes(self):
+        q = WriteQueue(coalescingKeys=[(MOTOR, 0x01), (MOTOR, 0x02)])
+        q.put(MOTOR, b"\x01\x10")
+        q.put(MOTOR, b"\x04\x01\x00")
+        q.put(MOTOR, b"\x01\x20")
+        q.put(MOTOR, b"\x04\x02\x00")
+        q.put(MOTOR, b"\x02\x30")
+        self.assertEqual([d for (_, d, _) in self.drain(q)],
+                         [b"\x01\x20", b"\x04\x01\x00", b"\x04\x02\x00", b"\x02\x30"])
+        self.assertEqual(q.coalescedCount, 1)
+
+    def testPreservesOrderOfOtherWrites(self):
+        q = WriteQueue(coalescingKeys=[MOTOR])
+        for i in range(3):
+            q.put(SOUND, bytes([i]))
+        self.assertEqual([d for (_, d, _) in self.drain(q)], [b"\x00", b"\x01", b"\x02"])
+
+    def testDoesNotCoalesceWritesWithResponse(self):
+        q = WriteQueue(coalescingKeys=[MOTOR])
+        q.put(MOTOR, b"\x01", True)
+        q.put(MOTOR, b"\x02", True)
+        self.assertEqual(len(q), 2)
+
+    def testCoalescesAgainAfterPendingWriteIsSent(self):
+        q = WriteQueue(coalescingKeys=[MOTOR])
+        q.put(MOTOR, b"\x01")
+        q.get()
+        q.put(MOTOR, b"\x02")
+        self.assertEqual(self.drain(q), [(MOTOR, b"\x02", False)])
+
+    def testSendsHigherPriorityFirst(self):
+        q = WriteQueue(priorities=PRIORITIES)
+        q.put(SOUND, b"\x10")
+        q.put(4, b"\x20")
+        q.put(MOTOR, b"\x00")
+        self.assertEqual([k for (k, _, _) in self.drain(q)], [MOTOR, 4, SOUND])
+
+    def testHigherPriorityEvictsLowerPriorityWhenFull(self):
+        q = WriteQueue(2, priorities=PRIORITIES, policy=QueueFullPolicy.RAISE)
+        q.put(SOUND, b"\x10")
+        q.put(LIGHT, b"\x11")
+        q.put(MOTOR, b"\x00")
+        self.assertEqual(self.drain(q), [(MOTOR, b"\x00", False), (LIGHT, b"\x11", False)])
+        self.assertEqual(q.stats(), dict(depth=0, maxDepth=2, coalesced=0, dropped=1))
+
+    def testDropOldestPolicy(self):
+        q = WriteQueue(2, policy=QueueFullPolicy.DROP_OLDEST)
+        for i in range(3):
+            q.put(SOUND, bytes([i]))
+        self.assertEqual([d for (_, d, _) in self.drain(q)], [b"\x01", b"\x02"])
+        self.assertEqual(q.droppedCount, 1)
+
+    def testDropOldestPolicyKeepsHigherPriority(self):
+        q = WriteQueue(2, priorities=PRIORITIES, policy=QueueFullPolicy.DROP_OLDEST)
+        q.put(MOTOR, b"\x00")
+        q.put(MOTOR, b"\x01", True)
+        q.put(LIGHT, b"\x11")
+        self.assertEqual(self.drain(q), [(MOTOR, b"\x00", False), (MOTOR, b"\x01", True)])
+        self.assertEqual(q.droppedCount, 1)
+
+    def testBlockPolicy(self):
+        q = WriteQueue(1)
+        q.put(SOUND, b"\x00")
+        t = Thread(target=q.put, args=(SOUND, b"\x01"))
+        t.start()
+        t.join(0.05)
+        self.assertTrue(t.is_alive())
+        self.assertEqual(q.get(), (SOUND, b"\x00", False))
+        t.join(1)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(self.drain(q), [(SOUND, b"\x01", False)])
+        self.assertEqual(q.droppedCount, 0)
+
+    def testDropNewPolicy(self):
+        q = WriteQueue(2, policy=QueueFullPolicy.DROP_NEW)
+        for i in range(3):
+            q.put(SOUND, bytes([i]))
+        self.assertEqual([d for (_, d, _) in self.drain(q)], [b"\x00", b"\x01"])
+        self.assertEqual(q.droppedCount, 1)
+
+    def testRaisePolicy(self):
+        q = WriteQueue(1, policy=QueueFullPolicy.RAISE)
+        q.put(SOUND, b"\x00")
+        self.assertRaises(Full, q.put, SOUND, b"\x01")
+
+    def testGetRaisesEmpty(self):
+        self.assertRaises(Empty, WriteQueue().get)
+
+
+if __name__ == '__main__':
+    unittest.main()
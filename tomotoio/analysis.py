@@ -0,0 +1,102 @@
+"""Vectorized decoders for offline analysis of recorded notifications (requires NumPy)"""
+from typing import Any, Optional, Sequence
+
+from .data import ToioIDType
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed for the offline analysis
+    np = None
+
+TOIO_ID_RECORD_SIZE = 13
+
+# One row per TOIO_ID notification. type and fromType hold ToioIDType values;
+# the fields that do not apply to the type of the row are zero.
+TOIO_ID_DTYPE = np.dtype([
+    ('time', 'f8'),
+    ('type', 'u1'),
+    ('fromType', 'u1'),
+    ('x', 'u2'),
+    ('y', 'u2'),
+    ('angle', 'u2'),
+    ('sensorX', 'u2'),
+    ('sensorY', 'u2'),
+    ('sensorAngle', 'u2'),
+    ('value', 'u4'),
+]) if np else None
+
+
+def _requireNumPy():
+    if np is None:
+        raise ImportError("NumPy is required for tomotoio.analysis (pip install numpy)")
+
+
+def _toMatrix(payloads: Any) -> Any:
+    """Packs the payloads into an (n, 13) uint8 matrix padded with zeros, plus their lengths."""
+    if isinstance(payloads, np.ndarray):
+        if payloads.ndim != 2:
+            raise ValueError("Expected a 2D array of payloads, got shape %s" % (payloads.shape,))
+        matrix = np.zeros((len(payloads), TOIO_ID_RECORD_SIZE), np.uint8)
+        width = min(payloads.shape[1], TOIO_ID_RECORD_SIZE)
+        matrix[:, :width] = payloads[:, :width]
+        return (matrix, np.full(len(payloads), payloads.shape[1]))
+
+    lengths = np.fromiter(map(len, payloads), np.int64, len(payloads))
+    flat = np.frombuffer(b"".join(payloads), np.uint8)
+    if len(flat) == 0:
+        return (np.zeros((len(payloads), TOIO_ID_RECORD_SIZE), np.uint8), lengths)
+
+    offsets = np.cumsum(lengths) - lengths
+    columns = np.arange(TOIO_ID_RECORD_SIZE)
+    indices = np.minimum(offsets[:, None] + columns, len(flat) - 1)
+    matrix = np.where(columns < lengths[:, None], flat[indices], 0).astype(np.uint8)
+    return (matrix, lengths)
+
+
+def _u16(matrix: Any, column: int) -> Any:
+    return matrix[:, column].astype(np.uint16) | (matrix[:, column + 1].astype(np.uint16) << 8)
+
+
+def decodeToioIDArray(payloads: Sequence[bytes], timestamps: Optional[Sequence[float]] = None) -> Any:
+    """Decodes many TOIO_ID payloads at once.
+
+    Arguments:
+        payloads {Sequence[bytes]} -- Raw payloads, or a 2D uint8 array with a payload per row
+
+    Keyword Arguments:
+        timestamps {Optional[Sequence[float]]} -- Receive time of each payload (default: {None}, stored as NaN)
+
+    Returns:
+        numpy.ndarray -- Structured array of TOIO_ID_DTYPE. Rows whose leading byte is unknown or
+                         whose payload is too short have the type ToioIDType.INVALID.
+    """
+    _requireNumPy()
+    (matrix, lengths) = _toMatrix(payloads)
+    result = np.zeros(len(matrix), TOIO_ID_DTYPE)
+    result['time'] = np.nan if timestamps is None else np.asarray(timestamps, np.float64)
+
+    leading = matrix[:, 0]
+    isPosition = (leading == 0x01) & (lengths >= 13)
+    isStandard = (leading == 0x02) & (lengths >= 7)
+    isMissed = (leading == 0x03) | (leading == 0x04) | (leading == 0xff)
+
+    types = np.full(len(matrix), ToioIDType.INVALID.value, np.uint8)
+    types[isPosition] = ToioIDType.POSITION.value
+    types[isStandard] = ToioIDType.STANDARD.value
+    types[isMissed] = ToioIDType.MISSED.value
+    result['type'] = types
+
+    fromTypes = np.full(len(matrix), ToioIDType.INVALID.value, np.uint8)
+    fromTypes[leading == 0x03] = ToioIDType.POSITION.value
+    fromTypes[leading == 0x04] = ToioIDType.STANDARD.value
+    result['fromType'] = np.where(isMissed, fromTypes, 0)
+
+    for (field, column) in (('x', 1), ('y', 3), ('sensorX', 7), ('sensorY', 9), ('sensorAngle', 11)):
+        result[field] = np.where(isPosition, _u16(matrix, column), 0)
+
+    # The angle is at the same offset in both PositionID and StandardID
+    result['angle'] = np.where(isPosition | isStandard, _u16(matrix, 5), 0)
+    value = _u16(matrix, 1).astype(np.uint32) | (_u16(matrix, 3).astype(np.uint32) << 16)
+    result['value'] = np.where(isStandard, value, 0)
+
+    return result
@@ -0,0 +1,192 @@
+"""asyncio front end of cubes and navigators"""
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from bluepy.btle import UUID
+
+from .constants import UUIDs
+from .cube import Cube, ReadableProperty
+from .eventbus import EventBus
+from .messages import decodeConfigProtocolVersionResponse, encodeConfigProtocolVersionRequest
+from .navigator import NavigationCommandBase, Navigator
+
+# Runs the writes that may block, of all the cubes, in the order they are called
+_writer: Optional[ThreadPoolExecutor] = None
+_writerLock = Lock()
+
+
+def _getWriter() -> ThreadPoolExecutor:
+    global _writer
+    with _writerLock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(1, "AsyncCube writes")
+        return _writer
+
+
+def _setDone(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncProperty:
+    """Awaitable reads and notification streams of a characteristic."""
+
+    def __init__(self, cube: 'AsyncCube', prop: ReadableProperty):
+        self.cube = cube
+        self.prop = prop
+
+    async def get(self, maxAge: Optional[float] = None) -> Any:
+        """Returns the value of the characteristic, as ReadableProperty.get() does, without blocking the loop."""
+        cached = self.prop._cached(maxAge)
+        if cached is not None:
+            return self.prop.decoder(cached)
+        data = await asyncio.wrap_future(self.cube.cube.peer.readFuture(self.prop.uuid))
+        return self.prop._store(data)
+
+    def enableNotification(self, value: bool = True):
+        self.prop.enableNotification(value)
+
+    async def stream(self, types: Optional[Tuple[type, ...]] = None, envelope: bool = False,
+                     capacity: int = 1024) -> AsyncIterator[Any]:
+        """Yields the notified events, or FleetEvent with envelope=True, until the iteration stops.
+
+        Keyword Arguments:
+            types {Optional[Tuple[type, ...]]} -- Classes of the events to yield (default: {None}, all)
+            envelope {bool} -- Whether to yield FleetEvent with the receive time and sequence number (default: {False})
+            capacity {int} -- Events kept while the consumer is busy, the oldest ones are dropped beyond (default: {1024})
+        """
+        subscription = self.cube.bus.subscribe(characteristics=[self.prop.charId], types=types, capacity=capacity)
+        self.cube._attach(self.prop.uuid)
+        try:
+            async for e in subscription:
+                yield e if envelope else e.event
+        finally:
+            self.cube._detach(self.prop.uuid)
+            subscription.close()
+
+
+class AsyncCube:
+    """Cube driven from an asyncio event loop.
+
+    The notifications of the cube reach the loop through an EventBus, so many cubes can be
+    driven from one loop without a thread per cube. A characteristic is published on the bus
+    only while it is streamed, so the other notifications are not even decoded. Reads are
+    awaited without blocking the loop when the peer runs its I/O on a reactor.
+
+    The writes are the set* and turn* methods of Cube, awaited (e.g. await acube.setLight(...))
+    in the order they are called. When the peer queues its writes for a reactor they run on the
+    loop, otherwise on a writer thread shared by all the cubes. Awaiting setMotorWithTarget and
+    setMotorWithMultipleTargets returns the MotorResult once the control completes. The other
+    methods are those of Cube.
+    """
+
+    def __init__(self, cube: Cube):
+        self.cube = cube
+        self.name = cube.name
+        self.bus = EventBus()
+        self.lock = Lock()
+        # Number of streams per characteristic published on the bus
+        self.streams: Dict[UUID, int] = dict()
+        self.toioID = AsyncProperty(self, cube.toioID)
+        self.motion = AsyncProperty(self, cube.motion)
+        self.button = AsyncProperty(self, cube.button)
+        self.battery = AsyncProperty(self, cube.battery)
+        self.motor = AsyncProperty(self, cube.motor)
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.cube, name)
+        if not name.startswith(("set", "turn")) or not callable(method):
+            return method
+
+        async def write(*args, **kwargs) -> Any:
+            result = await self._run(partial(method, *args, **kwargs))
+            if isinstance(result, Future):
+                return await asyncio.wrap_future(result)
+            return result
+
+        return write
+
+    def _queuesWrites(self) -> bool:
+        peer = self.cube.peer
+        return getattr(peer, "reactor", None) is not None and getattr(peer, "registered", False)
+
+    async def _run(self, func: Callable[[], Any]) -> Any:
+        if self._queuesWrites():
+            # Only queued for the reactor, so the loop is not blocked
+            return func()
+        return await asyncio.get_running_loop().run_in_executor(_getWriter(), func)
+
+    def _attach(self, uuid: UUID):
+        with self.lock:
+            count = self.streams.get(uuid, 0)
+            self.streams[uuid] = count + 1
+            if count == 0:
+                self.bus.attach(self.cube, [uuid])
+
+    def _detach(self, uuid: UUID):
+        with self.lock:
+            count = self.streams[uuid] - 1
+            if count > 0:
+                self.streams[uuid] = count
+                return
+            del self.streams[uuid]
+            self.bus.detach(self.cube, [uuid])
+
+    async def getConfigProtocolVersion(self) -> str:
+        await self._run(partial(self.cube._write, UUIDs.CONFIG, encodeConfigProtocolVersionRequest(), True))
+        await asyncio.sleep(0.1)
+        data = await asyncio.wrap_future(self.cube.peer.readFuture(UUIDs.CONFIG))
+        version = decodeConfigProtocolVersionResponse(data)
+        self.cube.peer.setProtocolVersion(version)
+        return version
+
+    async def aclose(self):
+        """Releases the cube once the writes called so far have run."""
+        await self._run(lambda: None)
+        self.release()
+
+    def release(self):
+        self.bus.detach(self.cube)
+        self.cube.release()
+
+
+class AsyncNavigator:
+    """Navigator whose moves and rotations are awaited until they complete.
+
+    Cancelling the awaiting task, or its timeout, stops the cube.
+    """
+
+    def __init__(self, cube: AsyncCube, **kwargs):
+        self.cube = cube
+        self.nav = Navigator(cube.cube, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.nav, name)
+
+    async def move(self, targetX: float, targetY: float, tolerance: float, timeout: Optional[float] = None,
+                   moveRotateThreshold: float = 30, fixedSpeed: bool = False):
+        await self._run(lambda: self.nav.move(targetX, targetY, tolerance, moveRotateThreshold, fixedSpeed), timeout)
+
+    async def rotate(self, targetAngle: float, tolerance: float, timeout: Optional[float] = None):
+        await self._run(lambda: self.nav.rotate(targetAngle, tolerance), timeout)
+
+    async def _run(self, start: Callable[[], Any], timeout: Optional[float]):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def complete():
+            loop.call_soon_threadsafe(_setDone, future)
+
+        start()
+        command: NavigationCommandBase = self.nav.command
+        command.whenComplete(complete)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            if self.nav.command is command:
+                self.nav.setCommand(None)
+                self.nav.setMotor(0, 0)
+            raise
@@ -1,48 +1,330 @@
+"""Peer of a cube connected through bluepy, with the line reader of its helper process"""
 import logging as log
+import os
+import time
+from concurrent.futures import Future
 from queue import Empty, Queue
 from threading import Thread, currentThread
-from typing import Any, Callable, List, Optional, Mapping
+from typing import Any, Callable, Dict, Iterable, List, Optional, Mapping, Tuple, Union
 
-from bluepy.btle import (ADDR_TYPE_RANDOM, BTLEInternalError, DefaultDelegate,
-                         Peripheral, UUID)
+from bluepy.btle import (ADDR_TYPE_RANDOM, BluepyHelper, BTLEDisconnectError, BTLEException, BTLEGattError,
+                         BTLEInternalError, DefaultDelegate, Peripheral, UUID)
 
-from .cube import Peer, PeerListenerFunc
-import time
+from .constants import CHARACTERISTIC_IDS, CharacteristicID, UUIDs
+from .cube import Peer, PeerListenerFunc, TimedPeerListenerFunc
+from .handlecache import HandleCache
+from .messages import decodeConfigProtocolVersionResponse, encodeConfigProtocolVersionRequest
+from .reactor import Reactor
+from .stats import NANOS_PER_MILLI, PeerStats
+from .writequeue import QueueFullPolicy, WritePriority, WriteQueue
+
+# Motor writes (including emergency stops) go ahead of the light and sound effects
+DEFAULT_WRITE_PRIORITIES = {
+    UUIDs.MOTOR: WritePriority.HIGH,
+    UUIDs.LIGHT: WritePriority.LOW,
+    UUIDs.SOUND: WritePriority.LOW,
+}
+
+# Writes that replace each other while pending: the plain motor and acceleration controls
+# (but not the controls with targets, each of which has its own response) and any light
+DEFAULT_COALESCING_WRITES = (
+    (UUIDs.MOTOR, 0x01),
+    (UUIDs.MOTOR, 0x02),
+    (UUIDs.MOTOR, 0x05),
+    UUIDs.LIGHT,
+)
+
+# Seconds a read handed over to the reactor thread may take
+READ_TIMEOUT = 10
+
+
+class HelperReader:
+    """Line reader that replaces the stdout of the bluepy helper process.
+
+    bluepy reads the helper through a buffered text stream, so lines already pulled
+    into that buffer are invisible to poll(). This reader keeps its own buffer so the
+    notification loop knows exactly when complete lines are pending.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream  # keep the original pipe object alive as it owns the fd
+        self.fd = stream.fileno()
+        self.buffer = bytearray()
+        self.eof = False
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def fill(self) -> bool:
+        chunk = os.read(self.fd, 4096)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def hasLine(self) -> bool:
+        return b"\n" in self.buffer
+
+    def readline(self) -> str:
+        while True:
+            i = self.buffer.find(b"\n")
+            if i >= 0:
+                line = bytes(self.buffer[:i + 1])
+                del self.buffer[:i + 1]
+                return line.decode()
+            if self.eof or not self.fill():
+                line = bytes(self.buffer)
+                self.buffer.clear()
+                return line.decode()
+
+    def close(self):
+        self.stream.close()
+
+
+class _Operation:
+    """Read or write sent to the helper, waiting for its response."""
+    __slots__ = ('kind', 'handle', 'data', 'withResponse', 'future', 'retried', 'startTime')
+
+    def __init__(self, kind: str, handle: int, data: Optional[bytes] = None, withResponse: bool = False,
+                 future: Optional[Future] = None):
+        self.kind = kind
+        self.handle = handle
+        self.data = data
+        self.withResponse = withResponse
+        self.future = future
+        self.retried = False
+        self.startTime = 0
+
+    def command(self) -> str:
+        if self.kind == 'rd':
+            return "rd %X\n" % self.handle
+        return "%s %X %s\n" % ("wrr" if self.withResponse else "wr", self.handle, self.data.hex())
 
 
 class BlePeer(Peer, DefaultDelegate):
-    def __init__(self, address: str, iface: int = 0):
+    """Cube connected through bluepy.
+
+    On a reactor, the reactor thread only sends the reads and writes to the helper and handles
+    their responses among the notifications, one operation in flight at a time, so that it never
+    waits for a cube and a slow read of one cube does not hold up the notifications of the
+    others. The bluepy calls made on the reactor thread anyway (reads from the listeners and
+    the rediscovery of the handles) first wait for the operation in flight.
+    """
+
+    def __init__(self, address: str, iface: int = 0, eventDriven: bool = True, reactor: Optional[Reactor] = None,
+                 coalescingWrites: Iterable[Union[UUID, Tuple[UUID, int]]] = DEFAULT_COALESCING_WRITES,
+                 writePriorities: Mapping[UUID, WritePriority] = DEFAULT_WRITE_PRIORITIES,
+                 queueFullPolicy: QueueFullPolicy = QueueFullPolicy.BLOCK,
+                 handleCache: Optional[HandleCache] = None):
         super().__init__()
+        startTime = time.monotonic()
         self.peripheral: Peripheral = Peripheral(address, ADDR_TYPE_RANDOM, iface).withDelegate(self)
+        connectTime = time.monotonic()
         # self.peripheral.setMTU(92) # extend BLE packet size. to use Motor control with multiple targets specified. But not works well on Raspbian and Ubuntu18
         self.listeners: List[PeerListenerFunc] = list()
+        self.timedListeners: List[TimedPeerListenerFunc] = list()
+        self.sequences = [0 for _ in CharacteristicID]
         self.notificationThread: Optional[Thread] = None
-        self.writeQueue: Queue = Queue(100)
+        self.readQueue: Queue = Queue()
         self.uuidHandleMap: Mapping[UUID, int] = dict()
         self.handleUUIDMap: Mapping[int, UUID] = dict()
-        
-        for c in self.peripheral.getCharacteristics():
-            self.uuidHandleMap[c.uuid] = c.getHandle()
-            self.handleUUIDMap[c.getHandle()] = c.uuid
+        self.handleIDMap: Mapping[int, int] = dict()
+        self.handleCache = handleCache
+        self.usingCachedHandles = False
+        self.coalescingWrites = list(coalescingWrites)
+        self.writePriorities = dict(writePriorities)
+        self.reactor: Optional[Reactor] = None
+        self.registered = False
+        self.running = False
+        self.inFlight: Optional[_Operation] = None
+        # Nonzero while bluepy is called synchronously on the reactor thread
+        self.holding = 0
+
+        self.writeQueue = WriteQueue(100, policy=queueFullPolicy)
+        self.traffic = PeerStats()
+
+        cachedHandles = handleCache.get(address) if handleCache else None
+        if cachedHandles:
+            self._setHandles({UUID(u): h for (u, h) in cachedHandles.items()})
+            self.usingCachedHandles = True
+        else:
+            self._discoverHandles()
+        if handleCache:
+            self._checkProtocolVersion()
+
+        # Seconds spent in each phase of the setup
+        self.timings: Dict[str, float] = dict(connect=connectTime - startTime, discovery=time.monotonic() - connectTime)
+
+        if eventDriven or reactor:
+            self.helperReader = HelperReader(self.peripheral._helper.stdout)
+            self.peripheral._helper.stdout = self.helperReader
+            self.reactor = reactor if reactor else Reactor("Reactor for %s" % address, closeWhenUnused=True)
+            self.reactor.acquire()
+
+    def __str__(self):
+        return self.peripheral.addr
+
+    def _setHandles(self, uuidHandleMap: Mapping[UUID, int]):
+        self.uuidHandleMap = dict(uuidHandleMap)
+        self.handleUUIDMap = {h: u for (u, h) in uuidHandleMap.items()}
+        self.handleIDMap = {h: int(CHARACTERISTIC_IDS[u]) for (u, h) in uuidHandleMap.items() if u in CHARACTERISTIC_IDS}
+        keys = (_coalescingKey(self.uuidHandleMap, w) for w in self.coalescingWrites)
+        self.writeQueue.coalescingKeys = frozenset(k for k in keys if k is not None)
+        self.writeQueue.priorities = {self.uuidHandleMap[u]: p for (u, p) in self.writePriorities.items() if u in self.uuidHandleMap}
+
+    def _discoverHandles(self):
+        self._setHandles({c.uuid: c.getHandle() for c in self.peripheral.getCharacteristics()})
+        self.usingCachedHandles = False
+        if self.handleCache:
+            self.handleCache.put(self.peripheral.addr, {str(u): h for (u, h) in self.uuidHandleMap.items()})
+
+    def _refreshStaleHandles(self, handle: int) -> Optional[int]:
+        """Rediscovers the handles if they came from the cache, and returns the new handle
+        corresponding to the given one, or None if there was nothing to refresh."""
+        if not self.usingCachedHandles:
+            return None
+
+        log.warning("Cached handles of %s seem stale, rediscovering", self)
+        (uuid, offset) = (self.handleUUIDMap.get(handle), 0)
+        if uuid is None:
+            # Client characteristic configuration descriptor next to the characteristic
+            (uuid, offset) = (self.handleUUIDMap.get(handle - 1), 1)
+        self.handleCache.invalidate(self.peripheral.addr)
+        self._discoverHandles()
+        return self.uuidHandleMap[uuid] + offset if uuid in self.uuidHandleMap else None
+
+    def _checkProtocolVersion(self):
+        """Asks the cube for its protocol version, through the cached handles if any, so that stale
+        handles are rediscovered before anything is written to them without a response."""
+        try:
+            self._writeDirect(self.uuidHandleMap[UUIDs.CONFIG], encodeConfigProtocolVersionRequest(), True)
+            version = decodeConfigProtocolVersionResponse(self._readDirect(self.uuidHandleMap[UUIDs.CONFIG]))
+        except (KeyError, IndexError, ValueError, BTLEGattError) as ex:
+            if not self.usingCachedHandles:
+                log.warning("Failed to get the protocol version of %s: %s", self, repr(ex))
+                return
+            log.warning("Cached handles of %s seem stale, rediscovering: %s", self, repr(ex))
+            self.handleCache.invalidate(self.peripheral.addr)
+            self._discoverHandles()
+            self._checkProtocolVersion()
+            return
+        self.setProtocolVersion(version)
+
+    def setProtocolVersion(self, version: str):
+        if not self.handleCache:
+            return
+
+        if self.usingCachedHandles and not self.handleCache.matchesVersion(self.peripheral.addr, version):
+            log.info("Protocol version of %s changed to %s, rediscovering the handles", self, version)
+            self.handleCache.invalidate(self.peripheral.addr)
+            if self.reactor and self.registered:
+                self.reactor.call(lambda: self._direct(self._discoverHandles))
+            else:
+                self._discoverHandles()
+        self.handleCache.put(self.peripheral.addr, {str(u): h for (u, h) in self.uuidHandleMap.items()}, version)
 
     def disconnect(self):
+        if self.reactor:
+            if self.registered:
+                self.reactor.call(self._detachFromReactor)
+            self.reactor.release()
+        else:
+            self._stopNotificationThread()
         self.peripheral.disconnect()
 
+    def getWriteQueueStats(self) -> Dict[str, int]:
+        return self.writeQueue.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        result = self.traffic.snapshot()
+        result["writeQueue"] = dict(self.writeQueue.stats(),
+                                    wait=self.writeQueue.waitTime.snapshot(NANOS_PER_MILLI),
+                                    depthAtPut=self.writeQueue.putDepth.snapshot())
+        return result
+
+    def _isOffThread(self) -> bool:
+        if self.reactor:
+            return self.registered and not self.reactor.isReactorThread()
+        return self.notificationThread is not None and self.notificationThread != currentThread()
+
     def _read(self, handle: int) -> bytes:
-        return self.peripheral.readCharacteristic(handle)
-    
+        if self.reactor and self.registered and self.reactor.isReactorThread():
+            return self._direct(lambda: self._readDirect(handle))
+        if self.reactor and self._isOffThread():
+            # The reactor thread owns the helper pipe, so let it do the round trip
+            future: Future = Future()
+            self.readQueue.put((handle, future))
+            self.reactor.schedule(self)
+            return future.result(READ_TIMEOUT)
+        else:
+            return self._readDirect(handle)
+
+    def readFuture(self, uuid: UUID) -> Future:
+        if self.reactor and self._isOffThread():
+            future: Future = Future()
+            self.readQueue.put((self.uuidHandleMap[uuid], future))
+            self.reactor.schedule(self)
+            return future
+        return super().readFuture(uuid)
+
+    def _readDirect(self, handle: int) -> bytes:
+        startTime = time.monotonic_ns()
+        try:
+            try:
+                data = self.peripheral.readCharacteristic(handle)
+            except BTLEGattError:
+                newHandle = self._refreshStaleHandles(handle)
+                if newHandle is None:
+                    raise
+                data = self.peripheral.readCharacteristic(newHandle)
+        except Exception:
+            self.traffic.failedReads += 1
+            raise
+
+        self.traffic.recordRead(time.monotonic_ns() - startTime)
+        return data
+
+    def _writeDirect(self, handle: int, data: bytes, withResponse: bool):
+        try:
+            try:
+                self.peripheral.writeCharacteristic(handle, data, withResponse)
+            except BTLEGattError:
+                newHandle = self._refreshStaleHandles(handle)
+                if newHandle is None:
+                    raise
+                self.peripheral.writeCharacteristic(newHandle, data, withResponse)
+        except Exception:
+            self.traffic.failedWrites += 1
+            raise
+
+        self.traffic.recordWrite(len(data))
+
     def _write(self, handle: int, data: bytes, withResponse: bool = False):
-        if self.notificationThread and self.notificationThread != currentThread():
-            self.writeQueue.put((handle, data, withResponse))
+        if self.reactor and self.registered and self.reactor.isReactorThread():
+            if 0 < self.writeQueue.maxsize <= len(self.writeQueue):
+                # Nothing else drains the queue, so waiting for room would never end
+                self._direct(lambda: self._writeDirect(handle, data, withResponse))
+            else:
+                self.writeQueue.put(handle, data, withResponse)
+                self._sendNextOperation()
+        elif self._isOffThread():
+            self.writeQueue.put(handle, data, withResponse)
+            if self.reactor:
+                self.reactor.schedule(self)
         else:
-            self.peripheral.writeCharacteristic(handle, data, withResponse)
-    
+            self._writeDirect(handle, data, withResponse)
+
     def _enableNotification(self, handle: int, value: bool = True):
-        if value and not self.notificationThread:
-            self._startNotificationThread()
+        if value:
+            if self.reactor and not self.registered:
+                self.reactor.register(self)
+                self.registered = True
+            elif not self.reactor and not self.notificationThread:
+                self._startNotificationThread()
 
         self._write(handle+1, bytes([int(value), 0]))
-        
+
     def read(self, uuid: UUID) -> bytes:
         return self._read(self.uuidHandleMap[uuid])
 
@@ -55,21 +337,180 @@ class BlePeer(Peer, DefaultDelegate):
     def addListener(self, listener: PeerListenerFunc):
         self.listeners.append(listener)
 
+    def addTimedListener(self, listener: TimedPeerListenerFunc):
+        self.timedListeners.append(listener)
+
     def handleNotification(self, handle: int, data: bytes):
+        # Stamp before running any listener so slow listeners do not shift the time
+        now = time.monotonic_ns()
+        charId = self.handleIDMap.get(handle)
+        if charId is None:
+            return
+
+        self.traffic.recordNotification(charId, len(data), now)
+        self.sequences[charId] += 1
+        sequence = self.sequences[charId]
         for listener in self.listeners:
-            listener(self.handleUUIDMap[handle], data)
+            listener(charId, data)
+        for timedListener in self.timedListeners:
+            timedListener(charId, data, now, sequence)
+
+    def processPendingOperations(self):
+        self._sendNextOperation()
+
+    def _sendNextOperation(self):
+        """Sends the next queued write, or else read, unless an operation is in flight."""
+        if self.inFlight is not None or self.holding or not self.registered:
+            return
+
+        try:
+            (handle, data, withResponse) = self.writeQueue.get()
+            self._sendOperation(_Operation('wr', handle, data, withResponse))
+            return
+        except Empty:
+            pass
+
+        try:
+            while True:
+                (handle, future) = self.readQueue.get(False)
+                if future.set_running_or_notify_cancel():
+                    self._sendOperation(_Operation('rd', handle, future=future))
+                    return
+        except Empty:
+            pass
+
+    def _sendOperation(self, op: _Operation):
+        op.startTime = time.monotonic_ns()
+        self.inFlight = op
+        try:
+            self.peripheral._writeCmd(op.command())
+        except Exception as ex:
+            self.inFlight = None
+            self._failOperation(op, ex)
+
+    def _handleResponse(self, resp: Dict[str, Any]):
+        op = self.inFlight
+        if op is None:
+            log.debug("Ignored a response of bluepy-helper with no operation in flight: %s", resp)
+            return
+
+        self.inFlight = None
+        if resp['rsp'][0] == 'err':
+            ex = _helperError(resp)
+            if isinstance(ex, BTLEGattError) and not op.retried:
+                newHandle = self._direct(lambda: self._refreshStaleHandles(op.handle))
+                if newHandle is not None:
+                    (op.handle, op.retried) = (newHandle, True)
+                    self._sendOperation(op)
+                    return
+            self._failOperation(op, ex)
+        elif op.kind == 'rd':
+            self.traffic.recordRead(time.monotonic_ns() - op.startTime)
+            op.future.set_result(resp['d'][0])
+        else:
+            self.traffic.recordWrite(len(op.data))
+
+        self._sendNextOperation()
+
+    def _failOperation(self, op: _Operation, ex: Exception):
+        if op.kind == 'rd':
+            self.traffic.failedReads += 1
+            op.future.set_exception(ex)
+        else:
+            self.traffic.failedWrites += 1
+            log.warning("Failed to write to the handle 0x%x of %s: %s", op.handle, self, repr(ex))
+
+    def _waitForOperation(self):
+        while self.inFlight is not None:
+            line = self.helperReader.readline()
+            if not line or not self._processHelperLine(line):
+                raise BTLEDisconnectError("%s is disconnected" % self)
+
+    def _direct(self, func: Callable[[], Any]) -> Any:
+        """Calls bluepy on the reactor thread, after the response of the operation in flight, so bluepy does not take it."""
+        self.holding += 1
+        try:
+            self._waitForOperation()
+            return func()
+        finally:
+            self.holding -= 1
+            if not self.holding:
+                self.reactor.schedule(self)
+
+    def _detachFromReactor(self):
+        self.holding += 1
+        try:
+            # Writes queued before the disconnection (such as stopping the motors) still go out
+            self._waitForOperation()
+            while True:
+                self._writeDirect(*self.writeQueue.get())
+        except (BTLEException, Empty):
+            pass
+        self.reactor.unregister(self)
+        self.registered = False
+        self.holding -= 1
+
+    def processHelperExit(self):
+        self.registered = False
+        ex = BTLEDisconnectError("%s is disconnected" % self)
+        (op, self.inFlight) = (self.inFlight, None)
+        if op is not None:
+            self._failOperation(op, ex)
+        try:
+            while True:
+                (_, future) = self.readQueue.get(False)
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(ex)
+        except Empty:
+            pass
+
+    def processHelperLines(self):
+        while self.helperReader.hasLine():
+            if not self._processHelperLine(self.helperReader.readline()):
+                return
+
+    def _processHelperLine(self, line: str) -> bool:
+        """Handles a line of the helper, and returns False once the cube is disconnected."""
+        if line.startswith('#') or line == '\n':
+            return True
+
+        resp = BluepyHelper.parseResp(line)
+        respType = resp.get('rsp', [None])[0]
+        if respType == 'ntfy' or respType == 'ind':
+            self.handleNotification(resp['hnd'][0], resp['d'][0])
+        elif respType == 'rd' or respType == 'wr' or respType == 'err':
+            self._handleResponse(resp)
+        elif respType == 'stat' and resp.get('state', [None])[0] == 'disc':
+            log.warning("%s is disconnected", self)
+            self.reactor.unregister(self)
+            self.processHelperExit()
+            return False
+        else:
+            log.debug("Ignored unexpected response from bluepy-helper: %s", resp)
+        return True
 
     def _startNotificationThread(self):
         t = Thread(name="Notification for %s" % self, target=self._processNotifications)
         t.setDaemon(True)
         self.notificationThread = t
+        self.running = True
         t.start()
 
+    def _stopNotificationThread(self):
+        t = self.notificationThread
+        if not t:
+            return
+
+        self.running = False
+        if t != currentThread():
+            t.join()
+        self.notificationThread = None
+
     def _processNotifications(self):
-        while True:
+        while self.running:
             try:
                 while True:
-                    writeArgs = self.writeQueue.get(False)
+                    writeArgs = self.writeQueue.get()
                     self._write(*writeArgs)
             except Empty:
                 pass
@@ -78,3 +519,19 @@ class BlePeer(Peer, DefaultDelegate):
                 self.peripheral.waitForNotifications(0.01)
             except BTLEInternalError as ex:
                 log.warn(ex)
+
+
+def _helperError(resp: Dict[str, Any]) -> Exception:
+    # As bluepy raises them
+    code = resp.get('code', [None])[0]
+    if code == 'atterr':
+        return BTLEGattError("Bluetooth command failed", resp)
+    return BTLEException("Error from bluepy-helper (%s)" % code, resp)
+
+
+def _coalescingKey(uuidHandleMap: Mapping[UUID, int], write: Union[UUID, Tuple[UUID, int]]) -> Any:
+    (uuid, leadingByte) = write if isinstance(write, tuple) else (write, None)
+    handle = uuidHandleMap.get(uuid)
+    if handle is None or leadingByte is None:
+        return handle
+    return (handle, leadingByte)
@@ -1,3 +1,6 @@
+from enum import IntEnum
+from typing import Dict
+
 from bluepy.btle import UUID
 
 
@@ -16,3 +19,28 @@ class UUIDs:
     BUTTON = UUID("10B20107-5B3B-4571-9508-CF3EFCD7BBAE")
     BATTERY = UUID("10B20108-5B3B-4571-9508-CF3EFCD7BBAE")
     CONFIG = UUID("10B201FF-5B3B-4571-9508-CF3EFCD7BBAE")
+
+
+class CharacteristicID(IntEnum):
+    """Small integer IDs of the characteristics, used to index dispatch tables."""
+
+    TOIO_ID = 0
+    MOTOR = 1
+    LIGHT = 2
+    SOUND = 3
+    MOTION = 4
+    BUTTON = 5
+    BATTERY = 6
+    CONFIG = 7
+
+
+CHARACTERISTIC_IDS: Dict[UUID, CharacteristicID] = {
+    UUIDs.TOIO_ID: CharacteristicID.TOIO_ID,
+    UUIDs.MOTOR: CharacteristicID.MOTOR,
+    UUIDs.LIGHT: CharacteristicID.LIGHT,
+    UUIDs.SOUND: CharacteristicID.SOUND,
+    UUIDs.MOTION: CharacteristicID.MOTION,
+    UUIDs.BUTTON: CharacteristicID.BUTTON,
+    UUIDs.BATTERY: CharacteristicID.BATTERY,
+    UUIDs.CONFIG: CharacteristicID.CONFIG,
+}
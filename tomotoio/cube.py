@@ -1,12 +1,18 @@
-from collections import defaultdict
-from time import sleep
-from typing import Any, Callable, Dict, Generic, TypeVar, Union
+from concurrent.futures import Future
+from time import monotonic_ns, sleep
+from typing import Any, Callable, Dict, Generic, List, Mapping, Optional, Tuple, TypeVar, Union
 from bluepy.btle import UUID
 
-from .constants import UUIDs
+from .constants import CHARACTERISTIC_IDS, CharacteristicID, UUIDs
+from .eventqueue import EventQueue, OverflowPolicy, PolicyKey, createEventQueues
 from .messages import *
+from .stats import NANOS_PER_MILLI, Histogram
+from .targetcontrol import TargetControlTracker
 
-PeerListenerFunc = Callable[[UUID, bytes], Any]
+# Receives the CharacteristicID of the notification and its raw bytes
+PeerListenerFunc = Callable[[int, bytes], Any]
+# Also receives the receive time in nanoseconds and the sequence number per characteristic
+TimedPeerListenerFunc = Callable[[int, bytes, int, int], Any]
 
 
 class Peer:
@@ -25,39 +31,146 @@ class Peer:
     def addListener(self, listener: PeerListenerFunc):
         raise NotImplementedError()
 
+    def addTimedListener(self, listener: TimedPeerListenerFunc):
+        """Adds a listener that also receives the receive time and the sequence number of each notification.
+
+        This stamps the notifications when the peer calls its listeners. Peers that can stamp
+        them earlier override it.
+        """
+        sequences = [0 for _ in CharacteristicID]
+
+        def stamp(charId: int, data: bytes):
+            sequences[charId] += 1
+            listener(charId, data, self.now(), sequences[charId])
+
+        self.addListener(stamp)
+
+    def readFuture(self, uuid: UUID) -> Future:
+        """Starts reading the characteristic and returns the future of the bytes.
+
+        This reads right away on the calling thread. Peers doing their I/O on another thread
+        override it, so the caller does not wait for the round trip.
+        """
+        future: Future = Future()
+        try:
+            future.set_result(self.read(uuid))
+        except Exception as ex:
+            future.set_exception(ex)
+        return future
+
+    def now(self) -> int:
+        """Returns the time of the clock the notifications are stamped with, in nanoseconds."""
+        return monotonic_ns()
+
+    def setProtocolVersion(self, version: str):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return dict()
+
+
+# Codecs of the characteristics notifying more than one type of event
+EVENT_CODECS = {
+    CharacteristicID.TOIO_ID: TOIO_ID_CODEC,
+    CharacteristicID.MOTION: MOTION_CODEC,
+    CharacteristicID.MOTOR: MOTOR_CODEC,
+}
 
 T = TypeVar('T')
 CubeListenerFunc = Callable[[Any], Any]
 
 
 class ReadableProperty(Generic[T]):
-    def __init__(self, cube: 'Cube', uuid: UUID, decoder: Callable[[bytes], T]):
+    def __init__(self, cube: 'Cube', uuid: UUID, decoder: Callable[[bytes], T],
+                 readTypes: Optional[Tuple[type, ...]] = None):
         self.cube = cube
         self.uuid = uuid
+        self.charId = CHARACTERISTIC_IDS[uuid]
         self.decoder = decoder
-
-    def get(self) -> T:
-        return self.decoder(self.cube.peer.read(self.uuid))
+        # Leading bytes of the payloads a read returns, when the characteristic notifies other types as well
+        codec = EVENT_CODECS.get(self.charId)
+        self.readBytes: Optional[List[int]] = \
+            sorted(set(b for t in readTypes for b in codec.leadingBytes(t))) if codec and readTypes else None
+
+    def get(self, maxAge: Optional[float] = None) -> T:
+        """Returns the value of the characteristic.
+
+        Keyword Arguments:
+            maxAge {Optional[float]} -- Seconds the last value received by notification or read can be
+                                        reused for instead of reading the cube (default: {None}, always read).
+                                        Only the notified types a read returns are reused, e.g. Motion
+                                        rather than TiltEuler for the motion characteristic.
+
+        Returns:
+            T -- Decoded value
+        """
+        cached = self._cached(maxAge)
+        if cached is not None:
+            return self.decoder(cached)
+        return self._store(self.cube.peer.read(self.uuid))
+
+    def _cached(self, maxAge: Optional[float]) -> Optional[bytes]:
+        if maxAge is not None:
+            if self.readBytes is None:
+                last = self.cube.lastValues[self.charId]
+            else:
+                byLeadingByte = self.cube.lastValuesByLeadingByte[self.charId]
+                last = max((byLeadingByte[b] for b in self.readBytes if byLeadingByte[b]),
+                           key=lambda v: v[1], default=None)
+            if last and self.cube.peer.now() - last[1] < maxAge * 1e9:
+                return last[0]
+        return None
+
+    def _store(self, data: bytes) -> T:
+        self.cube._storeLastValue(self.charId, data, self.cube.peer.now())
+        return self.decoder(data)
+
+    def age(self) -> Optional[float]:
+        """Returns the seconds since the last value was received, or None if nothing was received yet."""
+        last = self.cube.lastValues[self.charId]
+        return (self.cube.peer.now() - last[1]) / 1e9 if last else None
 
     def enableNotification(self, value=True):
         self.cube.peer.enableNotification(self.uuid, value)
 
-    def addListener(self, listener: CubeListenerFunc):
-        self.cube.addListener(self.uuid, listener)
+    def addListener(self, listener: CubeListenerFunc, envelope: bool = False):
+        self.cube.addListener(self.uuid, listener, envelope)
 
 
 class Cube:
     def __init__(self, peer: Peer, name: str):
         self.peer = peer
         self.name = name
-        self.listeners: Dict[int, List[CubeListenerFunc]] = defaultdict(lambda: list())
+        self.listeners: List[List[CubeListenerFunc]] = [list() for _ in CharacteristicID]
+        self.envelopeListeners: List[List[CubeListenerFunc]] = [list() for _ in CharacteristicID]
+        self.decoders: List[Optional[Callable[[bytes], Any]]] = [None for _ in CharacteristicID]
+        self.decoders[CharacteristicID.MOTION] = decodeMotion
+        self.decoders[CharacteristicID.BUTTON] = decodeButton
+        self.decoders[CharacteristicID.TOIO_ID] = decodeToioID
+        self.decoders[CharacteristicID.MOTOR] = decodeMotor
+        # Nanoseconds spent in decoding and calling the listeners per notification
+        self.listenerTime: List[Histogram] = [Histogram() for _ in CharacteristicID]
+        # Raw bytes and receive time (peer.now()) of the last notification or read per characteristic
+        self.lastValues: List[Optional[Tuple[bytes, int]]] = [None for _ in CharacteristicID]
+        # The same per leading byte, for the characteristics notifying more than one type of event
+        self.lastValuesByLeadingByte: List[Optional[List[Optional[Tuple[bytes, int]]]]] = \
+            [[None] * 256 if charId in EVENT_CODECS else None for charId in CharacteristicID]
+        # Listeners added by event type per characteristic and leading byte, as (eventType, listener, envelope)
+        self.eventListeners: List[Optional[List[Tuple[Tuple[type, CubeListenerFunc, bool], ...]]]] = \
+            [None for _ in CharacteristicID]
+        # Queues the notifications are handed over to per characteristic, None to call the listeners right away
+        self.eventQueues: List[Optional[EventQueue]] = [None for _ in CharacteristicID]
+        # Futures of the pending motor controls with targets
+        self.targetControls = TargetControlTracker(peer.now, lambda: self.setMotor(0, 0))
+        self.targetResponsesEnabled = False
         self.toioID = ReadableProperty[Union[PositionID, StandardID, MissedID]](self, UUIDs.TOIO_ID, decodeToioID)
-        self.motion = ReadableProperty[Union[Motion, MagneticForce, TiltEuler, TiltQuaternion]](self, UUIDs.MOTION, decodeMotion)
+        self.motion = ReadableProperty[Union[Motion, MagneticForce, TiltEuler, TiltQuaternion]](self, UUIDs.MOTION, decodeMotion, (Motion,))
         self.button = ReadableProperty[bool](self, UUIDs.BUTTON, decodeButton)
         self.battery = ReadableProperty[int](self, UUIDs.BATTERY, decodeBattery)
-        self.motor = ReadableProperty[Union[Motor, MotorSpeed]](self, UUIDs.MOTOR, decodeMotor)
+        self.motor = ReadableProperty[Union[Motor, MotorSpeed]](self, UUIDs.MOTOR, decodeMotor, (MotorSpeed,))
 
-        peer.addListener(self._handleNotification)
+        peer.addTimedListener(self._handleNotification)
+        self.addEventListener(Motor, self.targetControls.handleResponse)
 
     def _read(self, uuid: UUID) -> bytes:
         return self.peer.read(uuid)
@@ -68,32 +181,149 @@ class Cube:
     def _enableNotification(self, uuid: UUID, value: bool = True):
         self.peer.enableNotification(uuid, value)
 
-    def _handleNotification(self, uuid: UUID, data: bytes):
-        e: Any
-        if uuid == UUIDs.MOTION:
-            e = decodeMotion(data)
-        elif uuid == UUIDs.BUTTON:
-            e = decodeButton(data)
-        elif uuid == UUIDs.TOIO_ID:
-            e = decodeToioID(data)
-        elif uuid == UUIDs.MOTOR:
-            e = decodeMotor(data)
+    def _handleNotification(self, charId: int, data: bytes, timestamp: Optional[int] = None, sequence: int = 0):
+        if timestamp is None:
+            timestamp = self.peer.now()
+        self._storeLastValue(charId, data, timestamp)
+        if self.targetControls.pending:
+            # Responses may get lost, so overdue controls fail as long as anything is notified
+            self.targetControls.expire(timestamp)
+
+        queue = self.eventQueues[charId]
+        if queue is not None:
+            queue.put(charId, data, timestamp, sequence)
         else:
-            e = data
-
-        for listener in self.listeners[uuid]:
+            self._deliver(charId, data, timestamp, sequence)
+
+    def _storeLastValue(self, charId: int, data: bytes, timestamp: int):
+        last = (data, timestamp)
+        self.lastValues[charId] = last
+        byLeadingByte = self.lastValuesByLeadingByte[charId]
+        if byLeadingByte is not None and data:
+            byLeadingByte[data[0]] = last
+
+    def _deliver(self, charId: int, data: bytes, timestamp: int, sequence: int):
+        listeners = self.listeners[charId]
+        envelopeListeners = self.envelopeListeners[charId]
+        eventListeners = self.eventListeners[charId]
+        # Peek the leading byte, so the payloads of the types nobody listens to are not decoded
+        eventListeners = eventListeners[data[0]] if eventListeners and data else None
+        if not listeners and not envelopeListeners and not eventListeners:
+            return
+
+        startTime = monotonic_ns()
+        decoder = self.decoders[charId]
+        e = decoder(data) if decoder else data
+
+        for listener in listeners:
             listener(e)
+        envelope = Envelope(charId, e, timestamp, sequence) if envelopeListeners else None
+        for listener in envelopeListeners:
+            listener(envelope)
+        if eventListeners:
+            for (eventType, listener, wantsEnvelope) in eventListeners:
+                if not isinstance(e, eventType):
+                    continue
+                if wantsEnvelope:
+                    if envelope is None:
+                        envelope = Envelope(charId, e, timestamp, sequence)
+                    listener(envelope)
+                else:
+                    listener(e)
+        self.listenerTime[charId].record(monotonic_ns() - startTime)
+
+    def startEventQueues(self, capacity: int = 64, policies: Optional[Mapping[PolicyKey, OverflowPolicy]] = None,
+                         perCharacteristic: bool = False):
+        """Hands the notifications over to worker threads instead of calling the listeners on the receiving thread.
+
+        Keyword Arguments:
+            capacity {int} -- Notifications kept per characteristic before the overflow policy applies (default: {64})
+            policies {Optional[Mapping[PolicyKey, OverflowPolicy]]} -- Overflow policies per characteristic, or per
+                (characteristic, leading byte) for a lane of its own (default: {None}, DEFAULT_OVERFLOW_POLICIES
+                and DROP_OLDEST for the others)
+            perCharacteristic {bool} -- Whether each characteristic has its own worker thread, rather than one
+                worker per cube calling the listeners in the order of arrival (default: {False})
+        """
+        self.stopEventQueues()
+        queues = createEventQueues(self._deliver, perCharacteristic, "Events of %s" % self.name,
+                                   capacity=capacity, policies=policies)
+        for q in set(q for q in queues if q is not None):
+            q.start()
+        self.eventQueues = queues
+
+    def stopEventQueues(self, drain: bool = True):
+        queues = set(q for q in self.eventQueues if q is not None)
+        self.eventQueues = [None for _ in CharacteristicID]
+        for q in queues:
+            q.stop(drain)
 
     def release(self):
+        self.targetControls.cancelAll()
         self.peer.disconnect()
-
-    def addListener(self, uuid: UUID, listener: CubeListenerFunc):
-        self.listeners[uuid].append(listener)
+        self.stopEventQueues(False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns a snapshot of the traffic statistics of the peer and the time spent in the listeners.
+
+        Times are in milliseconds. Long inter-arrival times with idle listeners point to the BLE
+        link, while listener times close to the inter-arrival times mean the listeners cannot keep up.
+        """
+        result = self.peer.stats()
+        result["listeners"] = {c.name: self.listenerTime[c].snapshot(NANOS_PER_MILLI)
+                               for c in CharacteristicID if self.listenerTime[c].count}
+        queues = list(dict.fromkeys(q for q in self.eventQueues if q is not None))
+        if queues:
+            result["eventQueues"] = [q.stats() for q in queues]
+        return result
+
+    def addListener(self, uuid: UUID, listener: CubeListenerFunc, envelope: bool = False):
+        """Adds a listener of the notifications of the characteristic.
+
+        With envelope=True, the listener receives an Envelope carrying the receive time and the
+        sequence number of the notification instead of the bare event.
+        """
+        (self.envelopeListeners if envelope else self.listeners)[CHARACTERISTIC_IDS[uuid]].append(listener)
+
+    def removeListener(self, uuid: UUID, listener: CubeListenerFunc, envelope: bool = False):
+        listeners = (self.envelopeListeners if envelope else self.listeners)[CHARACTERISTIC_IDS[uuid]]
+        if listener in listeners:
+            listeners.remove(listener)
+
+    def addEventListener(self, eventType: type, listener: CubeListenerFunc, envelope: bool = False):
+        """Adds a listener of the events of a type, e.g. PositionID, MissedID, Motion, TiltEuler or MotorSpeed.
+
+        Only the events of the type (or its subclasses) are delivered to the listener, and the
+        notifications of the types nobody listens to are not even decoded.
+        """
+        for (charId, codec) in EVENT_CODECS.items():
+            leadingBytes = codec.leadingBytes(eventType)
+            if not leadingBytes:
+                continue
+
+            table = self.eventListeners[charId]
+            if table is None:
+                table = self.eventListeners[charId] = [() for _ in range(256)]
+            for b in leadingBytes:
+                # The entries are replaced rather than modified, so they can be iterated without a lock
+                table[b] = table[b] + ((eventType, listener, envelope),)
+            return
+
+        raise ValueError("No notification decodes to %s" % eventType.__name__)
+
+    def removeEventListener(self, eventType: type, listener: CubeListenerFunc):
+        for table in self.eventListeners:
+            if table is None:
+                continue
+            for (b, entries) in enumerate(table):
+                if entries:
+                    table[b] = tuple(x for x in entries if not (x[0] is eventType and x[1] == listener))
 
     def getConfigProtocolVersion(self) -> str:
         self._write(UUIDs.CONFIG, encodeConfigProtocolVersionRequest(), True)
         sleep(0.1)
-        return decodeConfigProtocolVersionResponse(self._read(UUIDs.CONFIG))
+        version = decodeConfigProtocolVersionResponse(self._read(UUIDs.CONFIG))
+        self.peer.setProtocolVersion(version)
+        return version
 
     def setMotor(self, left: float, right: float, duration: float = 0):
         self._write(UUIDs.MOTOR, encodeMotor(int(left), int(right), duration))
@@ -119,11 +349,27 @@ class Cube:
         sleep(dur*2 + 0.2)
     
 
-    def setMotorWithTarget(self, ctrlid: int, x: int, y: int, maxspeed: int = 10, speedtype: int = SpeedChangeType.CONSTANT, movingtype: int = MovementType.ROTATING, angletype: int = TargetPointAngleType.NO_ROTATION, deg: int = 0, timeout: int = 0):
-      self._write(UUIDs.MOTOR, encodeMotorTarget(ctrlid, x, y, timeout, movingtype, maxspeed, speedtype, angletype, deg))
+    def setMotorWithTarget(self, ctrlid: Optional[int], x: int, y: int, maxspeed: int = 10, speedtype: int = SpeedChangeType.CONSTANT, movingtype: int = MovementType.ROTATING, angletype: int = TargetPointAngleType.NO_ROTATION, deg: int = 0, timeout: int = 0) -> Future:
+        """Moves to the target, and returns the future of the MotorResult of the control.
+
+        A free control ID is allocated when ctrlid is None. Cancelling the future stops the motors.
+        """
+        (ctrlid, future) = self._startTargetControl(MotorInfoType.WITH_TARGET, ctrlid, timeout)
+        self._write(UUIDs.MOTOR, encodeMotorTarget(ctrlid, x, y, timeout, movingtype, maxspeed, speedtype, angletype, deg))
+        return future
 
-    def setMotorWithMultipleTargets(self, ctrlid: int, goals, maxspeed: int = 10, speedtype: int = SpeedChangeType.CONSTANT, movingtype: int = MovementType.ROTATING, addwritemode:int = AdditionalWriteSettingType.ADD, timeout: int = 0):
+    def setMotorWithMultipleTargets(self, ctrlid: Optional[int], goals, maxspeed: int = 10, speedtype: int = SpeedChangeType.CONSTANT, movingtype: int = MovementType.ROTATING, addwritemode:int = AdditionalWriteSettingType.ADD, timeout: int = 0) -> Future:
+        """Moves through the targets, and returns the future of the MotorResult of the control as setMotorWithTarget does."""
+        (ctrlid, future) = self._startTargetControl(MotorInfoType.WITH_MULTIPLE_TARGETS, ctrlid, timeout)
         self._write(UUIDs.MOTOR, encodeMotorMultipleTargets(ctrlid, goals, addwritemode, timeout, movingtype, maxspeed, speedtype))
+        return future
+
+    def _startTargetControl(self, controlType: int, ctrlid: Optional[int], timeout: int) -> Tuple[int, Future]:
+        if not self.targetResponsesEnabled:
+            # The futures are resolved by the responses notified on the motor characteristic
+            self.targetResponsesEnabled = True
+            self._enableNotification(UUIDs.MOTOR)
+        return self.targetControls.start(controlType, ctrlid, timeout)
 
     def setMotorWithAcceleration(self, transspeed: int, transaccel: int, traveldirection: int = DirectionType.FORWARD, turnspeed: int = 0, turndirection: int = DirectionType.FORWARD, priority:int = SpeedPriorityType.TRANSITION, duration: float = 0):
         self._write(UUIDs.MOTOR, encodeMotorAcceleration(transspeed, transaccel, turnspeed, turndirection, traveldirection, priority, duration))
@@ -1,4 +1,10 @@
 from enum import Enum, IntEnum
+from typing import Any, Dict, Optional
+
+
+def _fields(obj: Any) -> Dict[str, Any]:
+    """Returns the attributes of an object with __slots__, like vars() does for a plain object."""
+    return {name: getattr(obj, name) for cls in reversed(type(obj).__mro__) for name in getattr(cls, '__slots__', ())}
 
 
 class ToioIDType(Enum):
@@ -9,7 +15,17 @@ class ToioIDType(Enum):
 
 
 class ToioID:
-    def __init__(self, type: ToioIDType):
+    # The type is fixed per subclass, so it is a class attribute rather than a slot
+    __slots__ = ()
+    type = ToioIDType.INVALID
+
+    def __init__(self, type: Optional[ToioIDType] = None):
+        # The type used to be passed in, so it is still accepted: checked against the class,
+        # or kept per instance by subclasses without __slots__ as it was before
+        if type is None or type == self.type:
+            return
+        if not hasattr(self, '__dict__'):
+            raise ValueError("%s is of type %s, not %s" % (self.__class__.__name__, self.type, type))
         self.type = type
 
     def isPosition(self):
@@ -19,15 +35,20 @@ class ToioID:
         return self.type == ToioIDType.STANDARD
 
     def isMissed(self):
-        return self.type == ToioIDType.POSITION_MISSED
+        return self.type == ToioIDType.MISSED
+
+    def isEstimated(self):
+        return False
 
     def __str__(self):
-        return str(vars(self))
+        return str(dict(type=self.type, **_fields(self)))
 
 
 class PositionID(ToioID):
+    __slots__ = ('x', 'y', 'angle', 'sensorX', 'sensorY', 'sensorAngle')
+    type = ToioIDType.POSITION
+
     def __init__(self, x: float, y: float, angle: float, sensorX: float, sensorY: float, sensorAngle: float):
-        super().__init__(ToioIDType.POSITION)
         self.x = x
         self.y = y
         self.angle = angle
@@ -36,16 +57,32 @@ class PositionID(ToioID):
         self.sensorAngle = sensorAngle
 
 
+class EstimatedPositionID(PositionID):
+    """Position dead-reckoned while the mat cannot be read, with its uncertainty in mat units."""
+    __slots__ = ('uncertainty',)
+
+    def __init__(self, x: float, y: float, angle: float, uncertainty: float):
+        super().__init__(x, y, angle, x, y, angle)
+        self.uncertainty = uncertainty
+
+    def isEstimated(self):
+        return True
+
+
 class StandardID(ToioID):
+    __slots__ = ('value', 'angle')
+    type = ToioIDType.STANDARD
+
     def __init__(self, value: float, angle: float):
-        super().__init__(ToioIDType.STANDARD)
         self.value = value
         self.angle = angle
 
 
 class MissedID(ToioID):
+    __slots__ = ('fromType',)
+    type = ToioIDType.MISSED
+
     def __init__(self, fromType: ToioIDType):
-        super().__init__(ToioIDType.MISSED)
         self.fromType = fromType
 
 class Orientation(Enum):
@@ -58,6 +95,8 @@ class Orientation(Enum):
     LEFT_UP = 6
 
 class Motion:
+    __slots__ = ('isLevel', 'collision', 'doubleTap', 'orientation', 'shake')
+
     def __init__(self, isLevel: bool, collision: bool, doubleTap: bool, orientation: Orientation, shake: int):
         self.isLevel = isLevel
         self.collision = collision
@@ -66,7 +105,7 @@ class Motion:
         self.shake = shake
 
     def __str__(self):
-        return str(vars(self))
+        return str(_fields(self))
 
 
 class Light:
@@ -86,36 +125,44 @@ class Note:
         self.volume = volume
 
 class Motor:
+    __slots__ = ('type', 'id', 'result')
+
     def __init__(self, ctrltype: int, ctrlid: int, result: int):
         self.type = ctrltype
         self.id = ctrlid
         self.result = result
 
     def __str__(self):
-        return str(vars(self))
+        return str(_fields(self))
 
 
 class MotorSpeed:
+    __slots__ = ('type', 'left', 'right')
+
     def __init__(self, ctrltype: int, left: int, right: int):
         self.type = ctrltype
         self.left = left
         self.right = right
 
     def __str__(self):
-        return str(vars(self))
+        return str(_fields(self))
 
 
 class TiltEuler:
+    __slots__ = ('roll', 'pitch', 'yaw')
+
     def __init__(self, roll: int, pitch: int, yaw: int):
         self.roll = roll
         self.pitch = pitch
         self.yaw = yaw
 
     def __str__(self):
-        return str(vars(self))
+        return str(_fields(self))
 
 
 class TiltQuaternion:
+    __slots__ = ('w', 'x', 'y', 'z')
+
     def __init__(self, w: int, x: int, y: int, z: int):
         self.w = w
         self.x = x
@@ -123,10 +170,12 @@ class TiltQuaternion:
         self.z = z
 
     def __str__(self):
-        return str(vars(self))
+        return str(_fields(self))
 
 
 class MagneticForce:
+    __slots__ = ('status', 'strength', 'x', 'y', 'z')
+
     def __init__(self, status: int, strength: int ,x: int, y: int, z: int):
         self.status = status
         self.strength = strength
@@ -135,7 +184,25 @@ class MagneticForce:
         self.z = z
 
     def __str__(self):
-        return str(vars(self))
+        return str(_fields(self))
+
+
+class Envelope:
+    """Decoded event with the time it was received and its sequence number.
+
+    timestamp is in nanoseconds of the clock of the peer (time.monotonic_ns() for the BLE
+    peers), and sequence counts the notifications of the characteristic from 1.
+    """
+    __slots__ = ('charId', 'event', 'timestamp', 'sequence')
+
+    def __init__(self, charId: int, event: Any, timestamp: int, sequence: int):
+        self.charId = charId
+        self.event = event
+        self.timestamp = timestamp
+        self.sequence = sequence
+
+    def __str__(self):
+        return str(_fields(self))
 
 
 class PostureType(IntEnum):
@@ -0,0 +1,236 @@
+"""Single stream of the events of a fleet of cubes"""
+import asyncio
+import logging as log
+from collections import deque
+from threading import Condition, Lock, Thread, current_thread
+from typing import Any, Callable, Collection, Deque, Dict, List, Optional, Tuple, Union
+
+from bluepy.btle import UUID
+
+from .constants import CharacteristicID, UUIDs
+from .cube import Cube
+from .data import Envelope
+from .eventqueue import OverflowPolicy
+
+# Characteristics the cubes notify
+NOTIFYING_UUIDS = (UUIDs.TOIO_ID, UUIDs.MOTOR, UUIDs.MOTION, UUIDs.BUTTON, UUIDs.BATTERY)
+
+
+class FleetEvent:
+    """Decoded event of a cube with the time it was received and its sequence number, as in Envelope."""
+    __slots__ = ('cube', 'charId', 'event', 'timestamp', 'sequence')
+
+    def __init__(self, cube: Cube, charId: int, event: Any, timestamp: int, sequence: int):
+        self.cube = cube
+        self.charId = charId
+        self.event = event
+        self.timestamp = timestamp
+        self.sequence = sequence
+
+    def __str__(self):
+        return str(dict(cube=self.cube.name, charId=CharacteristicID(self.charId).name, event=self.event,
+                        timestamp=self.timestamp, sequence=self.sequence))
+
+
+class Subscription:
+    """Events of the bus matching a topic, queued for one consumer.
+
+    A subscription is iterated over either on a thread (for e in subscription) or in a
+    coroutine (async for e in subscription), and the iteration ends when it is closed. Up to
+    capacity events are kept; beyond that the oldest ones are dropped unless the policy is
+    NEVER_DROP.
+    """
+
+    def __init__(self, bus: 'EventBus', cubes: Optional[Collection[Union[Cube, str]]] = None,
+                 types: Optional[Tuple[type, ...]] = None, characteristics: Optional[Collection[CharacteristicID]] = None,
+                 capacity: int = 1024, policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST):
+        self.bus = bus
+        self.cubes = frozenset(c.name if isinstance(c, Cube) else c for c in cubes) if cubes is not None else None
+        self.types = tuple(types) if types is not None else None
+        self.characteristics = frozenset(characteristics) if characteristics is not None else None
+        self.capacity = capacity
+        self.policy = policy
+        self.events: Deque[FleetEvent] = deque()
+        self.condition = Condition()
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = list()
+        self.closed = False
+        self.droppedCount = 0
+        self.thread: Optional[Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def matches(self, e: FleetEvent) -> bool:
+        return (self.cubes is None or e.cube.name in self.cubes) and \
+            (self.characteristics is None or e.charId in self.characteristics) and \
+            (self.types is None or isinstance(e.event, self.types))
+
+    def put(self, e: FleetEvent):
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.events) >= self.capacity:
+                if self.policy == OverflowPolicy.DROP_NEW:
+                    self.droppedCount += 1
+                    return
+                if self.policy == OverflowPolicy.DROP_OLDEST:
+                    self.events.popleft()
+                    self.droppedCount += 1
+            self.events.append(e)
+            self._wakeup()
+
+    def _wakeup(self):
+        self.condition.notify_all()
+        (waiters, self.waiters) = (self.waiters, list())
+        for (loop, future) in waiters:
+            if loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(_setDone, future)
+            except RuntimeError:
+                pass  # the loop was closed meanwhile
+
+    def get(self, timeout: Optional[float] = None) -> Optional[FleetEvent]:
+        """Pops the next event, waiting for it up to timeout seconds, or returns None on timeout or when closed."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.events or self.closed, timeout):
+                return None
+            return self.events.popleft() if self.events else None
+
+    def close(self):
+        """Ends the iteration once the queued events are consumed, and unsubscribes from the bus."""
+        self.bus.unsubscribe(self)
+        with self.condition:
+            self.closed = True
+            self._wakeup()
+        if self.thread and self.thread is not current_thread():
+            self.thread.join()
+            self.thread = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> FleetEvent:
+        e = self.get()
+        if e is None:
+            raise StopIteration()
+        return e
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> FleetEvent:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.events:
+                    return self.events.popleft()
+                if self.closed:
+                    raise StopAsyncIteration()
+                future = loop.create_future()
+                waiter = (loop, future)
+                self.waiters.append(waiter)
+            try:
+                await future
+            finally:
+                # Cancelled or timed out consumers must not be woken up
+                with self.condition:
+                    if waiter in self.waiters:
+                        self.waiters.remove(waiter)
+
+    def _consume(self, callback: Callable[[FleetEvent], Any]):
+        for e in self:
+            try:
+                callback(e)
+            except Exception:
+                log.exception("Failed to handle %s", e)
+
+
+def _setDone(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class EventBus:
+    """Merges the events of many cubes into one stream in the order they are received.
+
+    The events reach the subscriptions from the threads receiving them, and each subscription
+    is consumed by one thread, one coroutine or one callback, so the application state needs
+    no locking across the cubes.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.subscriptions: List[Subscription] = list()
+        self.attachments: Dict[int, List[Tuple[UUID, Callable[[Envelope], Any]]]] = dict()
+
+    def attach(self, cube: Cube, uuids: Collection[UUID] = NOTIFYING_UUIDS):
+        """Publishes the notifications of the characteristics of the cube (which still need to be enabled)."""
+        listeners = list()
+        for uuid in uuids:
+            def listener(envelope: Envelope, cube=cube):
+                self.publish(FleetEvent(cube, envelope.charId, envelope.event, envelope.timestamp, envelope.sequence))
+
+            cube.addListener(uuid, listener, envelope=True)
+            listeners.append((uuid, listener))
+        with self.lock:
+            self.attachments.setdefault(id(cube), list()).extend(listeners)
+
+    def detach(self, cube: Cube, uuids: Optional[Collection[UUID]] = None):
+        """Stops publishing the notifications of the characteristics of the cube (default: {None}, all)."""
+        with self.lock:
+            listeners = self.attachments.pop(id(cube), list())
+            if uuids is not None:
+                kept = [x for x in listeners if x[0] not in uuids]
+                listeners = [x for x in listeners if x[0] in uuids]
+                if kept:
+                    self.attachments[id(cube)] = kept
+        for (uuid, listener) in listeners:
+            cube.removeListener(uuid, listener, envelope=True)
+
+    def publish(self, e: FleetEvent):
+        # Under the lock so that every subscription sees the events of all the cubes in the same order
+        with self.lock:
+            for s in self.subscriptions:
+                if s.matches(e):
+                    s.put(e)
+
+    def subscribe(self, cubes: Optional[Collection[Union[Cube, str]]] = None, types: Optional[Tuple[type, ...]] = None,
+                  characteristics: Optional[Collection[CharacteristicID]] = None,
+                  callback: Optional[Callable[[FleetEvent], Any]] = None, capacity: int = 1024,
+                  policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST) -> Subscription:
+        """Subscribes to the events matching a topic.
+
+        Keyword Arguments:
+            cubes {Optional[Collection[Union[Cube, str]]]} -- Cubes or their names (default: {None}, all)
+            types {Optional[Tuple[type, ...]]} -- Classes of the events, e.g. (PositionID, Motion) (default: {None}, all)
+            characteristics {Optional[Collection[CharacteristicID]]} -- Characteristics (default: {None}, all)
+            callback {Optional[Callable[[FleetEvent], Any]]} -- Function called with each event on a thread of
+                                                                the subscription (default: {None}, iterate instead)
+            capacity {int} -- Events kept until they are consumed (default: {1024})
+            policy {OverflowPolicy} -- What happens to the events beyond the capacity (default: {DROP_OLDEST})
+
+        Returns:
+            Subscription -- Iterable of FleetEvent, to be closed when done
+        """
+        s = Subscription(self, cubes, types, characteristics, capacity, policy)
+        with self.lock:
+            self.subscriptions = self.subscriptions + [s]
+        if callback:
+            s.thread = Thread(name="EventBus callback", target=s._consume, args=(callback,), daemon=True)
+            s.thread.start()
+        return s
+
+    def unsubscribe(self, s: Subscription):
+        with self.lock:
+            self.subscriptions = [x for x in self.subscriptions if x is not s]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(subscriptions=[dict(depth=len(s), dropped=s.droppedCount) for s in self.subscriptions])
+
+
+def createEventBus(cubes: Collection[Cube], uuids: Collection[UUID] = NOTIFYING_UUIDS) -> EventBus:
+    bus = EventBus()
+    for cube in cubes:
+        bus.attach(cube, uuids)
+    return bus
@@ -0,0 +1,179 @@
+"""Bounded queues handing the notifications of a cube over to worker threads"""
+import logging as log
+from collections import deque
+from enum import Enum
+from threading import Condition, Thread, current_thread
+from time import monotonic_ns
+from typing import Any, Callable, Deque, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+from .constants import CharacteristicID
+from .data import MotorInfoType
+from .stats import NANOS_PER_MILLI, Histogram
+
+# Receives the CharacteristicID, the raw bytes, the receive time and the sequence number
+EventHandlerFunc = Callable[[int, bytes, int, int], Any]
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = 0
+    DROP_NEW = 1
+    # The queue grows beyond its capacity rather than losing the notification
+    NEVER_DROP = 2
+
+
+# Policies by characteristic, or by characteristic and leading byte for the payloads which
+# get a lane of their own apart from the other payloads of the characteristic
+PolicyKey = Union[CharacteristicID, Tuple[CharacteristicID, int]]
+
+# The latest pose, motion, motor speed and battery supersede the older ones, while a button
+# press or a motor control result is seen only once.
+DEFAULT_OVERFLOW_POLICIES: Mapping[PolicyKey, OverflowPolicy] = {
+    CharacteristicID.BUTTON: OverflowPolicy.NEVER_DROP,
+    CharacteristicID.MOTOR: OverflowPolicy.NEVER_DROP,
+    (CharacteristicID.MOTOR, MotorInfoType.SPEED): OverflowPolicy.DROP_OLDEST,
+}
+
+
+class EventQueue:
+    """Queue of the notifications of some characteristics of a cube, drained by a worker thread.
+
+    Putting a notification is a few list operations, so the thread receiving from the BLE link
+    never waits for the listeners. Each characteristic has its own lane of the given capacity
+    with its own overflow policy, and so has each (characteristic, leading byte) given a policy
+    of its own. The worker calls the handler in the order of arrival across the lanes.
+    """
+
+    def __init__(self, handler: EventHandlerFunc, capacity: int = 64,
+                 policies: Optional[Mapping[PolicyKey, OverflowPolicy]] = None,
+                 defaultPolicy: OverflowPolicy = OverflowPolicy.DROP_OLDEST, name: str = "Events"):
+        self.handler = handler
+        self.capacity = capacity
+        policies = DEFAULT_OVERFLOW_POLICIES if policies is None else policies
+        # Lanes 0 to len(CharacteristicID) - 1 are those of the characteristics, followed by the leading bytes
+        self.policies = [policies.get(c, defaultPolicy) for c in CharacteristicID]
+        self.byteLanes: List[Optional[Dict[int, int]]] = [None for _ in CharacteristicID]
+        for (key, policy) in policies.items():
+            if isinstance(key, tuple):
+                (charId, leadingByte) = key
+                if self.byteLanes[charId] is None:
+                    self.byteLanes[charId] = dict()
+                self.byteLanes[charId][leadingByte] = len(self.policies)
+                self.policies.append(policy)
+        self.name = name
+        # Entries are (order, charId, data, timestamp, sequence, putTime)
+        self.lanes: List[Deque[Tuple[int, int, bytes, int, int, int]]] = [deque() for _ in self.policies]
+        self.condition = Condition()
+        self.order = 0
+        self.size = 0
+        self.maxDepth = 0
+        self.droppedCounts = [0 for _ in CharacteristicID]
+        # Nanoseconds from the put to the handler call of each notification
+        self.waitTime = Histogram()
+        self.thread: Optional[Thread] = None
+        self.running = False
+
+    def __len__(self) -> int:
+        return self.size
+
+    def start(self):
+        with self.condition:
+            if self.thread:
+                return
+            t = Thread(name=self.name, target=self._run, daemon=True)
+            self.thread = t
+            self.running = True
+            t.start()
+
+    def stop(self, drain: bool = True):
+        """Stops the worker after it handles the pending notifications, or drops them with drain=False."""
+        t = self.thread
+        if not t:
+            return
+
+        with self.condition:
+            self.running = False
+            if not drain:
+                self._clear()
+            self.condition.notify_all()
+        if t is not current_thread():
+            t.join()
+        self.thread = None
+
+    def put(self, charId: int, data: bytes, timestamp: int, sequence: int):
+        with self.condition:
+            i = charId
+            byteLanes = self.byteLanes[charId]
+            if byteLanes is not None and data:
+                i = byteLanes.get(data[0], charId)
+            lane = self.lanes[i]
+            if len(lane) >= self.capacity:
+                policy = self.policies[i]
+                if policy == OverflowPolicy.DROP_NEW:
+                    self.droppedCounts[charId] += 1
+                    return
+                if policy == OverflowPolicy.DROP_OLDEST:
+                    lane.popleft()
+                    self.size -= 1
+                    self.droppedCounts[charId] += 1
+
+            lane.append((self.order, charId, data, timestamp, sequence, monotonic_ns()))
+            self.order += 1
+            self.size += 1
+            self.maxDepth = max(self.maxDepth, self.size)
+            self.condition.notify()
+
+    def _clear(self):
+        for lane in self.lanes:
+            if lane:
+                self.droppedCounts[lane[0][1]] += len(lane)
+                lane.clear()
+        self.size = 0
+
+    def _pop(self) -> Optional[Tuple[int, int, bytes, int, int, int]]:
+        """Pops the oldest notification of all the lanes, waiting for one while running."""
+        with self.condition:
+            while not self.size:
+                if not self.running:
+                    return None
+                self.condition.wait()
+
+            oldest = None
+            for lane in self.lanes:
+                if lane and (oldest is None or lane[0][0] < oldest[0][0]):
+                    oldest = lane
+            self.size -= 1
+            return oldest.popleft()
+
+    def _run(self):
+        while True:
+            entry = self._pop()
+            if entry is None:
+                return
+
+            (_, charId, data, timestamp, sequence, putTime) = entry
+            self.waitTime.record(monotonic_ns() - putTime)
+            try:
+                self.handler(charId, data, timestamp, sequence)
+            except Exception:
+                log.exception("Failed to handle a notification of %s", CharacteristicID(charId).name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.condition:
+            return dict(depth=self.size, maxDepth=self.maxDepth,
+                        dropped={c.name: self.droppedCounts[c] for c in CharacteristicID if self.droppedCounts[c]},
+                        wait=self.waitTime.snapshot(NANOS_PER_MILLI))
+
+
+def createEventQueues(handler: EventHandlerFunc, perCharacteristic: bool = False, name: str = "Events",
+                      characteristics: Iterable[CharacteristicID] = CharacteristicID,
+                      **kwargs) -> List[Optional[EventQueue]]:
+    """Creates the queues of a cube, indexed by CharacteristicID.
+
+    All the characteristics share a queue and a worker, unless perCharacteristic=True gives each
+    its own so a slow listener of one does not delay the others.
+    """
+    queues: List[Optional[EventQueue]] = [None for _ in CharacteristicID]
+    shared = None if perCharacteristic else EventQueue(handler, name=name, **kwargs)
+    for c in characteristics:
+        queues[c] = shared if shared is not None else EventQueue(handler, name="%s %s" % (name, c.name), **kwargs)
+    return queues
@@ -1,17 +1,133 @@
+import logging as log
 import sys
-from typing import List
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, wait
+from threading import Thread
+from typing import Callable, Dict, List, Optional
 
 from .blepeer import BlePeer
-from .cube import Cube
+from .cube import Cube, Peer
+from .handlecache import HandleCache
+from .reactor import Reactor
 
 
-def createCube(address: str, name: str = None, iface: int = 0) -> Cube:
-    return Cube(BlePeer(address, iface), name if name else address)
+class ConnectResult:
+    def __init__(self, addresses: List[str]):
+        self.addresses = addresses
+        # In the same order as the addresses, None for the cubes failed to connect
+        self.cubes: List[Optional[Cube]] = [None] * len(addresses)
+        self.errors: Dict[str, Exception] = dict()
+        # Seconds spent in each phase (connect, discovery, total) and the number of attempts per address
+        self.timings: Dict[str, Dict[str, float]] = dict()
 
+    def succeeded(self) -> List[Cube]:
+        return [c for c in self.cubes if c]
 
-def createCubesFromFile(addressesFile: str = None, iface: int = 0) -> List[Cube]:
+    def failed(self) -> List[str]:
+        return [a for (a, c) in zip(self.addresses, self.cubes) if not c]
+
+
+class ConnectError(Exception):
+    def __init__(self, result: ConnectResult):
+        super().__init__("Failed to connect to %s" % ", ".join(result.failed()))
+        self.result = result
+
+
+def createCube(address: str, name: str = None, iface: int = 0, reactor: Optional[Reactor] = None,
+               handleCache: Optional[HandleCache] = None) -> Cube:
+    return Cube(BlePeer(address, iface, reactor=reactor, handleCache=handleCache), name if name else address)
+
+
+def _startPeer(createPeer: Callable[[], Peer], address: str) -> Future:
+    # bluepy has no connection timeout, so connect on a separate thread which can be abandoned
+    future: Future = Future()
+
+    def connect():
+        try:
+            future.set_result(createPeer())
+        except Exception as ex:
+            future.set_exception(ex)
+
+    Thread(name="Connection to %s" % address, target=connect, daemon=True).start()
+    return future
+
+
+def connectCubes(addresses: List[str], iface: int = 0, reactor: Optional[Reactor] = None,
+                 maxWorkers: int = 4, timeout: Optional[float] = None,
+                 retries: int = 0, backoff: float = 0.5, handleCache: Optional[HandleCache] = None,
+                 peerFactory: Callable[..., Peer] = BlePeer) -> ConnectResult:
+    """Connects to the cubes concurrently.
+
+    An attempt abandoned on timeout keeps connecting in the background, so the next attempt
+    to the same address waits for it to end rather than racing with it.
+
+    Arguments:
+        addresses {List[str]} -- MAC addresses of the cubes
+
+    Keyword Arguments:
+        maxWorkers {int} -- Number of cubes connected at the same time (default: {4})
+        timeout {Optional[float]} -- Timeout in seconds of each connection attempt (default: {None})
+        retries {int} -- Number of retries after a failed attempt (default: {0})
+        backoff {float} -- Seconds to wait before the first retry, doubled for every retry (default: {0.5})
+        handleCache {Optional[HandleCache]} -- Cache to skip the GATT discovery with (default: {None})
+        peerFactory {Callable[..., Peer]} -- Called as BlePeer(address, iface, reactor=..., handleCache=...)
+                                             (default: {BlePeer})
+
+    Returns:
+        ConnectResult -- Cubes in the same order as the addresses, errors and timings
+    """
+    result = ConnectResult(addresses)
+
+    def connect(i: int, address: str):
+        def createPeer() -> Peer:
+            return peerFactory(address, iface, reactor=reactor, handleCache=handleCache)
+
+        startTime = time.monotonic()
+        abandoned: Optional[Future] = None
+        for attempt in range(retries + 1):
+            if abandoned:
+                wait([abandoned])
+                abandoned = None
+            try:
+                if timeout is None:
+                    peer = createPeer()
+                else:
+                    future = _startPeer(createPeer, address)
+                    try:
+                        peer = future.result(timeout)
+                    except TimeoutError:
+                        future.add_done_callback(lambda f: f.exception() is None and f.result().disconnect())
+                        abandoned = future
+                        raise
+                result.cubes[i] = Cube(peer, "Cube #%d" % (i + 1))
+                result.timings[address] = dict(peer.timings, attempts=attempt + 1, total=time.monotonic() - startTime)
+                return
+            except Exception as ex:
+                log.warning("Failed to connect to %s (attempt %d): %s", address, attempt + 1, repr(ex))
+                result.errors[address] = ex
+                if attempt < retries:
+                    time.sleep(backoff * (2 ** attempt))
+
+        result.timings[address] = dict(attempts=retries + 1, total=time.monotonic() - startTime)
+
+    with ThreadPoolExecutor(max(maxWorkers, 1), "Connector") as executor:
+        for (i, address) in enumerate(addresses):
+            executor.submit(connect, i, address)
+
+    for (address, c) in zip(addresses, result.cubes):
+        if c:
+            result.errors.pop(address, None)
+
+    return result
+
+
+def createCubesFromFile(addressesFile: str = None, iface: int = 0,
+                        reactor: Optional[Reactor] = None, shareReactor: bool = True,
+                        maxWorkers: int = 1, timeout: Optional[float] = None, retries: int = 0,
+                        allowPartial: bool = False,
+                        handleCacheFile: Optional[str] = None) -> List[Cube]:
     def readAddresses(f) -> List[str]:
-        return [s.strip() for s in f.readlines()]
+        return [s.strip() for s in f.readlines() if s.strip()]
 
     if addressesFile:
         with open(addressesFile) as f:
@@ -19,4 +135,24 @@ def createCubesFromFile(addressesFile: str = None, iface: int = 0) -> List[Cube]
     else:
         addresses = readAddresses(sys.stdin)
 
-    return [createCube(a, "Cube #%d" % i, iface) for i, a in enumerate(addresses, 1)]
+    sharedReactor = None
+    if not reactor and shareReactor:
+        # One thread serves all the cubes rather than a thread per cube, until they are all released
+        reactor = sharedReactor = Reactor(closeWhenUnused=True)
+        sharedReactor.acquire()
+
+    handleCache = HandleCache(handleCacheFile) if handleCacheFile else None
+    try:
+        result = connectCubes(addresses, iface, reactor, maxWorkers, timeout, retries, handleCache=handleCache)
+    finally:
+        if sharedReactor:
+            sharedReactor.release()
+    for (address, timing) in result.timings.items():
+        log.debug("Connection to %s: %s", address, timing)
+
+    if result.errors and not allowPartial:
+        for c in result.succeeded():
+            c.release()
+        raise ConnectError(result)
+
+    return result.succeeded()
@@ -0,0 +1,64 @@
+"""On-disk cache of the GATT handles of cubes"""
+import json
+import logging as log
+import os
+from threading import Lock
+from typing import Any, Dict, Optional
+
+DEFAULT_HANDLE_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "tomotoio", "handles.json")
+
+
+class HandleCache:
+    """Characteristic handles of cubes keyed by MAC address, persisted as a JSON file.
+
+    The handles of a cube only change with its firmware, so each entry also records the
+    BLE protocol version reported by the cube. BlePeer asks the cube for that version
+    through the cached handles right after connecting, which works as a validation: an
+    entry whose version does not match (or was never recorded) is rediscovered.
+    """
+
+    def __init__(self, path: str = DEFAULT_HANDLE_CACHE_FILE):
+        self.path = path
+        self.lock = Lock()
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError) as ex:
+            log.warning("Ignored the broken handle cache %s: %s", self.path, ex)
+            return dict()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmpPath = self.path + ".tmp"
+            with open(tmpPath, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmpPath, self.path)
+        except OSError as ex:
+            log.warning("Failed to save the handle cache %s: %s", self.path, ex)
+
+    def get(self, address: str) -> Optional[Dict[str, int]]:
+        """Returns the cached handles of the cube as a map from UUID strings to handles."""
+        with self.lock:
+            entry = self.entries.get(address.lower())
+            return dict(entry["handles"]) if entry else None
+
+    def put(self, address: str, handles: Dict[str, int], protocolVersion: Optional[str] = None):
+        with self.lock:
+            self.entries[address.lower()] = dict(handles=dict(handles), protocolVersion=protocolVersion)
+            self._save()
+
+    def matchesVersion(self, address: str, protocolVersion: str) -> bool:
+        with self.lock:
+            entry = self.entries.get(address.lower())
+            return bool(entry) and entry["protocolVersion"] == protocolVersion
+
+    def invalidate(self, address: str):
+        with self.lock:
+            if self.entries.pop(address.lower(), None) is not None:
+                self._save()
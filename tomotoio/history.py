@@ -0,0 +1,194 @@
+"""Fixed-capacity pose history with velocity estimation"""
+from array import array
+from typing import Optional, Tuple
+
+from .geo import angleDiff
+
+Pose = Tuple[float, float, float, float]
+
+
+class SlidingExtremum:
+    """Maximum (or minimum) of the last window values pushed, in amortized O(1).
+
+    This is a monotonic queue kept in preallocated arrays used as a ring, so pushing a
+    value never allocates.
+    """
+
+    def __init__(self, window: int, isMax: bool = True):
+        self.window = window
+        self.isMax = isMax
+        self.indices = array('q', bytes(8 * window))
+        self.values = array('d', bytes(8 * window))
+        self.clear()
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+        self.count = 0
+
+    def push(self, value: float):
+        index = self.count
+        self.count += 1
+
+        # Drop the values that can never be the extremum again
+        while self.size:
+            back = (self.head + self.size - 1) % self.window
+            v = self.values[back]
+            if (v <= value) if self.isMax else (v >= value):
+                self.size -= 1
+            else:
+                break
+
+        if self.size and self.indices[self.head] <= index - self.window:
+            self.head = (self.head + 1) % self.window
+            self.size -= 1
+
+        tail = (self.head + self.size) % self.window
+        self.indices[tail] = index
+        self.values[tail] = value
+        self.size += 1
+
+    def value(self) -> Optional[float]:
+        return self.values[self.head] if self.size else None
+
+
+class PoseHistory:
+    """Ring buffer of the last poses (t, x, y, angle) of a cube.
+
+    The poses are kept in preallocated arrays, so appending is O(1) and does not allocate.
+    Angles are unwrapped as they are appended, so the angular velocity is continuous across
+    0 and 360 degrees. The extent of the positions over the last extentWindow poses is
+    maintained incrementally for stall detection.
+    """
+
+    def __init__(self, capacity: int = 64, extentWindow: Optional[int] = None):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.xs = array('d', bytes(8 * capacity))
+        self.ys = array('d', bytes(8 * capacity))
+        self.angles = array('d', bytes(8 * capacity))
+        self.extentWindow = extentWindow if extentWindow else capacity
+        self.extremums = [SlidingExtremum(self.extentWindow, isMax) for isMax in (False, True, False, True)]
+        self.clear()
+
+    def clear(self):
+        self.head = 0  # index of the next slot to write
+        self.size = 0
+        self.sinceClear = 0
+        for e in self.extremums:
+            e.clear()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, t: float, x: float, y: float, angle: float):
+        if self.size:
+            last = (self.head - 1) % self.capacity
+            angle = self.angles[last] + angleDiff(angle - self.angles[last])
+
+        i = self.head
+        self.times[i] = t
+        self.xs[i] = x
+        self.ys[i] = y
+        self.angles[i] = angle
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.sinceClear += 1
+
+        (minX, maxX, minY, maxY) = self.extremums
+        minX.push(x)
+        maxX.push(x)
+        minY.push(y)
+        maxY.push(y)
+
+    def _slot(self, i: int) -> int:
+        """Returns the slot of the i-th pose, where 0 is the oldest one kept and -1 the latest."""
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("pose index out of range")
+        return (self.head - self.size + i) % self.capacity
+
+    def __getitem__(self, i: int) -> Pose:
+        s = self._slot(i)
+        return (self.times[s], self.xs[s], self.ys[s], self.angles[s] % 360)
+
+    def latest(self) -> Optional[Pose]:
+        return self[-1] if self.size else None
+
+    def extent(self) -> Optional[Tuple[float, float]]:
+        """Returns the width and height of the bounding box of the last extentWindow positions."""
+        if not self.size:
+            return None
+        (minX, maxX, minY, maxY) = self.extremums
+        return (maxX.value() - minX.value(), maxY.value() - minY.value())
+
+    def isStalled(self, threshold: float) -> bool:
+        """Tells if the last extentWindow positions all stayed within the threshold."""
+        if self.sinceClear < self.extentWindow:
+            return False
+        (w, h) = self.extent()
+        return w < threshold and h < threshold
+
+    def _fit(self, start: int, end: int) -> Optional[Tuple[float, float, float, float]]:
+        """Least squares slopes of x, y and angle over the poses [start, end), with their mean time."""
+        n = end - start
+        if n < 2:
+            return None
+
+        t0 = self.times[self._slot(start)]
+        (st, stt, sx, stx, sy, sty, sa, sta) = (0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        for i in range(start, end):
+            s = self._slot(i)
+            t = self.times[s] - t0
+            (x, y, a) = (self.xs[s], self.ys[s], self.angles[s])
+            st += t
+            stt += t * t
+            sx += x
+            stx += t * x
+            sy += y
+            sty += t * y
+            sa += a
+            sta += t * a
+
+        d = n * stt - st * st
+        if d <= 0:
+            return None
+        return ((n * stx - st * sx) / d, (n * sty - st * sy) / d, (n * sta - st * sa) / d, t0 + st / n)
+
+    def _windowStart(self, window: float) -> int:
+        latest = self.times[self._slot(-1)]
+        start = self.size - 1
+        while start > 0 and latest - self.times[self._slot(start - 1)] <= window:
+            start -= 1
+        return start
+
+    def velocity(self, window: float = 0.1) -> Optional[Tuple[float, float, float]]:
+        """Estimates the velocity from the poses of the last window seconds.
+
+        Arguments:
+            window {float} -- Seconds of history to fit
+
+        Returns:
+            Optional[Tuple[float, float, float]] -- X and Y velocity in mat units per second and angular
+                                                    velocity in degrees per second (clockwise positive),
+                                                    or None if there are less than two poses in the window
+        """
+        if not self.size:
+            return None
+        fit = self._fit(self._windowStart(window), self.size)
+        return fit[:3] if fit else None
+
+    def acceleration(self, window: float = 0.2) -> Optional[Tuple[float, float]]:
+        """Estimates the X and Y acceleration in mat units per second squared from the last window seconds,
+        by comparing the velocity of its older and newer halves."""
+        if not self.size:
+            return None
+        start = self._windowStart(window)
+        middle = (start + self.size) // 2
+        older = self._fit(start, middle)
+        newer = self._fit(middle, self.size)
+        if not older or not newer or newer[3] <= older[3]:
+            return None
+        dt = newer[3] - older[3]
+        return ((newer[0] - older[0]) / dt, (newer[1] - older[1]) / dt)
@@ -0,0 +1,37 @@
+"""Differential drive model of the cube"""
+from math import cos, degrees, radians, sin
+from typing import Tuple
+
+MILLIS_PER_UNIT = 560.0 / 410.0
+AXLE_TRACK_UNITS = 26.6 / MILLIS_PER_UNIT
+
+# Rough wheel speed in millimeters per second for a motor speed value of 1
+MILLIS_PER_SECOND_PER_SPEED = 2.04
+UNITS_PER_SECOND_PER_SPEED = MILLIS_PER_SECOND_PER_SPEED / MILLIS_PER_UNIT
+
+
+def advancePose(x: float, y: float, angle: float, left: float, right: float, dt: float) -> Tuple[float, float, float]:
+    """Moves a pose along the arc the wheels drive for the given time.
+
+    Arguments:
+        x {float} -- X in mat units
+        y {float} -- Y in mat units
+        angle {float} -- Angle in degrees
+        left {float} -- Left wheel speed in mat units per second
+        right {float} -- Right wheel speed in mat units per second
+        dt {float} -- Seconds
+
+    Returns:
+        Tuple[float, float, float] -- Advanced X, Y and angle (in [0, 360))
+    """
+    v = (left + right) / 2
+    # The angle increments clockwise as Y grows downward, so a faster left wheel turns it positive
+    omega = (left - right) / AXLE_TRACK_UNITS
+    a0 = radians(angle)
+    da = omega * dt
+    if abs(da) < 1e-6:
+        (x, y) = (x + v * cos(a0) * dt, y + v * sin(a0) * dt)
+    else:
+        r = v / omega
+        (x, y) = (x + r * (sin(a0 + da) - sin(a0)), y - r * (cos(a0 + da) - cos(a0)))
+    return (x, y, (angle + degrees(da)) % 360)
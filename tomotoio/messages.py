@@ -1,7 +1,7 @@
 """Decoder/encoder functions for Toio BLE communication messages"""
 
-from struct import pack, unpack
-from typing import List, Union
+from struct import Struct, pack, unpack
+from typing import Any, Callable, List, Tuple, Union
 import logging
 
 from .data import *
@@ -11,67 +11,292 @@ def _wrongBytesError(data: bytes) -> ValueError:
     raise ValueError("Wrong bytes '%s'" % data)
 
 
-def decodeToioID(data: bytes) -> Union[PositionID, StandardID, MissedID]:
-    if data[0] == 0x01:
-        (_, x, y, a, sx, sy, sa) = unpack("<BHHHHHH", data)
-        return PositionID(x, y, a, sx, sy, sa)
-    if data[0] == 0x02:
-        (_, value, angle) = unpack("<BIH", data)
-        return StandardID(value, angle)
-    if data[0] == 0x03:
-        return MissedID(ToioIDType.POSITION)
-    if data[0] == 0x04:
-        return MissedID(ToioIDType.STANDARD)
-    if data[0] == 0xff:
-        return MissedID(ToioIDType.INVALID)
+class DecodeBuffer:
+    """Reusable events filled by the decode*Into functions.
+
+    Each decode overwrites the event of its type in place and returns it, so the event
+    is only valid until the next decode of the same type into the same buffer.
+    """
+
+    def __init__(self):
+        self.positionID = PositionID(0, 0, 0, 0, 0, 0)
+        self.standardID = StandardID(0, 0)
+        self.missedID = MissedID(ToioIDType.INVALID)
+        self.motion = Motion(False, False, False, Orientation.INVALID, 0)
+        self.magneticForce = MagneticForce(0, 0, 0, 0, 0)
+        self.tiltEuler = TiltEuler(0, 0, 0)
+        self.tiltQuaternion = TiltQuaternion(0, 0, 0, 0)
+        self.motor = Motor(0, 0, 0)
+        self.motorSpeed = MotorSpeed(0, 0, 0)
+
+
+DecoderFunc = Callable[[bytes], Any]
+DecoderIntoFunc = Callable[[bytes, DecodeBuffer], Any]
 
+
+def _decodeWrongBytes(data: bytes, buffer: DecodeBuffer = None):
     raise _wrongBytesError(data)
 
 
-def decodeMotion(data: bytes) -> Motion:
-    if data[0] == 0x01:
-        if len(data) == 3:
-            (_, isLevel, collision) = unpack("<BBB", data)
-            return Motion(isLevel != 0, collision != 0, False, Orientation.INVALID)
-        else:
-            (_, isLevel, collision, doubleTap, orientation, shake) = unpack("<BBBBBB", data)
-            return Motion(isLevel != 0, collision != 0, doubleTap != 0, Orientation(orientation), shake)
-    if data[0] == 0x02:
-        (_, status, strength, x, y, z) = unpack("<BBBbbb", data)
-        return MagneticForce(status, strength, x, y, z)
-    if data[0] == 0x03:
-        if data[1] == 0x01:
-            (_, angleType, roll, pitch, yaw) = unpack("<BBhhh", data)
-            return TiltEuler(roll, pitch, yaw)
-        if data[1] == 0x02:
-            (_, angleType, w, x, y, z) = unpack("<BBhhhh", data)
-            return TiltQuaternion(w, x, y, z)
+class Codec:
+    """Decoders for the payloads of one characteristic, dispatched by the leading byte."""
+
+    def __init__(self):
+        self.decoders: List[DecoderFunc] = [_decodeWrongBytes] * 256
+        self.intoDecoders: List[DecoderIntoFunc] = [_decodeWrongBytes] * 256
+        # Classes of the events each leading byte decodes to
+        self.eventTypes: List[Tuple[type, ...]] = [()] * 256
+
+    def register(self, leadingByte: int, decoder: DecoderFunc, intoDecoder: DecoderIntoFunc,
+                 eventTypes: Tuple[type, ...] = ()):
+        self.decoders[leadingByte] = decoder
+        self.intoDecoders[leadingByte] = intoDecoder
+        self.eventTypes[leadingByte] = eventTypes
+
+    def leadingBytes(self, eventType: type) -> List[int]:
+        """Returns the leading bytes of the payloads that decode to the event type or its subclasses."""
+        return [b for (b, types) in enumerate(self.eventTypes) if any(issubclass(t, eventType) for t in types)]
+
+    def decode(self, data: bytes) -> Any:
+        return self.decoders[data[0]](data)
+
+    def decodeInto(self, data: bytes, buffer: DecodeBuffer) -> Any:
+        return self.intoDecoders[data[0]](data, buffer)
+
+
+_POSITION_ID = Struct("<BHHHHHH")
+_STANDARD_ID = Struct("<BIH")
+_MOTION = Struct("<BBB")
+_MOTION_EXTENDED = Struct("<BBBBBB")
+_MAGNETIC_FORCE = Struct("<BBBbbb")
+_TILT_EULER = Struct("<BBhhh")
+_TILT_QUATERNION = Struct("<BBhhhh")
+_BUTTON = Struct("<BB")
+_BATTERY = Struct("<B")
+
+_ORIENTATIONS = tuple(Orientation)
+_MISSED_FROM_TYPES = {0x03: ToioIDType.POSITION, 0x04: ToioIDType.STANDARD, 0xff: ToioIDType.INVALID}
+
+
+def _orientation(value: int) -> Orientation:
+    if value < len(_ORIENTATIONS):
+        return _ORIENTATIONS[value]
+    return Orientation(value)  # raises ValueError
+
+
+def _decodePositionID(data: bytes) -> PositionID:
+    (_, x, y, a, sx, sy, sa) = _POSITION_ID.unpack(data)
+    return PositionID(x, y, a, sx, sy, sa)
+
+
+def _decodePositionIDInto(data: bytes, buffer: DecodeBuffer) -> PositionID:
+    e = buffer.positionID
+    (_, e.x, e.y, e.angle, e.sensorX, e.sensorY, e.sensorAngle) = _POSITION_ID.unpack(data)
+    return e
+
+
+def _decodeStandardID(data: bytes) -> StandardID:
+    (_, value, angle) = _STANDARD_ID.unpack(data)
+    return StandardID(value, angle)
+
+
+def _decodeStandardIDInto(data: bytes, buffer: DecodeBuffer) -> StandardID:
+    e = buffer.standardID
+    (_, e.value, e.angle) = _STANDARD_ID.unpack(data)
+    return e
+
+
+def _decodeMissedID(data: bytes) -> MissedID:
+    return MissedID(_MISSED_FROM_TYPES[data[0]])
+
+
+def _decodeMissedIDInto(data: bytes, buffer: DecodeBuffer) -> MissedID:
+    e = buffer.missedID
+    e.fromType = _MISSED_FROM_TYPES[data[0]]
+    return e
+
+
+def _decodeMotion(data: bytes) -> Motion:
+    if len(data) == 3:
+        (_, isLevel, collision) = _MOTION.unpack(data)
+        return Motion(isLevel != 0, collision != 0, False, Orientation.INVALID, 0)
+    else:
+        (_, isLevel, collision, doubleTap, orientation, shake) = _MOTION_EXTENDED.unpack(data)
+        return Motion(isLevel != 0, collision != 0, doubleTap != 0, _orientation(orientation), shake)
+
+
+def _decodeMotionInto(data: bytes, buffer: DecodeBuffer) -> Motion:
+    e = buffer.motion
+    if len(data) == 3:
+        (_, isLevel, collision) = _MOTION.unpack(data)
+        (doubleTap, e.orientation, e.shake) = (0, Orientation.INVALID, 0)
+    else:
+        (_, isLevel, collision, doubleTap, orientation, e.shake) = _MOTION_EXTENDED.unpack(data)
+        e.orientation = _orientation(orientation)
+    (e.isLevel, e.collision, e.doubleTap) = (isLevel != 0, collision != 0, doubleTap != 0)
+    return e
+
+
+def _decodeMagneticForce(data: bytes) -> MagneticForce:
+    (_, status, strength, x, y, z) = _MAGNETIC_FORCE.unpack(data)
+    return MagneticForce(status, strength, x, y, z)
+
+
+def _decodeMagneticForceInto(data: bytes, buffer: DecodeBuffer) -> MagneticForce:
+    e = buffer.magneticForce
+    (_, e.status, e.strength, e.x, e.y, e.z) = _MAGNETIC_FORCE.unpack(data)
+    return e
+
+
+def _decodeTilt(data: bytes) -> Union[TiltEuler, TiltQuaternion]:
+    if data[1] == 0x01:
+        (_, _, roll, pitch, yaw) = _TILT_EULER.unpack(data)
+        return TiltEuler(roll, pitch, yaw)
+    if data[1] == 0x02:
+        (_, _, w, x, y, z) = _TILT_QUATERNION.unpack(data)
+        return TiltQuaternion(w, x, y, z)
+
+    raise _wrongBytesError(data)
+
+
+def _decodeTiltInto(data: bytes, buffer: DecodeBuffer) -> Union[TiltEuler, TiltQuaternion]:
+    if data[1] == 0x01:
+        e = buffer.tiltEuler
+        (_, _, e.roll, e.pitch, e.yaw) = _TILT_EULER.unpack(data)
+        return e
+    if data[1] == 0x02:
+        e = buffer.tiltQuaternion
+        (_, _, e.w, e.x, e.y, e.z) = _TILT_QUATERNION.unpack(data)
+        return e
 
     raise _wrongBytesError(data)
 
 
+def _decodeMotorResponse(data: bytes) -> Motor:
+    if len(data) != 3:
+        raise _wrongBytesError(data)
+    return Motor(data[0], data[1], data[2])
+
+
+def _decodeMotorResponseInto(data: bytes, buffer: DecodeBuffer) -> Motor:
+    if len(data) != 3:
+        raise _wrongBytesError(data)
+    e = buffer.motor
+    (e.type, e.id, e.result) = data
+    return e
+
+
+def _decodeMotorSpeed(data: bytes) -> MotorSpeed:
+    if len(data) != 3:
+        raise _wrongBytesError(data)
+    return MotorSpeed(data[0], data[1], data[2])
+
+
+def _decodeMotorSpeedInto(data: bytes, buffer: DecodeBuffer) -> MotorSpeed:
+    if len(data) != 3:
+        raise _wrongBytesError(data)
+    e = buffer.motorSpeed
+    (e.type, e.left, e.right) = data
+    return e
+
+
+TOIO_ID_CODEC = Codec()
+TOIO_ID_CODEC.register(0x01, _decodePositionID, _decodePositionIDInto, (PositionID,))
+TOIO_ID_CODEC.register(0x02, _decodeStandardID, _decodeStandardIDInto, (StandardID,))
+for _leadingByte in _MISSED_FROM_TYPES:
+    TOIO_ID_CODEC.register(_leadingByte, _decodeMissedID, _decodeMissedIDInto, (MissedID,))
+
+MOTION_CODEC = Codec()
+MOTION_CODEC.register(0x01, _decodeMotion, _decodeMotionInto, (Motion,))
+MOTION_CODEC.register(0x02, _decodeMagneticForce, _decodeMagneticForceInto, (MagneticForce,))
+MOTION_CODEC.register(0x03, _decodeTilt, _decodeTiltInto, (TiltEuler, TiltQuaternion))
+
+MOTOR_CODEC = Codec()
+for _leadingByte in range(256):
+    MOTOR_CODEC.register(_leadingByte, _decodeMotorResponse, _decodeMotorResponseInto, (Motor,))
+MOTOR_CODEC.register(MotorInfoType.SPEED, _decodeMotorSpeed, _decodeMotorSpeedInto, (MotorSpeed,))
+
+
+def decodeToioID(data: bytes) -> Union[PositionID, StandardID, MissedID]:
+    return TOIO_ID_CODEC.decoders[data[0]](data)
+
+
+def decodeToioIDInto(data: bytes, buffer: DecodeBuffer) -> Union[PositionID, StandardID, MissedID]:
+    return TOIO_ID_CODEC.intoDecoders[data[0]](data, buffer)
+
+
+def decodeMotion(data: bytes) -> Union[Motion, MagneticForce, TiltEuler, TiltQuaternion]:
+    return MOTION_CODEC.decoders[data[0]](data)
+
+
+def decodeMotionInto(data: bytes, buffer: DecodeBuffer) -> Union[Motion, MagneticForce, TiltEuler, TiltQuaternion]:
+    return MOTION_CODEC.intoDecoders[data[0]](data, buffer)
+
+
 def decodeButton(data: bytes) -> bool:
     if data[0] == 0x01:
-        (_, isPressed) = unpack("<BB", data)
+        (_, isPressed) = _BUTTON.unpack(data)
         return isPressed != 0
 
     raise _wrongBytesError(data)
 
 
 def decodeBattery(data: bytes) -> int:
-    return unpack("<B", data)[0]
+    return _BATTERY.unpack(data)[0]
 
 
 def _motorDirection(value: int) -> int:
     return 1 if value >= 0 else 2
 
 def decodeMotor(data: bytes) -> Union[Motor, MotorSpeed]:
-    if len(data) == 3:
-        if data[0] == MotorInfoType.SPEED:
-            return(MotorSpeed(data[0], data[1], data[2]))
-        else:
-            return(Motor(data[0], data[1], data[2]))
-    raise _wrongBytesError(data)
+    return MOTOR_CODEC.decoders[data[0]](data)
+
+
+def decodeMotorInto(data: bytes, buffer: DecodeBuffer) -> Union[Motor, MotorSpeed]:
+    return MOTOR_CODEC.intoDecoders[data[0]](data, buffer)
+
+
+# Encoders of what the cube sends, as opposed to what it receives (for simulated peers and tests)
+
+def encodePositionID(x: int, y: int, angle: int, sensorX: int = None, sensorY: int = None, sensorAngle: int = None) -> bytes:
+    return _POSITION_ID.pack(0x01, x, y, angle,
+                             x if sensorX is None else sensorX,
+                             y if sensorY is None else sensorY,
+                             angle if sensorAngle is None else sensorAngle)
+
+
+def encodeStandardID(value: int, angle: int) -> bytes:
+    return _STANDARD_ID.pack(0x02, value, angle)
+
+
+def encodeMissedID(fromType: ToioIDType = ToioIDType.POSITION) -> bytes:
+    return bytes([{ToioIDType.POSITION: 0x03, ToioIDType.STANDARD: 0x04}.get(fromType, 0xff)])
+
+
+def encodeMotion(isLevel: bool = True, collision: bool = False, doubleTap: bool = False,
+                 orientation: Orientation = Orientation.STRAIGHT_UP, shake: int = 0) -> bytes:
+    return _MOTION_EXTENDED.pack(0x01, int(isLevel), int(collision), int(doubleTap), orientation.value, shake)
+
+
+def encodeButton(isPressed: bool) -> bytes:
+    return _BUTTON.pack(0x01, 0x80 if isPressed else 0)
+
+
+def encodeBattery(level: int) -> bytes:
+    return _BATTERY.pack(level)
+
+
+def encodeMotorResponse(type: int, ctrlid: int, result: int) -> bytes:
+    return bytes([type, ctrlid, result])
+
+
+def encodeMotorSpeed(left: int, right: int) -> bytes:
+    return bytes([MotorInfoType.SPEED, min(left, 255), min(right, 255)])
+
+
+def encodeConfigProtocolVersionResponse(version: str) -> bytes:
+    return bytes([0x81, 0]) + version.encode()
+
 
 def encodeMotor(left: int, right: int, duration: float = 0) -> bytes:
     d = min(int(duration * 100), 255)
@@ -2,14 +2,15 @@ import logging as log
 from enum import IntEnum 
 from math import atan2, cos, degrees, hypot, radians, sin
 from threading import RLock
-from typing import Optional, Tuple, cast
+from typing import Any, Callable, List, Optional, Tuple, cast
 
 from .cube import Cube
-from .data import PositionID
+from .data import Envelope, EstimatedPositionID, MissedID, MotorSpeed, PositionID
 from .geo import *
+from .history import PoseHistory
+from .kinematics import AXLE_TRACK_UNITS, MILLIS_PER_UNIT, UNITS_PER_SECOND_PER_SPEED, advancePose
+from .odometry import Odometry
 
-MILLIS_PER_UNIT = 560.0 / 410.0
-AXLE_TRACK_UNITS = 26.6/ MILLIS_PER_UNIT
 MOTOR_DURATION = 1.5
 
 
@@ -106,10 +107,79 @@ def calcMoveSpeed(distance: float, da: float, currentSpeed: float, maxSpeed: flo
         return (s, r)
 
 
+class PosePredictor:
+    """Extrapolates the pose in a PositionID to the time a motor command sent now takes effect.
+
+    The pose in a notification is already about one connection interval old when it is handled,
+    and a motor command lands about one interval later. The predictor drives the last commanded
+    wheel speeds through the kinematic model for that latency, and blends the result with the
+    velocity estimated from the pose history, which also captures slipping and being pushed.
+    """
+
+    def __init__(self, latency: float = 0.05, commandWeight: float = 0.7, window: float = 0.1):
+        self.latency = latency
+        self.commandWeight = commandWeight
+        self.window = window
+
+    def predict(self, nav: 'NavigatorBase', e: PositionID) -> Tuple[float, float, float]:
+        now = nav.cube.peer.now()
+        # Add the time the notification waited before being handled
+        horizon = self.latency + max(now - nav.lastTimestamp, 0) / 1e9 if nav.lastTimestamp else self.latency
+
+        commanded = None
+        if nav.commandedSpeed:
+            (left, right, until) = nav.commandedSpeed
+            dt = horizon if until is None else min(horizon, max(until - now, 0) / 1e9)
+            k = UNITS_PER_SECOND_PER_SPEED
+            commanded = advancePose(e.x, e.y, e.angle, left * k, right * k, dt)
+
+        observed = None
+        velocity = nav.history.velocity(self.window)
+        if velocity:
+            (vx, vy, va) = velocity
+            observed = (e.x + vx * horizon, e.y + vy * horizon, (e.angle + va * horizon) % 360)
+
+        if commanded and observed:
+            w = self.commandWeight
+            return (commanded[0] * w + observed[0] * (1 - w),
+                    commanded[1] * w + observed[1] * (1 - w),
+                    (commanded[2] + angleDiff(observed[2] - commanded[2]) * (1 - w)) % 360)
+        return commanded or observed or (e.x, e.y, e.angle)
+
+
 class NavigatorBase:
-    def __init__(self, cube: Cube):
+    def __init__(self, cube: Cube, historySize: int = 64, stallWindow: int = 20,
+                 predictor: Optional[PosePredictor] = None, odometry: Optional[Odometry] = None):
         self.cube = cube
         self.mat = Mat()
+        self.lock = RLock()
+        # Receive time of the notification being handled, in nanoseconds of the peer clock
+        self.lastTimestamp = 0
+        # Poses with the receive time in seconds
+        self.history = PoseHistory(historySize, stallWindow)
+        self.predictor = predictor
+        self.odometry = odometry
+        # Wheel speeds of the last motor command and when it expires in the peer clock (None for never)
+        self.commandedSpeed: Optional[Tuple[float, float, Optional[int]]] = None
+
+    def setMotor(self, left: float, right: float, duration: float = 0):
+        if left == 0 and right == 0 and duration <= 0 and self.commandedSpeed == (0, 0, None):
+            # Already stopped, so a completed command does not write the stop again on every step
+            return
+
+        now = self.cube.peer.now()
+        expiry = now + int(duration * 1e9) if duration > 0 else None
+        self.commandedSpeed = (left, right, expiry)
+        if self.odometry:
+            with self.lock:
+                self.odometry.handleCommand(now / 1e9, left, right, duration)
+        self.cube.setMotor(left, right, duration)
+
+    def estimatePose(self, e: PositionID) -> Tuple[float, float, float]:
+        """Returns the pose to steer by: the one in the notification, or its prediction if there is a predictor."""
+        if self.predictor is None:
+            return (e.x, e.y, e.angle)
+        return self.predictor.predict(self, e)
 
 
 class NavigationCommandBase:
@@ -117,9 +187,26 @@ class NavigationCommandBase:
         self.nav = nav
         self.cube = nav.cube
         self.currentSpeed = 0.0
+        self.completionCallbacks: List[Callable[[], Any]] = list()
         self.complete = False
         self.lock = RLock()
 
+    @property
+    def complete(self) -> bool:
+        return self._complete
+
+    @complete.setter
+    def complete(self, value: bool):
+        self._complete = value
+        if value and self.completionCallbacks:
+            (callbacks, self.completionCallbacks) = (self.completionCallbacks, list())
+            for callback in callbacks:
+                callback()
+
+    def whenComplete(self, callback: Callable[[], Any]):
+        """Calls the function once, the next time the command finds its target reached."""
+        self.completionCallbacks.append(callback)
+
     def handleNotification(self, e):
         raise NotImplementedError()
 
@@ -143,11 +230,12 @@ class RotateCommand(NavigationCommandBase):
             if not isinstance(e, PositionID):
                 return
 
-            da = angleDiff(self.targetAngle - cast(PositionID, e).angle)
+            (_, _, angle) = self.nav.estimatePose(cast(PositionID, e))
+            da = angleDiff(self.targetAngle - angle)
             if abs(da) < self.tolerance:
                 self.complete = True
                 self.currentSpeed = 0.0
-                self.cube.setMotor(0, 0)
+                self.nav.setMotor(0, 0)
                 return
             else:
                 self.complete = False
@@ -157,10 +245,10 @@ class RotateCommand(NavigationCommandBase):
 
             if abs(da) < 10 and self.tolerance < 6:
                 # Precise mode (not always working well)
-                self.cube.setMotor(s, -s, 0.02)
+                self.nav.setMotor(s, -s, 0.02)
             else:
                 # Normal mode
-                self.cube.setMotor(s, -s, MOTOR_DURATION)
+                self.nav.setMotor(s, -s, MOTOR_DURATION)
 
 
 class MoveCommand(NavigationCommandBase):
@@ -193,14 +281,15 @@ class MoveCommand(NavigationCommandBase):
             if not isinstance(e, PositionID):
                 return
 
-            v = self.target - Vector(e)
-            da = angleDiff(v.direction() - cast(PositionID, e).angle)
+            (x, y, angle) = self.nav.estimatePose(cast(PositionID, e))
+            v = self.target - Vector(x, y)
+            da = angleDiff(v.direction() - angle)
             distance = v.magnitude()
 
             if distance < self.tolerance:
                 self.complete = True
                 self.currentSpeed = 0.0
-                self.cube.setMotor(0, 0)
+                self.nav.setMotor(0, 0)
                 return
             else:
                 self.complete = False
@@ -214,7 +303,7 @@ class MoveCommand(NavigationCommandBase):
 
                 (left, right) = calcMoveSpeed(distance, da, self.currentSpeed, self.moveSpeed, self.fixedSpeed)
                 self.currentSpeed = min(left, right)
-                self.cube.setMotor(left, right, MOTOR_DURATION)
+                self.nav.setMotor(left, right, MOTOR_DURATION)
             else:
                 # Rotate
                 if abs(da) < self.moveRotateThreshold:
@@ -224,7 +313,7 @@ class MoveCommand(NavigationCommandBase):
 
                 s = calcRotateSpeed(da, self.currentSpeed, self.rotateSpeedFactor)
                 self.currentSpeed = abs(s)
-                self.cube.setMotor(s, -s, MOTOR_DURATION)
+                self.nav.setMotor(s, -s, MOTOR_DURATION)
 
 
 class CircleCommand(NavigationCommandBase):
@@ -257,20 +346,100 @@ class CircleCommand(NavigationCommandBase):
 
 
 class Navigator(NavigatorBase):
-    def __init__(self, cube: Cube):
-        super().__init__(cube)
+    def __init__(self, cube: Cube, historySize: int = 64, stallWindow: int = 20,
+                 predictor: Optional[PosePredictor] = None, odometry: Optional[Odometry] = None):
+        """Creates a navigator.
+
+        With odometry, the navigator keeps running the command on dead-reckoned poses
+        (EstimatedPositionID) while the cube cannot read the mat. They are produced on the
+        MissedID and MotorSpeed notifications, and on tick(), which the application is
+        expected to call periodically from its loop.
+        """
+        super().__init__(cube, historySize, stallWindow, predictor, odometry)
         self.lastPosition: Optional[PositionID] = None
+        # Latest TOIO_ID event including MissedID and the dead-reckoned poses
+        self.lastEvent: Any = None
         self.command: Optional[NavigationCommandBase] = None
+        # Whether a ControlScheduler runs the command instead of the notifications
+        self.scheduled = False
 
-        cube.toioID.addListener(self._handleNotification)
+        # StandardID is not listened to, as the cube cannot be navigated on a card anyway
+        cube.addEventListener(PositionID, self._handlePosition, envelope=True)
+        cube.addEventListener(MissedID, self._handleMissed, envelope=True)
         cube.toioID.enableNotification()
 
-    def _handleNotification(self, e):
-        if isinstance(e, PositionID):
-            self.lastPosition = e
+        if odometry:
+            cube.addEventListener(MotorSpeed, self._handleMotorSpeed, envelope=True)
+            cube.motor.enableNotification()
+            cube.setConfigMotorSpeedNotify(1)
 
-        if self.command:
-            self.command.handleNotification(e)
+    def _dispatch(self, e, timestamp: int):
+        with self.lock:
+            self.lastTimestamp = timestamp
+            self.lastEvent = e
+            if isinstance(e, PositionID):
+                self.lastPosition = e
+                self.history.append(timestamp / 1e9, e.x, e.y, e.angle)
+
+        # Run the command out of the lock so it does not hold up the notifications of this cube
+        command = self.command
+        if command and not self.scheduled:
+            command.handleNotification(e)
+
+    def step(self, maxAge: float = 0.5):
+        """Runs the command once on the latest pose, as the control scheduler does on each tick.
+
+        Nothing is run while the cube is off the mat (unless odometry has an estimate) or when
+        the latest pose is older than maxAge seconds.
+        """
+        self.tick()
+        with self.lock:
+            e = self.lastEvent
+            fresh = self.cube.peer.now() - self.lastTimestamp <= maxAge * 1e9
+
+        command = self.command
+        if command and fresh and isinstance(e, PositionID):
+            command.handleNotification(e)
+
+    def _handlePosition(self, envelope: Envelope):
+        if self.odometry:
+            with self.lock:
+                self.odometry.handlePosition(envelope.timestamp / 1e9, envelope.event)
+        self._dispatch(envelope.event, envelope.timestamp)
+
+    def _handleMissed(self, envelope: Envelope):
+        estimate = None
+        if self.odometry:
+            with self.lock:
+                t = envelope.timestamp / 1e9
+                self.odometry.handleMissed(t)
+                estimate = self.odometry.estimate(t)
+
+        self._dispatch(envelope.event, envelope.timestamp)
+        if estimate:
+            self._dispatch(estimate, envelope.timestamp)
+
+    def _handleMotorSpeed(self, envelope: Envelope):
+        with self.lock:
+            t = envelope.timestamp / 1e9
+            self.odometry.handleMotorSpeed(t, envelope.event)
+            estimate = self.odometry.estimate(t)
+        if estimate:
+            self._dispatch(estimate, envelope.timestamp)
+
+    def tick(self) -> Optional[EstimatedPositionID]:
+        """Updates the pose by dead reckoning if the cube is off the mat, and returns it.
+
+        Unless the navigator is scheduled, the command is also run on the pose."""
+        if not self.odometry:
+            return None
+
+        with self.lock:
+            now = self.cube.peer.now()
+            estimate = self.odometry.estimate(now / 1e9)
+        if estimate:
+            self._dispatch(estimate, now)
+        return estimate
 
     def move(self, targetX: float, targetY: float, tolerance: float, moveRotateThreshold: float = 30, fixedSpeed: bool = False):
         if isinstance(self.command, MoveCommand):
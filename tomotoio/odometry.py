@@ -0,0 +1,97 @@
+"""Dead reckoning of the cube pose while the mat cannot be read"""
+from typing import Optional, Tuple
+
+from .data import EstimatedPositionID, MotorSpeed, PositionID
+from .kinematics import UNITS_PER_SECOND_PER_SPEED, advancePose
+
+
+class Odometry:
+    """Tracks the pose of a cube from its wheel speeds between absolute positions.
+
+    Every PositionID resets the estimate. Between them, the pose is advanced along the arcs
+    driven by the wheels. The speeds come from the MotorSpeed notifications when they are
+    enabled; as those carry no direction, the signs come from the commanded speeds, which are
+    also the fallback when there are no notifications.
+
+    The uncertainty is a heuristic radius in mat units: slipRatio of the distance driven plus
+    driftPerSecond for each second since the last absolute position.
+    """
+
+    def __init__(self, maxGap: float = 1.0, maxUncertainty: float = 30.0,
+                 slipRatio: float = 0.1, driftPerSecond: float = 2.0):
+        self.maxGap = maxGap
+        self.maxUncertainty = maxUncertainty
+        self.slipRatio = slipRatio
+        self.driftPerSecond = driftPerSecond
+        self.pose: Optional[Tuple[float, float, float]] = None
+        self.time = 0.0
+        self.fixTime = 0.0
+        self.distance = 0.0
+        self.isEstimating = False
+        # Signed wheel speed values: commanded, and measured (None until a MotorSpeed arrives)
+        self.commanded = (0.0, 0.0)
+        self.commandExpiry: Optional[float] = None
+        self.measured: Optional[Tuple[int, int]] = None
+
+    def uncertainty(self) -> float:
+        return self.distance * self.slipRatio + (self.time - self.fixTime) * self.driftPerSecond
+
+    def isReliable(self) -> bool:
+        """Tells if the estimate is still good enough to steer by."""
+        return self.pose is not None and self.time - self.fixTime <= self.maxGap and \
+            self.uncertainty() <= self.maxUncertainty
+
+    def _wheelSpeeds(self, t: float) -> Tuple[float, float]:
+        (left, right) = self.commanded
+        if self.measured is not None:
+            (left, right) = (self.measured[0] * (-1 if left < 0 else 1), self.measured[1] * (-1 if right < 0 else 1))
+        elif self.commandExpiry is not None and t >= self.commandExpiry:
+            (left, right) = (0.0, 0.0)
+        return (left * UNITS_PER_SECOND_PER_SPEED, right * UNITS_PER_SECOND_PER_SPEED)
+
+    def advance(self, t: float):
+        """Dead-reckons the pose up to the time t (seconds)."""
+        if self.pose is None or t <= self.time:
+            return
+
+        # Also runs between positions, as the cube has moved on by the time MissedID arrives.
+        # Split at the command expiry so the wheels stop where they did.
+        while t > self.time:
+            end = t
+            if self.commandExpiry is not None and self.time < self.commandExpiry < t:
+                end = self.commandExpiry
+            (left, right) = self._wheelSpeeds(self.time)
+            dt = end - self.time
+            self.pose = advancePose(*self.pose, left, right, dt)
+            self.distance += (abs(left) + abs(right)) / 2 * dt
+            self.time = end
+
+    def handlePosition(self, t: float, e: PositionID):
+        self.pose = (e.x, e.y, e.angle)
+        self.time = t
+        self.fixTime = t
+        self.distance = 0.0
+        self.isEstimating = False
+
+    def handleMissed(self, t: float):
+        self.advance(t)
+        self.isEstimating = self.pose is not None
+
+    def handleMotorSpeed(self, t: float, e: MotorSpeed):
+        self.advance(t)
+        self.measured = (e.left, e.right)
+
+    def handleCommand(self, t: float, left: float, right: float, duration: float = 0):
+        self.advance(t)
+        self.commanded = (left, right)
+        self.commandExpiry = t + duration if duration > 0 else None
+
+    def estimate(self, t: float) -> Optional[EstimatedPositionID]:
+        """Returns the dead-reckoned pose at the time t, or None if it is not estimating or not reliable."""
+        if not self.isEstimating:
+            return None
+        self.advance(t)
+        if not self.isReliable():
+            return None
+        (x, y, angle) = self.pose
+        return EstimatedPositionID(x, y, angle, self.uncertainty())
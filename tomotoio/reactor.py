@@ -0,0 +1,188 @@
+"""Single I/O thread shared by many BLE peers"""
+import logging as log
+import os
+import select
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Lock, Thread, current_thread
+from typing import Any, Callable, Dict, Optional, Set
+
+
+class Reactor:
+    """Multiplexes the notifications and queued operations of many peers on one thread.
+
+    Every registered peer contributes the fd of its bluepy helper to a single epoll set.
+    A peer is expected to provide helperReader (with fileno(), fill() and hasLine()),
+    processHelperLines(), processPendingOperations() and processHelperExit(), which is
+    called once the reactor drops the peer because its helper exited or failed.
+
+    With closeWhenUnused, the reactor closes itself once the last user acquiring it releases it.
+    """
+
+    def __init__(self, name: str = "Reactor", closeWhenUnused: bool = False):
+        self.name = name
+        self.closeWhenUnused = closeWhenUnused
+        self.users = 0
+        self.closed = False
+        self.epoll = select.epoll()
+        self.peers: Dict[int, Any] = dict()
+        self.pendingPeers: Set[Any] = set()
+        self.calls: Queue = Queue()
+        self.lock = Lock()
+        self.thread: Optional[Thread] = None
+        self.running = False
+        (self.wakeupReceiver, self.wakeupSender) = os.pipe()
+        os.set_blocking(self.wakeupSender, False)
+        self.epoll.register(self.wakeupReceiver, select.EPOLLIN)
+
+    def isReactorThread(self) -> bool:
+        return current_thread() is self.thread
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+            t = Thread(name=self.name, target=self._run, daemon=True)
+            self.thread = t
+            self.running = True
+            t.start()
+
+    def stop(self):
+        t = self.thread
+        if not t:
+            return
+
+        self.running = False
+        self.wakeup()
+        if t is not current_thread():
+            t.join()
+        self.thread = None
+
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            unused = self.users <= 0
+        if unused and self.closeWhenUnused:
+            self.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.stop()
+        self.epoll.close()
+        os.close(self.wakeupReceiver)
+        os.close(self.wakeupSender)
+
+    def call(self, func: Callable[[], Any]) -> Any:
+        """Runs the function on the reactor thread and returns its result."""
+        if self.isReactorThread():
+            return func()
+
+        self.start()
+        future: Future = Future()
+        self.calls.put((func, future))
+        self.wakeup()
+        return future.result()
+
+    def register(self, peer: Any):
+        self.call(lambda: self._add(peer))
+
+    def unregister(self, peer: Any):
+        if self.thread:
+            self.call(lambda: self._remove(peer))
+
+    def schedule(self, peer: Any):
+        """Asks the reactor thread to process the pending operations of the peer."""
+        with self.lock:
+            self.pendingPeers.add(peer)
+        self.wakeup()
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeupSender, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is full, so the thread is going to wake up anyway
+
+    def _add(self, peer: Any):
+        fd = peer.helperReader.fileno()
+        self.peers[fd] = peer
+        self.epoll.register(fd, select.EPOLLIN)
+
+    def _remove(self, peer: Any):
+        fd = peer.helperReader.fileno()
+        if self.peers.get(fd) is peer:
+            del self.peers[fd]
+            try:
+                self.epoll.unregister(fd)
+            except OSError:
+                pass  # the fd was closed already, which drops it from the epoll set
+
+    def _processCalls(self):
+        try:
+            while True:
+                (func, future) = self.calls.get(False)
+                try:
+                    future.set_result(func())
+                except Exception as ex:
+                    future.set_exception(ex)
+        except Empty:
+            pass
+
+    def _processPeers(self):
+        with self.lock:
+            pendingPeers = self.pendingPeers
+            self.pendingPeers = set()
+
+        for peer in pendingPeers:
+            try:
+                peer.processPendingOperations()
+            except Exception:
+                log.exception("Failed to process the operations for %s", peer)
+
+        for peer in list(self.peers.values()):
+            try:
+                peer.processHelperLines()
+            except Exception:
+                log.exception("Failed to process the notifications for %s", peer)
+
+    def _hasPendingWork(self) -> bool:
+        return bool(self.pendingPeers) or not self.calls.empty() or \
+            any(peer.helperReader.hasLine() for peer in self.peers.values())
+
+    def _fill(self, peer: Any):
+        try:
+            if peer.helperReader.fill():
+                return
+            log.warning("bluepy-helper for %s exited", peer)
+        except Exception:
+            log.exception("Failed to read the notifications for %s", peer)
+        try:
+            self._remove(peer)
+            peer.processHelperExit()
+        except Exception:
+            log.exception("Failed to unregister %s", peer)
+
+    def _run(self):
+        while self.running:
+            self._processCalls()
+            self._processPeers()
+
+            if not self.running:
+                break
+
+            for (fd, event) in self.epoll.poll(0 if self._hasPendingWork() else -1):
+                if fd == self.wakeupReceiver:
+                    os.read(self.wakeupReceiver, 4096)
+                    continue
+
+                peer = self.peers.get(fd)
+                if peer:
+                    self._fill(peer)
+
+        self._processCalls()
@@ -0,0 +1,116 @@
+"""Fixed-rate control loop for navigators"""
+import logging as log
+from threading import Event, Lock, Thread, current_thread
+from time import monotonic_ns
+from typing import Any, Callable, Dict, List, Optional
+
+from .stats import NANOS_PER_MILLI, Histogram
+
+
+class ControlScheduler:
+    """Steps all the registered navigators at a fixed rate on its own thread.
+
+    A registered navigator only records the poses its cube notifies, and its command is run on
+    the latest of them on each tick, so the control rate does not depend on how often and how
+    regularly the notifications arrive. When a tick overruns its period, the ticks it overlapped
+    are skipped and counted as missed rather than run back to back.
+
+    The lateness of each tick behind its deadline, the jitter of the interval between ticks
+    and the time the ticks take are kept in histograms, in milliseconds in stats().
+    """
+
+    def __init__(self, rate: float = 50, name: str = "Control", maxAge: float = 0.5,
+                 clock: Callable[[], int] = monotonic_ns):
+        self.period = int(1e9 / rate)
+        self.name = name
+        self.maxAge = maxAge
+        # Nanoseconds the deadlines are kept in
+        self.clock = clock
+        self.navigators: List[Any] = list()
+        self.lock = Lock()
+        self.thread: Optional[Thread] = None
+        self.stopping = Event()
+        self.lateness = Histogram()
+        self.jitter = Histogram()
+        self.duration = Histogram()
+        self.ticks = 0
+        self.missed = 0
+
+    def add(self, nav: Any):
+        with self.lock:
+            if nav not in self.navigators:
+                self.navigators = self.navigators + [nav]
+        nav.scheduled = True
+
+    def remove(self, nav: Any):
+        with self.lock:
+            self.navigators = [n for n in self.navigators if n is not nav]
+        nav.scheduled = False
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+            self.stopping.clear()
+            t = Thread(name=self.name, target=self._run, daemon=True)
+            self.thread = t
+            t.start()
+
+    def stop(self):
+        t = self.thread
+        if not t:
+            return
+
+        self.stopping.set()
+        if t is not current_thread():
+            t.join()
+        self.thread = None
+
+    def tick(self):
+        """Steps every navigator once."""
+        for nav in self.navigators:
+            try:
+                nav.step(self.maxAge)
+            except Exception:
+                log.exception("Failed to step a navigator")
+
+    def _run(self):
+        deadline = self.clock()
+        lastStart: Optional[int] = None
+        while not self.stopping.is_set():
+            start = self.clock()
+            self.lateness.record(start - deadline)
+            if lastStart is not None:
+                self.jitter.record(abs(start - lastStart - self.period))
+            lastStart = start
+
+            self.tick()
+            end = self.clock()
+            self.duration.record(end - start)
+            self.ticks += 1
+
+            deadline += self.period
+            if end >= deadline:
+                skipped = (end - deadline) // self.period + 1
+                self.missed += skipped
+                deadline += skipped * self.period
+
+            self._wait((deadline - self.clock()) / 1e9)
+
+    def _wait(self, seconds: float):
+        self.stopping.wait(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(rate=1e9 / self.period,
+                    ticks=self.ticks,
+                    missed=self.missed,
+                    lateness=self.lateness.snapshot(NANOS_PER_MILLI),
+                    jitter=self.jitter.snapshot(NANOS_PER_MILLI),
+                    duration=self.duration.snapshot(NANOS_PER_MILLI))
+
+    def resetStats(self):
+        self.lateness.reset()
+        self.jitter.reset()
+        self.duration.reset()
+        self.ticks = 0
+        self.missed = 0
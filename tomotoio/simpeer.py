@@ -0,0 +1,389 @@
+"""Simulated peer to run cubes without hardware"""
+import heapq
+import logging as log
+from math import radians
+from random import Random
+from struct import Struct
+from threading import RLock, Thread
+from time import sleep
+from typing import Iterable, List, Optional, Tuple
+
+from bluepy.btle import UUID
+
+from .constants import CHARACTERISTIC_IDS, CharacteristicID
+from .cube import Peer, PeerListenerFunc
+from .data import MotorInfoType, MotorResult, ToioIDType
+from .geo import angleDiff, direction
+from .messages import *
+from .kinematics import AXLE_TRACK_UNITS, UNITS_PER_SECOND_PER_SPEED, advancePose
+from .navigator import Mat
+from .targetcontrol import DEFAULT_TARGET_TIMEOUT
+
+TARGET_TOLERANCE = 8.0
+TARGET_ANGLE_TOLERANCE = 5.0
+
+_MOTOR_TARGET = Struct("<BBBBBBBHHH")
+_MOTOR_MULTIPLE_TARGETS_HEADER = Struct("<BBBBBBBB")
+_MOTOR_TARGET_POINT = Struct("<HHH")
+_MOTOR_ACCELERATION = Struct("<BBBHBBBB")
+
+
+class SimTarget:
+    def __init__(self, x: int, y: int, angleType: int, deg: int, ctrlid: int = 0):
+        self.x = x
+        self.y = y
+        self.angleType = angleType
+        self.deg = deg
+        # Control the target was written with, which gets a response once its last target is reached
+        self.ctrlid = ctrlid
+
+
+class SimTargetControl:
+    def __init__(self, responseType: int, ctrlid: int, targets: List[SimTarget],
+                 maxSpeed: int, deadline: float, startAngle: float):
+        self.responseType = responseType
+        self.ctrlid = ctrlid
+        self.targets = targets
+        self.maxSpeed = maxSpeed
+        self.deadline = deadline
+        self.startAngle = startAngle
+
+    def finalAngle(self, target: SimTarget) -> Optional[float]:
+        if target.angleType <= 2:
+            return target.deg
+        if target.angleType <= 4:
+            return self.startAngle + target.deg * (1 if target.angleType == 3 else -1)
+        return None
+
+
+class SimPeer(Peer):
+    """Peer backed by a kinematic model of a cube moving on a mat.
+
+    It decodes the motor commands written by Cube (plain, with target, with multiple targets
+    and with acceleration), integrates a differential drive model, and emits encoded TOIO_ID,
+    MOTOR and MOTION notifications. Notifications can be delayed and dropped to mimic a
+    congested link.
+
+    The simulation runs in its own time. Call step() or run() to advance it from the calling
+    thread (deterministic and as fast as the CPU allows), or start() a thread that advances it
+    at timeScale times the real time. Listeners are called from whichever thread advances it.
+    """
+
+    def __init__(self, x: float = 250, y: float = 250, angle: float = 0, mat: Optional[Mat] = None,
+                 positionInterval: float = 0.01, timeStep: float = 0.005,
+                 latency: float = 0, lossRate: float = 0, seed: Optional[int] = None,
+                 battery: int = 100, protocolVersion: str = "2.3.0",
+                 blindSpots: Iterable[Tuple[float, float, float, float]] = ()):
+        self.x = float(x)
+        self.y = float(y)
+        self.angle = float(angle)
+        self.mat = mat if mat else Mat()
+        self.positionInterval = positionInterval
+        self.timeStep = timeStep
+        self.latency = latency
+        self.lossRate = lossRate
+        self.random = Random(seed)
+        self.battery = battery
+        self.protocolVersion = protocolVersion
+        # Rectangles (left, top, right, bottom) on the mat where the position cannot be read
+        self.blindSpots = list(blindSpots)
+
+        self.time = 0.0
+        self.left = 0.0
+        self.right = 0.0
+        self.motorDeadline: Optional[float] = None
+        self.acceleration: Optional[Tuple[float, float, float, float]] = None
+        self.targetControl: Optional[SimTargetControl] = None
+        self.isPressed = False
+        self.motorSpeedNotify = False
+        self.lastMotorSpeed = (0, 0)
+        self.wasOnMat = self.isOnMat()
+        self.nextPositionTime = 0.0
+        self.lastConfigRequest = b""
+
+        self.listeners: List[PeerListenerFunc] = list()
+        self.notifying = [False for _ in CharacteristicID]
+        self.pendingNotifications: List[Tuple[float, int, int, bytes]] = list()
+        self.notificationCount = 0
+        self.lock = RLock()
+        self.thread: Optional[Thread] = None
+        self.running = False
+
+    # Peer interface
+
+    def disconnect(self):
+        self.stop()
+
+    def read(self, uuid: UUID) -> bytes:
+        charId = CHARACTERISTIC_IDS[uuid]
+        with self.lock:
+            if charId == CharacteristicID.TOIO_ID:
+                return self._encodeToioID()
+            if charId == CharacteristicID.MOTION:
+                return encodeMotion()
+            if charId == CharacteristicID.BUTTON:
+                return encodeButton(self.isPressed)
+            if charId == CharacteristicID.BATTERY:
+                return encodeBattery(self.battery)
+            if charId == CharacteristicID.MOTOR:
+                return encodeMotorSpeed(*self.lastMotorSpeed)
+            if charId == CharacteristicID.CONFIG and self.lastConfigRequest == encodeConfigProtocolVersionRequest():
+                return encodeConfigProtocolVersionResponse(self.protocolVersion)
+            return bytes([0])
+
+    def write(self, uuid: UUID, data: bytes, withResponse: bool = False):
+        charId = CHARACTERISTIC_IDS[uuid]
+        with self.lock:
+            if charId == CharacteristicID.MOTOR:
+                self._writeMotor(data)
+            elif charId == CharacteristicID.CONFIG:
+                self.lastConfigRequest = bytes(data)
+                if data[0] == 0x1c:
+                    self.motorSpeedNotify = data[2] != 0
+
+    def enableNotification(self, uuid: UUID, value: bool = True):
+        charId = CHARACTERISTIC_IDS[uuid]
+        with self.lock:
+            self.notifying[charId] = value
+            if value and charId == CharacteristicID.MOTION:
+                self._notify(charId, encodeMotion())
+
+    def addListener(self, listener: PeerListenerFunc):
+        self.listeners.append(listener)
+
+    def now(self) -> int:
+        # Notifications are stamped with the simulated time, so they stay consistent when it runs faster
+        return int(round(self.time * 1e9))
+
+    # Simulation control
+
+    def isOnMat(self) -> bool:
+        """Tells if the cube can read its position, i.e. it is on the mat and out of the blind spots."""
+        if self.mat.margin(self.x, self.y) < 0:
+            return False
+        return not any(l <= self.x <= r and t <= self.y <= b for (l, t, r, b) in self.blindSpots)
+
+    def setPose(self, x: float, y: float, angle: float):
+        with self.lock:
+            (self.x, self.y, self.angle) = (float(x), float(y), angle % 360)
+
+    def setButton(self, isPressed: bool):
+        with self.lock:
+            self.isPressed = isPressed
+            self._notify(CharacteristicID.BUTTON, encodeButton(isPressed))
+
+    def collide(self):
+        with self.lock:
+            self._notify(CharacteristicID.MOTION, encodeMotion(collision=True))
+
+    def step(self, dt: Optional[float] = None):
+        """Advances the simulation by dt seconds (one time step by default)."""
+        with self.lock:
+            dt = self.timeStep if dt is None else dt
+            self._updateControl(dt)
+            self._integrate(dt)
+            self.time += dt
+            self._emitSensors()
+            self._deliverNotifications()
+
+    def run(self, seconds: float):
+        """Advances the simulation by the given seconds of simulated time."""
+        end = self.time + seconds
+        while self.time < end - 1e-9:
+            self.step(min(self.timeStep, end - self.time))
+
+    def start(self, timeScale: float = 1.0):
+        """Advances the simulation on a thread, timeScale times faster than the real time."""
+        def loop():
+            while self.running:
+                self.step()
+                sleep(self.timeStep / timeScale)
+
+        self.running = True
+        t = Thread(name="Simulation", target=loop)
+        t.setDaemon(True)
+        self.thread = t
+        t.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    # Motor commands
+
+    def _writeMotor(self, data: bytes):
+        commandType = data[0]
+        if commandType in (1, 2):
+            self._cancelTargetControl()
+            self.acceleration = None
+            self.left = self._wheelSpeed(data[2], data[3])
+            self.right = self._wheelSpeed(data[5], data[6])
+            duration = data[7] * 0.01 if commandType == 2 and len(data) > 7 else 0
+            self.motorDeadline = self.time + duration if duration > 0 else None
+        elif commandType == 3:
+            (_, ctrlid, timeout, _, maxSpeed, _, _, x, y, a) = _MOTOR_TARGET.unpack(data)
+            self._startTargetControl(MotorInfoType.WITH_TARGET, ctrlid, timeout, maxSpeed,
+                                     [SimTarget(x, y, a >> 13, a & 0x1fff, ctrlid)], False)
+        elif commandType == 4:
+            (_, ctrlid, timeout, _, maxSpeed, _, _, writeMode) = _MOTOR_MULTIPLE_TARGETS_HEADER.unpack_from(data)
+            targets = list()
+            for offset in range(_MOTOR_MULTIPLE_TARGETS_HEADER.size, len(data) - _MOTOR_TARGET_POINT.size + 1, _MOTOR_TARGET_POINT.size):
+                (x, y, a) = _MOTOR_TARGET_POINT.unpack_from(data, offset)
+                targets.append(SimTarget(x, y, a >> 13, a & 0x1fff, ctrlid))
+            self._startTargetControl(MotorInfoType.WITH_MULTIPLE_TARGETS, ctrlid, timeout, maxSpeed, targets, writeMode == 1)
+        elif commandType == 5:
+            self._cancelTargetControl()
+            (_, speed, accel, turnSpeed, turnDirection, travelDirection, _, duration) = _MOTOR_ACCELERATION.unpack(data)
+            self.acceleration = (speed * (-1 if travelDirection else 1), accel * 10,
+                                 turnSpeed * (-1 if turnDirection else 1), 0)
+            self.motorDeadline = self.time + duration * 0.01 if duration > 0 else None
+        else:
+            log.debug("Ignored unknown motor command %s", data)
+
+    @staticmethod
+    def _wheelSpeed(motorDirection: int, speed: int) -> float:
+        return float(speed if motorDirection == 1 else -speed)
+
+    def _startTargetControl(self, responseType: int, ctrlid: int, timeout: int, maxSpeed: int,
+                            targets: List[SimTarget], add: bool):
+        control = self.targetControl
+        if add and control and control.responseType == responseType:
+            control.targets.extend(targets)
+            control.ctrlid = ctrlid
+            return
+
+        self._cancelTargetControl()
+        self.acceleration = None
+        self.motorDeadline = None
+        self.targetControl = SimTargetControl(responseType, ctrlid, targets, maxSpeed,
+                                              self.time + (timeout if timeout else DEFAULT_TARGET_TIMEOUT), self.angle)
+
+    def _finishTargetControl(self, result: MotorResult):
+        control = self.targetControl
+        self.targetControl = None
+        (self.left, self.right) = (0.0, 0.0)
+        if control:
+            # Every control still having targets gets the result, the last one even without
+            ctrlids = list(dict.fromkeys(t.ctrlid for t in control.targets)) or [control.ctrlid]
+            for ctrlid in ctrlids:
+                self._notify(CharacteristicID.MOTOR, encodeMotorResponse(control.responseType, ctrlid, result))
+
+    def _cancelTargetControl(self):
+        if self.targetControl:
+            self._finishTargetControl(MotorResult.OTHER_CONTROL_ACCEPTED)
+
+    # Physics
+
+    def _updateControl(self, dt: float):
+        if self.motorDeadline is not None and self.time >= self.motorDeadline:
+            self.motorDeadline = None
+            self.acceleration = None
+            (self.left, self.right) = (0.0, 0.0)
+
+        if self.acceleration:
+            (speed, accel, turnSpeed, current) = self.acceleration
+            current = min(current + accel * dt, speed) if speed >= current else max(current - accel * dt, speed)
+            if accel == 0:
+                current = speed
+            self.acceleration = (speed, accel, turnSpeed, current)
+            # Turn speed is in degrees per second; convert it to the wheel speed difference
+            diff = radians(turnSpeed) * AXLE_TRACK_UNITS / UNITS_PER_SECOND_PER_SPEED
+            (self.left, self.right) = (current + diff / 2, current - diff / 2)
+
+        control = self.targetControl
+        if not control:
+            return
+        if self.time >= control.deadline:
+            self._finishTargetControl(MotorResult.TIMEOUT)
+            return
+        if not self.isOnMat():
+            self._finishTargetControl(MotorResult.TOIO_ID_MISSED)
+            return
+
+        target = control.targets[0]
+        (dx, dy) = (target.x - self.x, target.y - self.y)
+        distance = (dx * dx + dy * dy) ** 0.5
+        if distance > TARGET_TOLERANCE:
+            da = angleDiff(direction(dx, dy) - self.angle)
+            if abs(da) > 30:
+                s = min(control.maxSpeed, max(abs(da) * 0.5, 10)) * (1 if da >= 0 else -1)
+                (self.left, self.right) = (s, -s)
+            else:
+                s = min(control.maxSpeed, distance + 10)
+                (self.left, self.right) = (s + da * 0.5, s - da * 0.5)
+            return
+
+        finalAngle = control.finalAngle(target)
+        if finalAngle is not None:
+            da = angleDiff(finalAngle - self.angle)
+            if abs(da) > TARGET_ANGLE_TOLERANCE:
+                s = min(control.maxSpeed, max(abs(da) * 0.5, 10)) * (1 if da >= 0 else -1)
+                (self.left, self.right) = (s, -s)
+                return
+
+        reached = control.targets.pop(0)
+        if not control.targets:
+            self._finishTargetControl(MotorResult.SUCCESS)
+        elif control.targets[0].ctrlid != reached.ctrlid:
+            # An added control follows, so the one just completed is reported on its own
+            self._notify(CharacteristicID.MOTOR,
+                         encodeMotorResponse(control.responseType, reached.ctrlid, MotorResult.SUCCESS))
+
+    def _integrate(self, dt: float):
+        k = UNITS_PER_SECOND_PER_SPEED
+        (self.x, self.y, self.angle) = advancePose(self.x, self.y, self.angle, self.left * k, self.right * k, dt)
+
+    # Notifications
+
+    def _encodeToioID(self) -> bytes:
+        if not self.isOnMat():
+            return encodeMissedID(ToioIDType.POSITION)
+        return encodePositionID(int(round(self.x)), int(round(self.y)), int(round(self.angle)) % 360)
+
+    def _emitSensors(self):
+        onMat = self.isOnMat()
+        if onMat and self.time >= self.nextPositionTime:
+            self.nextPositionTime = self.time + self.positionInterval
+            self._notify(CharacteristicID.TOIO_ID, self._encodeToioID())
+        elif not onMat and self.wasOnMat:
+            self._notify(CharacteristicID.TOIO_ID, encodeMissedID(ToioIDType.POSITION))
+        self.wasOnMat = onMat
+
+        motorSpeed = (min(int(abs(self.left)), 255), min(int(abs(self.right)), 255))
+        if motorSpeed != self.lastMotorSpeed:
+            self.lastMotorSpeed = motorSpeed
+            if self.motorSpeedNotify:
+                self._notify(CharacteristicID.MOTOR, encodeMotorSpeed(*motorSpeed))
+
+    def _notify(self, charId: int, data: bytes):
+        if not self.notifying[charId]:
+            return
+        if self.lossRate > 0 and self.random.random() < self.lossRate:
+            return
+
+        self.notificationCount += 1
+        heapq.heappush(self.pendingNotifications, (self.time + self.latency, self.notificationCount, charId, data))
+        if self.latency <= 0:
+            self._deliverNotifications()
+
+    def _deliverNotifications(self):
+        while self.pendingNotifications and self.pendingNotifications[0][0] <= self.time:
+            (_, _, charId, data) = heapq.heappop(self.pendingNotifications)
+            for listener in self.listeners:
+                listener(charId, data)
+
+
+def runSimulation(peers: Iterable[SimPeer], seconds: float, timeStep: Optional[float] = None):
+    """Advances many simulated peers in lockstep by the given seconds of simulated time."""
+    peers = list(peers)
+    if not peers:
+        return
+
+    dt = timeStep if timeStep else peers[0].timeStep
+    end = peers[0].time + seconds
+    while peers[0].time < end - 1e-9:
+        step = min(dt, end - peers[0].time)
+        for p in peers:
+            p.step(step)
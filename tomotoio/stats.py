@@ -0,0 +1,149 @@
+"""Low overhead counters and histograms for the instrumentation of peers and cubes"""
+from array import array
+from time import monotonic_ns
+from typing import Any, Dict, List, Optional
+
+from .constants import CharacteristicID
+
+# Each power of two is split into 2^SUB_BUCKET_BITS buckets, so a recorded value is off by 1/16 at most
+SUB_BUCKET_BITS = 4
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_EXACT_LIMIT = _SUB_BUCKETS * 2
+
+NANOS_PER_MILLI = 1e6
+
+
+class Histogram:
+    """HDR-style histogram of non-negative integers with a preallocated array of buckets.
+
+    Values below 32 are exact; above that, each power of two range has 16 buckets. Values
+    larger than maxValue fall into the last bucket. Recording is a couple of integer
+    operations and no allocation, so it is cheap enough to run on every notification.
+    """
+
+    def __init__(self, maxValue: int = 1 << 40):
+        self.maxValue = maxValue
+        self.buckets = array('Q', bytes(8 * (self._index(maxValue) + 1)))
+        self.reset()
+
+    @staticmethod
+    def _index(value: int) -> int:
+        shift = value.bit_length() - (SUB_BUCKET_BITS + 1)
+        if shift <= 0:
+            return value
+        return shift * _SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def _highestValue(index: int) -> int:
+        if index < _EXACT_LIMIT:
+            return index
+        shift = index // _SUB_BUCKETS - 1
+        return ((index - shift * _SUB_BUCKETS) << shift) + (1 << shift) - 1
+
+    def reset(self):
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        self.buckets[self._index(min(value, self.maxValue))] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, p: float) -> Optional[int]:
+        """Returns the value at the percentile p (0 to 100), or None if nothing was recorded."""
+        if not self.count:
+            return None
+
+        rank = max(int(self.count * p / 100 + 0.5), 1)
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                # The last bucket also holds the values beyond maxValue
+                return self.max if i == len(self.buckets) - 1 else min(self._highestValue(i), self.max)
+        return self.max
+
+    def snapshot(self, scale: float = 1) -> Dict[str, Any]:
+        """Returns the summary of the recorded values, each divided by scale."""
+        def scaled(v: Optional[float]) -> Optional[float]:
+            return None if v is None else v / scale
+
+        return dict(count=self.count,
+                    min=scaled(self.min),
+                    mean=scaled(self.total / self.count if self.count else None),
+                    p50=scaled(self.percentile(50)),
+                    p90=scaled(self.percentile(90)),
+                    p99=scaled(self.percentile(99)),
+                    max=scaled(self.max))
+
+
+class PeerStats:
+    """Traffic statistics of a peer.
+
+    The counters are updated without locks from whichever thread does the I/O, so a snapshot
+    may miss the operations that are in flight while it is taken. Times are in milliseconds
+    in the snapshots.
+    """
+
+    def __init__(self):
+        self.interArrival: List[Histogram] = [Histogram() for _ in CharacteristicID]
+        self.readLatency = Histogram()
+        self.reset()
+
+    def reset(self):
+        self.startTime = monotonic_ns()
+        self.lastArrival: List[Optional[int]] = [None for _ in CharacteristicID]
+        self.notificationCounts = [0 for _ in CharacteristicID]
+        self.notificationBytes = [0 for _ in CharacteristicID]
+        self.writeCount = 0
+        self.writeBytes = 0
+        self.failedWrites = 0
+        self.readCount = 0
+        self.failedReads = 0
+        for h in self.interArrival:
+            h.reset()
+        self.readLatency.reset()
+
+    def recordNotification(self, charId: int, size: int, now: int):
+        last = self.lastArrival[charId]
+        if last is not None:
+            self.interArrival[charId].record(now - last)
+        self.lastArrival[charId] = now
+        self.notificationCounts[charId] += 1
+        self.notificationBytes[charId] += size
+
+    def recordWrite(self, size: int):
+        self.writeCount += 1
+        self.writeBytes += size
+
+    def recordRead(self, latency: int):
+        self.readCount += 1
+        self.readLatency.record(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = max((monotonic_ns() - self.startTime) / 1e9, 1e-9)
+        notifications = dict()
+        for c in CharacteristicID:
+            if self.notificationCounts[c]:
+                notifications[c.name] = dict(count=self.notificationCounts[c],
+                                             bytes=self.notificationBytes[c],
+                                             perSec=self.notificationCounts[c] / elapsed,
+                                             interArrival=self.interArrival[c].snapshot(NANOS_PER_MILLI))
+
+        return dict(
+            elapsed=elapsed,
+            notifications=notifications,
+            writes=dict(count=self.writeCount, bytes=self.writeBytes, failed=self.failedWrites,
+                        perSec=self.writeCount / elapsed, bytesPerSec=self.writeBytes / elapsed),
+            reads=dict(count=self.readCount, failed=self.failedReads,
+                       latency=self.readLatency.snapshot(NANOS_PER_MILLI)),
+        )
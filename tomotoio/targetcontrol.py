@@ -0,0 +1,153 @@
+"""Futures of the motor controls with targets, resolved by their responses"""
+from concurrent.futures import Future, InvalidStateError
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from .data import Motor, MotorResult
+
+# Seconds the cube runs a control with target for when its timeout is 0
+DEFAULT_TARGET_TIMEOUT = 10
+# Seconds a response may take beyond the timeout of its control before the future fails
+RESPONSE_MARGIN = 2.0
+
+CTRL_ID_COUNT = 256
+
+
+class TargetControlTracker:
+    """Keeps the future of each pending motor control with target by its type and control ID.
+
+    A future resolves with the MotorResult of the response of its control. It fails with
+    TimeoutError when the response has not arrived by the timeout of the control plus a
+    margin, which is checked whenever a control is started or a notification arrives. Added
+    controls (AdditionalWriteSettingType.ADD) run one after another, so the deadlines of the
+    pending controls of the same type are pushed back each time one of them completes.
+
+    Reusing the control ID of a pending control cancels its future, and the response the cube
+    sends for the overwritten control (with the same ID) is ignored.
+
+    Cancelling a future calls onCancel, which is expected to stop the motors.
+    """
+
+    def __init__(self, now: Callable[[], int], onCancel: Optional[Callable[[], Any]] = None):
+        self.now = now
+        self.onCancel = onCancel
+        self.lock = Lock()
+        # (future, timeout in seconds, deadline in nanoseconds of the clock) by (MotorInfoType, ctrlid)
+        self.pending: Dict[Tuple[int, int], Tuple[Future, float, int]] = dict()
+        # Number of responses still to come for overwritten controls by (MotorInfoType, ctrlid)
+        self.superseded: Dict[Tuple[int, int], int] = dict()
+        self.nextCtrlId = 0
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def start(self, controlType: int, ctrlid: Optional[int] = None, timeout: int = 0) -> Tuple[int, Future]:
+        """Registers a control about to be written, allocating a free control ID if ctrlid is None.
+
+        Returns:
+            Tuple[int, Future] -- Control ID to write and the future of its MotorResult
+        """
+        now = self.now()
+        self.expire(now)
+
+        seconds = (timeout if timeout else DEFAULT_TARGET_TIMEOUT) + RESPONSE_MARGIN
+        future: Future = Future()
+        with self.lock:
+            if ctrlid is None:
+                ctrlid = self._allocate(controlType)
+            replaced = self.pending.pop((controlType, ctrlid), None)
+            if replaced:
+                self.superseded[(controlType, ctrlid)] = self.superseded.get((controlType, ctrlid), 0) + 1
+            self.pending[(controlType, ctrlid)] = (future, seconds, now + int(seconds * 1e9))
+
+        if replaced:
+            # Nothing can tell the responses of the two controls apart any more
+            replaced[0].cancel()
+        future.add_done_callback(lambda f: self._handleDone(controlType, ctrlid, f))
+        return (ctrlid, future)
+
+    def _allocate(self, controlType: int) -> int:
+        for i in range(CTRL_ID_COUNT):
+            ctrlid = (self.nextCtrlId + i) % CTRL_ID_COUNT
+            if (controlType, ctrlid) not in self.pending and (controlType, ctrlid) not in self.superseded:
+                self.nextCtrlId = (ctrlid + 1) % CTRL_ID_COUNT
+                return ctrlid
+        raise RuntimeError("All the control IDs are in use")
+
+    def _handleDone(self, controlType: int, ctrlid: int, future: Future):
+        with self.lock:
+            entry = self.pending.get((controlType, ctrlid))
+            if entry and entry[0] is future:
+                del self.pending[(controlType, ctrlid)]
+            else:
+                # Replaced by another control with the same ID, which keeps the motors going
+                return
+        if future.cancelled() and self.onCancel:
+            self.onCancel()
+
+    def handleResponse(self, e: Motor):
+        now = self.now()
+        with self.lock:
+            key = (e.type, e.id)
+            skipped = self.superseded.get(key, 0)
+            if skipped:
+                # Response to the overwritten control, not to the pending one
+                if skipped > 1:
+                    self.superseded[key] = skipped - 1
+                else:
+                    del self.superseded[key]
+                entry = None
+            else:
+                entry = self.pending.get(key)
+            if entry:
+                # The next added control of the type starts now
+                for (other, (future, seconds, deadline)) in self.pending.items():
+                    if other[0] == e.type:
+                        self.pending[other] = (future, seconds, max(deadline, now + int(seconds * 1e9)))
+
+        if entry:
+            _resolve(entry[0], _result(e.result))
+        self.expire(now)
+
+    def expire(self, now: Optional[int] = None):
+        """Fails the futures of the controls whose responses are overdue."""
+        if not self.pending:
+            return
+        if now is None:
+            now = self.now()
+        with self.lock:
+            overdue = [(key, future) for (key, (future, _, deadline)) in self.pending.items() if now > deadline]
+            for (key, _) in overdue:
+                # The response to the overwritten control is as late, if it comes at all
+                self.superseded.pop(key, None)
+        for ((controlType, ctrlid), future) in overdue:
+            _fail(future, TimeoutError("No response to the motor control %d of type 0x%x" % (ctrlid, controlType)))
+
+    def cancelAll(self):
+        """Cancels all the futures without calling onCancel, e.g. when the cube is released."""
+        with self.lock:
+            (pending, self.pending) = (self.pending, dict())
+            self.superseded.clear()
+        for (future, _, _) in pending.values():
+            future.cancel()
+
+
+def _result(value: int) -> Union[MotorResult, int]:
+    try:
+        return MotorResult(value)
+    except ValueError:
+        return value
+
+
+def _resolve(future: Future, result: Any):
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass  # cancelled meanwhile
+
+
+def _fail(future: Future, ex: Exception):
+    try:
+        future.set_exception(ex)
+    except InvalidStateError:
+        pass
@@ -0,0 +1,273 @@
+"""Recording and replaying the traffic of peers"""
+import logging as log
+import mmap
+from concurrent.futures import Future
+from enum import IntEnum
+from struct import Struct
+from threading import Lock, Thread, current_thread
+from time import monotonic_ns, sleep
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from bluepy.btle import UUID
+
+from .constants import CHARACTERISTIC_IDS, CharacteristicID
+from .cube import Peer, PeerListenerFunc, TimedPeerListenerFunc
+
+TRACE_MAGIC = b"TOIOTRC1"
+
+# Payload length, monotonic timestamp in nanoseconds, record kind and CharacteristicID
+_RECORD_HEADER = Struct("<IqBB")
+
+
+class RecordKind(IntEnum):
+    READ = 0
+    WRITE = 1
+    WRITE_WITH_RESPONSE = 2
+    NOTIFICATION = 3
+
+
+class TraceRecord(NamedTuple):
+    timestamp: int
+    kind: RecordKind
+    charId: CharacteristicID
+    data: bytes
+
+
+class TraceWriter:
+    """Appends records to a trace file.
+
+    The file starts with TRACE_MAGIC and is followed by records of a fixed size header
+    (see _RECORD_HEADER) and the raw payload. Nothing is ever rewritten, so a trace cut
+    short by a crash is still readable up to its last complete record. The records are
+    flushed every flushRecords records or flushInterval seconds, whichever comes first,
+    so a crash loses at most that much.
+    """
+
+    def __init__(self, path: str, flushRecords: int = 1000, flushInterval: float = 1.0):
+        self.path = path
+        self.flushRecords = flushRecords
+        self.flushInterval = int(flushInterval * 1e9)
+        self.lock = Lock()
+        self.file: BinaryIO = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(TRACE_MAGIC)
+        self.unflushed = 0
+        self.lastFlushTime = monotonic_ns()
+
+    def write(self, kind: RecordKind, charId: int, data: bytes, timestamp: Optional[int] = None):
+        now = monotonic_ns()
+        header = _RECORD_HEADER.pack(len(data), now if timestamp is None else timestamp, kind, charId)
+        with self.lock:
+            self.file.write(header)
+            self.file.write(data)
+            self.unflushed += 1
+            if self.unflushed >= self.flushRecords or now - self.lastFlushTime >= self.flushInterval:
+                self.file.flush()
+                self.unflushed = 0
+                self.lastFlushTime = now
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class TraceReader:
+    """Reads a trace file through mmap, so traces larger than the memory can be scanned."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            size = f.seek(0, 2)
+            self.map: Optional[mmap.mmap] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        if self.map is not None and self.map[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+            self.close()
+            raise ValueError("%s is not a trace file" % path)
+
+    def __iter__(self) -> Iterator[TraceRecord]:
+        return self.records()
+
+    def records(self, kinds: Optional[Iterable[RecordKind]] = None) -> Iterator[TraceRecord]:
+        m = self.map
+        if m is None:
+            return
+
+        kindSet = frozenset(kinds) if kinds is not None else None
+        size = len(m)
+        offset = len(TRACE_MAGIC)
+        while offset + _RECORD_HEADER.size <= size:
+            (length, timestamp, kind, charId) = _RECORD_HEADER.unpack_from(m, offset)
+            start = offset + _RECORD_HEADER.size
+            offset = start + length
+            if offset > size:
+                log.warning("Ignored the truncated record at the end of %s", self.path)
+                return
+            if kindSet is None or kind in kindSet:
+                yield TraceRecord(timestamp, RecordKind(kind), CharacteristicID(charId), m[start:offset])
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class RecordingPeer(Peer):
+    """Peer that records the traffic of another peer into a trace file.
+
+    The notifications keep the receive time and sequence number the other peer stamps them with.
+    """
+
+    def __init__(self, peer: Peer, trace: Union[str, TraceWriter]):
+        self.peer = peer
+        self.writer = trace if isinstance(trace, TraceWriter) else TraceWriter(trace)
+        self.listeners: List[PeerListenerFunc] = list()
+        self.timedListeners: List[TimedPeerListenerFunc] = list()
+        peer.addTimedListener(self._handleNotification)
+
+    def _handleNotification(self, charId: int, data: bytes, timestamp: int, sequence: int):
+        self.writer.write(RecordKind.NOTIFICATION, charId, data, timestamp)
+        for listener in self.listeners:
+            listener(charId, data)
+        for timedListener in self.timedListeners:
+            timedListener(charId, data, timestamp, sequence)
+
+    def disconnect(self):
+        try:
+            self.peer.disconnect()
+        finally:
+            self.writer.close()
+
+    def read(self, uuid: UUID) -> bytes:
+        data = self.peer.read(uuid)
+        self.writer.write(RecordKind.READ, CHARACTERISTIC_IDS[uuid], data, self.peer.now())
+        return data
+
+    def readFuture(self, uuid: UUID) -> Future:
+        def record(future: Future):
+            if not future.cancelled() and future.exception() is None:
+                self.writer.write(RecordKind.READ, CHARACTERISTIC_IDS[uuid], future.result(), self.peer.now())
+
+        future = self.peer.readFuture(uuid)
+        future.add_done_callback(record)
+        return future
+
+    def write(self, uuid: UUID, data: bytes, withResponse: bool = False):
+        self.writer.write(RecordKind.WRITE_WITH_RESPONSE if withResponse else RecordKind.WRITE,
+                          CHARACTERISTIC_IDS[uuid], data, self.peer.now())
+        self.peer.write(uuid, data, withResponse)
+
+    def enableNotification(self, uuid: UUID, value: bool = True):
+        self.peer.enableNotification(uuid, value)
+
+    def addListener(self, listener: PeerListenerFunc):
+        self.listeners.append(listener)
+
+    def addTimedListener(self, listener: TimedPeerListenerFunc):
+        self.timedListeners.append(listener)
+
+    def now(self) -> int:
+        return self.peer.now()
+
+    def setProtocolVersion(self, version: str):
+        self.peer.setProtocolVersion(version)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.peer.stats()
+
+
+class ReplayPeer(Peer):
+    """Peer that plays the notifications of a trace file back to its listeners.
+
+    Notifications keep their recorded spacing divided by speed; with speed=None they are
+    delivered as fast as the listeners take them. Timed listeners receive the recorded
+    timestamps, and now() follows them as the replay proceeds. A read returns the latest value of the
+    characteristic replayed so far (from a recorded read or notification). Writes are not
+    sent anywhere, but are kept in writes so they can be compared with the recorded ones.
+    """
+
+    def __init__(self, trace: Union[str, TraceReader], speed: Optional[float] = 1.0):
+        self.reader = trace if isinstance(trace, TraceReader) else TraceReader(trace)
+        self.speed = speed
+        self.listeners: List[PeerListenerFunc] = list()
+        self.timedListeners: List[TimedPeerListenerFunc] = list()
+        self.sequences = [0 for _ in CharacteristicID]
+        self.clock = 0
+        self.lastValues: List[bytes] = [bytes() for _ in CharacteristicID]
+        self.writes: List[TraceRecord] = list()
+        self.thread: Optional[Thread] = None
+        self.running = False
+
+    def disconnect(self):
+        self.stop()
+        self.reader.close()
+
+    def read(self, uuid: UUID) -> bytes:
+        return self.lastValues[CHARACTERISTIC_IDS[uuid]]
+
+    def write(self, uuid: UUID, data: bytes, withResponse: bool = False):
+        self.writes.append(TraceRecord(self.clock, RecordKind.WRITE_WITH_RESPONSE if withResponse else RecordKind.WRITE,
+                                       CHARACTERISTIC_IDS[uuid], data))
+
+    def enableNotification(self, uuid: UUID, value: bool = True):
+        pass  # the trace already contains only the notifications that were enabled
+
+    def addListener(self, listener: PeerListenerFunc):
+        self.listeners.append(listener)
+
+    def addTimedListener(self, listener: TimedPeerListenerFunc):
+        self.timedListeners.append(listener)
+
+    def now(self) -> int:
+        return self.clock
+
+    def play(self) -> int:
+        """Replays the whole trace on the calling thread and returns the number of notifications."""
+        self.running = True
+        return self._play()
+
+    def _play(self) -> int:
+        count = 0
+        firstTimestamp: Optional[int] = None
+        startTime = monotonic_ns()
+        for record in self.reader.records((RecordKind.READ, RecordKind.NOTIFICATION)):
+            if not self.running:
+                break
+
+            self.clock = record.timestamp
+            self.lastValues[record.charId] = record.data
+            if record.kind != RecordKind.NOTIFICATION:
+                continue
+
+            if self.speed:
+                if firstTimestamp is None:
+                    firstTimestamp = record.timestamp
+                delay = (record.timestamp - firstTimestamp) / self.speed - (monotonic_ns() - startTime)
+                if delay > 0:
+                    sleep(delay / 1e9)
+
+            self.sequences[record.charId] += 1
+            for listener in self.listeners:
+                listener(record.charId, record.data)
+            for timedListener in self.timedListeners:
+                timedListener(record.charId, record.data, record.timestamp, self.sequences[record.charId])
+            count += 1
+
+        self.running = False
+        return count
+
+    def start(self):
+        self.running = True
+        t = Thread(name="Replay of %s" % self.reader.path, target=self._play)
+        t.setDaemon(True)
+        self.thread = t
+        t.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not current_thread():
+            self.thread.join()
+        self.thread = None
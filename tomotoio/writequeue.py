@@ -0,0 +1,151 @@
+"""Pending write scheduler for peers"""
+from collections import deque
+from enum import Enum, IntEnum
+from queue import Empty, Full
+from threading import Condition
+from time import monotonic_ns
+from typing import Any, Deque, Dict, Hashable, Iterable, List, Mapping, Optional, Tuple
+
+from .stats import Histogram
+
+WriteArgs = Tuple[Hashable, bytes, bool]
+
+
+class WritePriority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class QueueFullPolicy(Enum):
+    BLOCK = 0
+    DROP_OLDEST = 1
+    DROP_NEW = 2
+    RAISE = 3
+
+
+class WriteQueue:
+    """Queue of pending characteristic writes.
+
+    Writes without response matching one of the coalescing keys are latest-wins: while a
+    matching write is still pending, the new payload replaces it in place, so the cube
+    receives only the newest intent and receives it as early as the stale one would have.
+    A coalescing key is either a key, matching all its payloads, or a (key, leading byte)
+    pair, matching only the payloads starting with that byte, so that e.g. plain motor
+    writes replace each other while motor controls with targets are all sent. All the
+    other writes are kept in FIFO order within their priority.
+
+    Higher priority writes are always sent first. When the queue is full, a write evicts
+    the oldest pending write of a lower priority if there is one (so a stop command is
+    never held up by a flood of light patterns); otherwise the policy decides. No policy
+    evicts a write of a higher priority.
+    """
+
+    def __init__(self, maxsize: int = 100, coalescingKeys: Iterable[Hashable] = (),
+                 priorities: Optional[Mapping[Hashable, WritePriority]] = None,
+                 policy: QueueFullPolicy = QueueFullPolicy.BLOCK):
+        self.maxsize = maxsize
+        self.coalescingKeys = frozenset(coalescingKeys)
+        self.priorities: Mapping[Hashable, WritePriority] = priorities if priorities else dict()
+        self.policy = policy
+        self.queues: List[Deque[List[Any]]] = [deque() for _ in WritePriority]
+        self.pendingByKey: Dict[Hashable, List[Any]] = dict()
+        self.condition = Condition()
+        self.size = 0
+        self.maxDepth = 0
+        self.coalescedCount = 0
+        self.droppedCount = 0
+        # Nanoseconds from the first put to the get of each write, and the depth seen by each put
+        self.waitTime = Histogram()
+        self.putDepth = Histogram(maxsize if maxsize > 0 else 1 << 20)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def stats(self) -> Dict[str, int]:
+        with self.condition:
+            return dict(depth=self.size, maxDepth=self.maxDepth,
+                        coalesced=self.coalescedCount, dropped=self.droppedCount)
+
+    def put(self, key: Hashable, data: bytes, withResponse: bool = False):
+        priority = self.priorities.get(key, WritePriority.NORMAL)
+        with self.condition:
+            mergeKey = None
+            if not withResponse:
+                if key in self.coalescingKeys:
+                    mergeKey = key
+                elif data and (key, data[0]) in self.coalescingKeys:
+                    mergeKey = (key, data[0])
+            coalescing = mergeKey is not None
+            if coalescing:
+                entry = self.pendingByKey.get(mergeKey)
+                if entry:
+                    entry[1] = data
+                    self.coalescedCount += 1
+                    return
+
+            if not self._makeRoom(priority):
+                return
+
+            if coalescing and mergeKey in self.pendingByKey:
+                # Another matching write got in while we were waiting for room
+                self.pendingByKey[mergeKey][1] = data
+                self.coalescedCount += 1
+                return
+
+            entry = [key, data, withResponse, monotonic_ns(), mergeKey]
+            self.queues[priority].append(entry)
+            self.size += 1
+            self.putDepth.record(self.size)
+            self.maxDepth = max(self.maxDepth, self.size)
+            if coalescing:
+                self.pendingByKey[mergeKey] = entry
+
+    def get(self) -> WriteArgs:
+        """Pops the next write without blocking, or raises queue.Empty."""
+        with self.condition:
+            for q in self.queues:
+                if q:
+                    entry = self._pop(q)
+                    self.waitTime.record(monotonic_ns() - entry[3])
+                    self.condition.notify()
+                    return (entry[0], entry[1], entry[2])
+
+            raise Empty()
+
+    def _pop(self, q: Deque[List[Any]]) -> List[Any]:
+        entry = q.popleft()
+        self.size -= 1
+        if entry[4] is not None and self.pendingByKey.get(entry[4]) is entry:
+            del self.pendingByKey[entry[4]]
+        return entry
+
+    def _makeRoom(self, priority: WritePriority) -> bool:
+        if self.maxsize <= 0 or self.size < self.maxsize:
+            return True
+
+        for lower in reversed(WritePriority):
+            if lower <= priority:
+                break
+            if self.queues[lower]:
+                self._pop(self.queues[lower])
+                self.droppedCount += 1
+                return True
+
+        if self.policy == QueueFullPolicy.BLOCK:
+            while self.size >= self.maxsize:
+                self.condition.wait()
+        elif self.policy == QueueFullPolicy.DROP_OLDEST:
+            # Only the writes of the same priority are left to evict, since the lower ones are gone
+            self.droppedCount += 1
+            if not self.queues[priority]:
+                return False
+            self._pop(self.queues[priority])
+        elif self.policy == QueueFullPolicy.DROP_NEW:
+            self.droppedCount += 1
+            return False
+        else:
+            self.droppedCount += 1
+            raise Full("Write queue is full")
+
+        return True